@@ -0,0 +1,59 @@
+import threading
+import httpx
+from openai import OpenAI
+
+
+class AIClientFactory:
+    """AI客户端工厂 - 基于连接池、keep-alive和可配置超时的httpx客户端创建OpenAI客户端"""
+
+    @staticmethod
+    def http2_available():
+        """是否安装了HTTP/2支持（h2包）"""
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    @classmethod
+    def create(cls, ai_settings):
+        """根据AI配置创建OpenAI客户端
+
+        429/5xx和连接错误由SDK按max_retries自动重试（指数退避加随机抖动）
+        """
+        http = ai_settings.http
+        http_client = httpx.Client(
+            http2=http.http2 and cls.http2_available(),
+            timeout=httpx.Timeout(
+                connect=http.connect_timeout,
+                read=http.read_timeout,
+                write=http.write_timeout,
+                pool=http.pool_timeout
+            ),
+            limits=httpx.Limits(
+                max_connections=http.max_connections,
+                max_keepalive_connections=http.max_keepalive_connections,
+                keepalive_expiry=http.keepalive_expiry
+            )
+        )
+        client = OpenAI(
+            api_key=ai_settings.api_key,
+            base_url=ai_settings.base_url,
+            http_client=http_client,
+            max_retries=http.max_retries
+        )
+        if http.prewarm:
+            cls.prewarm(http_client, str(client.base_url))
+        return client
+
+    @staticmethod
+    def prewarm(http_client, url):
+        """在后台线程中预先完成DNS解析和TLS握手，连接放入连接池供首次对话复用"""
+        def run():
+            try:
+                # 只需建立连接，不关心响应状态
+                http_client.head(url)
+            except Exception as e:
+                print(f"预热AI服务连接失败: {e}")
+
+        threading.Thread(target=run, name="ai-client-prewarm", daemon=True).start()
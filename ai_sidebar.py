@@ -1,25 +1,41 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                                QTextEdit, QLabel, QScrollArea, QFrame, QSizePolicy,
-                               QFileDialog, QGraphicsOpacityEffect)
-from PySide6.QtCore import Qt, QThread, Signal, QTimer, QEvent, QPropertyAnimation, QEasingCurve
+                               QFileDialog, QGraphicsOpacityEffect, QMessageBox)
+from PySide6.QtCore import Qt, QObject, QThread, Signal, QTimer, QEvent, QPropertyAnimation, QEasingCurve
 from PySide6.QtGui import QFont, QCursor, QPixmap
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
-import base64
+import html
 import os
-import re
-import yaml
+import threading
 from style_settings import AISidebarStyles
-from user_operations import UserOperations
+from config_manager import ConfigManager
+from ai_client import AIClientFactory
+from conversation_history import ConversationHistory
+from image_processor import ImagePreprocessor
+from document_cache import DocumentFileCache
+from markdown_view import MarkdownMessageView
+from chat_sessions import ChatSessionStore, ChatSessionDialog
+from response_cache import ResponseCache
+from page_summarizer import PageSummarizer
+from page_extractor import PageExtractor
+from html_cleaner import HTMLTextCleaner
+from page_content_cache import PageContentCache
+from page_presummarizer import PagePresummarizer
+from history_index import HistoryEmbeddingIndex
+from user_operations import UserOperations, CreditBalanceCache
 
 
 class AIWorker(QThread):
     """AI工作线程"""
-    response_chunk = Signal(str, str)  # 流式输出的每个片段和思考过程
-    response_complete = Signal(str, str)  # 完整响应和思考过程
-    error_occurred = Signal(str)
+    response_chunk = Signal(int, str, str)  # 请求ID，流式输出的增量片段：回复内容增量和思考过程增量
+    response_complete = Signal(int, str, str, bool)  # 请求ID，完整响应、思考过程，以及回复是否正常生成（而非错误提示）
+    error_occurred = Signal(int, str)  # 请求ID，错误信息
+    upload_progress = Signal(int, int, int, str)  # 请求ID，文档上传进度：已完成数量、总数、刚完成的文件名
+    cancelled = Signal(int)  # 请求被取消
     
-    def __init__(self, ai_sidebar, message, use_deep_thinking=False, use_search=False, has_images=False, has_documents=False):
+    def __init__(self, ai_sidebar, message, use_deep_thinking=False, use_search=False, has_images=False, has_documents=False,
+                 retrieval_query=None, retrieval_exclude=()):
         super().__init__()
         self.ai_sidebar = ai_sidebar
         self.message = message
@@ -27,8 +43,35 @@ class AIWorker(QThread):
         self.use_search = use_search
         self.has_images = has_images
         self.has_documents = has_documents
+        self.retrieval_query = retrieval_query  # 检索相关历史页面的查询文本，None时不检索
+        self.retrieval_exclude = retrieval_exclude  # 已引用的网页，不再作为历史页面附上
         self.full_response = ""
         self.thought_process = ""
+        self.request_id = 0  # 由AIWorkerPool分配
+        self.timed_out = False
+        self.cancel_event = threading.Event()
+        self.response = None  # 当前的流式响应，取消时关闭
+        self.completed = False  # 回复是否正常生成并加入对话历史
+    
+    def cancel(self):
+        """取消请求：尚未开始的上传不再执行，并关闭正在读取的流式响应"""
+        self.cancel_event.set()
+        response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception as e:
+                print(f"关闭流式响应错误: {e}")
+    
+    def _set_completed(self):
+        """标记回复已正常生成"""
+        self.completed = True
+    
+    def _set_response(self, response):
+        """记录当前的流式响应（请求已取消时立即关闭）"""
+        self.response = response
+        if self.cancel_event.is_set():
+            response.close()
         
     def run(self):
         """线程运行方法"""
@@ -46,27 +89,159 @@ class AIWorker(QThread):
             
             # 使用ai_sidebar中的流式对话方法
             response_generator = self.ai_sidebar._chat_stream_with_thinking(
-                self.message, extra_body, has_images=self.has_images, has_documents=self.has_documents
+                self.message, extra_body, has_images=self.has_images, has_documents=self.has_documents,
+                progress_callback=lambda *args: self.upload_progress.emit(self.request_id, *args),
+                cancel_event=self.cancel_event, response_callback=self._set_response,
+                completed_callback=self._set_completed, retrieval_query=self.retrieval_query,
+                retrieval_exclude=self.retrieval_exclude
             )
             
+            # 只发送增量，界面线程合并后按帧刷新
             for content, reasoning_content in response_generator:
+                if self.cancel_event.is_set():
+                    break
                 if reasoning_content:
                     self.thought_process += reasoning_content
-                    self.response_chunk.emit(self.full_response, self.thought_process)
-                
                 if content:
                     self.full_response += content
-                    self.response_chunk.emit(self.full_response, self.thought_process)
+                if content or reasoning_content:
+                    self.response_chunk.emit(self.request_id, content or "", reasoning_content or "")
             
-            self.response_complete.emit(self.full_response, self.thought_process)
+            if self.timed_out:
+                self.error_occurred.emit(self.request_id, "抱歉，AI服务响应超时，请稍后重试")
+            elif self.cancel_event.is_set():
+                self.cancelled.emit(self.request_id)
+            else:
+                self.response_complete.emit(self.request_id, self.full_response, self.thought_process, self.completed)
         except Exception as e:
             error_msg = f"抱歉，AI服务暂时不可用: {str(e)}"
-            self.error_occurred.emit(error_msg)
+            self.error_occurred.emit(self.request_id, error_msg)
+
+
+class PagePlanLoader(QThread):
+    """页面分段计划线程 - 在后台完成HTML转文本、token计数和分段，避免长网页阻塞界面"""
+    ready = Signal(object)  # 计算结果，失败时为None
+    
+    def __init__(self, function):
+        super().__init__()
+        self.function = function
+    
+    def run(self):
+        """线程运行方法"""
+        try:
+            result = self.function()
+        except Exception as e:
+            print(f"页面分段计划错误: {e}")
+            result = None
+        self.ready.emit(result)
+
+
+class AIWorkerPool(QObject):
+    """AI请求管理 - 为每个请求分配ID，限制同时运行的请求数，支持取消和超时"""
+    request_finished = Signal(int)  # 请求结束（完成、失败、取消或超时）
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.next_request_id = 1
+        self.queue = []  # 等待运行的工作线程
+        self.running = {}  # {请求ID: 工作线程}
+        self.timers = {}  # {请求ID: [首个片段超时定时器, 总超时定时器]}
+    
+    def submit(self, worker):
+        """提交请求，返回请求ID；超过并发上限时排队等待"""
+        worker.request_id = self.next_request_id
+        self.next_request_id += 1
+        # 连接到本对象的方法，保证在界面线程中处理
+        worker.finished.connect(self._on_finished)
+        self.queue.append(worker)
+        self._start_next()
+        return worker.request_id
+    
+    def is_active(self, request_id):
+        """请求是否仍在排队或运行"""
+        return request_id in self.running or any(w.request_id == request_id for w in self.queue)
+    
+    def cancel(self, request_id):
+        """取消请求"""
+        for worker in self.queue:
+            if worker.request_id == request_id:
+                self.queue.remove(worker)
+                worker.cancelled.emit(request_id)
+                self.request_finished.emit(request_id)
+                worker.deleteLater()
+                return
+        worker = self.running.get(request_id)
+        if worker is not None:
+            worker.cancel()
+    
+    def cancel_all(self):
+        """取消所有请求"""
+        for worker in list(self.queue):
+            self.cancel(worker.request_id)
+        for request_id in list(self.running):
+            self.cancel(request_id)
+    
+    def shutdown(self, timeout_ms=3000):
+        """取消所有请求并等待工作线程退出（关闭窗口时调用）"""
+        self.cancel_all()
+        for worker in list(self.running.values()):
+            worker.wait(timeout_ms)
+    
+    def _start_next(self):
+        """在并发上限内启动排队的请求"""
+        ai_settings = ConfigManager.get().ai
+        while self.queue and len(self.running) < ai_settings.max_concurrent_requests:
+            worker = self.queue.pop(0)
+            request_id = worker.request_id
+            self.running[request_id] = worker
+            
+            # 首个片段超时：收到任何片段或上传进度后停止
+            first_chunk_timer = self._create_timer(request_id, ai_settings.first_chunk_timeout)
+            worker.response_chunk.connect(first_chunk_timer.stop)
+            worker.upload_progress.connect(first_chunk_timer.stop)
+            total_timer = self._create_timer(request_id, ai_settings.request_timeout)
+            self.timers[request_id] = [first_chunk_timer, total_timer]
+            worker.start()
+    
+    def _create_timer(self, request_id, seconds):
+        timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.timeout.connect(lambda: self._on_timeout(request_id))
+        timer.start(int(seconds * 1000))
+        return timer
+    
+    def _on_timeout(self, request_id):
+        """请求超时，关闭流式响应"""
+        worker = self.running.get(request_id)
+        if worker is not None:
+            worker.timed_out = True
+            worker.cancel()
+    
+    def _on_finished(self):
+        """工作线程退出后清理并启动下一个请求"""
+        request_id = self.sender().request_id
+        for timer in self.timers.pop(request_id, []):
+            timer.stop()
+            timer.deleteLater()
+        worker = self.running.pop(request_id, None)
+        if worker is not None:
+            worker.deleteLater()
+        self.request_finished.emit(request_id)
+        self._start_next()
 
 
 class AISidebar(QWidget):
     """AI侧边栏组件"""
     
+    UPLOAD_WORKERS = 4  # 文档并行上传的最大线程数
+    KEEP_RECENT_MESSAGES = 2  # 始终保留组件的最近消息数
+    VIRTUALIZE_MARGIN = 1  # 可视区域上下额外保留组件的范围（以可视区域高度为单位）
+    RESUME_DISPLAY_LIMIT = 50  # 恢复会话时显示的最近消息数
+    CLIENT_CLOSE_INTERVAL = 10  # 检查能否关闭替换下来的AI客户端的间隔（秒），也给后台的短请求留出完成时间
+    # 保存到会话存储的消息字段
+    DISPLAY_FIELDS = ('text', 'is_ai', 'has_images', 'image_paths', 'has_documents', 'doc_paths',
+                      'has_webpages', 'webpage_urls', 'use_deep_thinking', 'thought')
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent = parent
@@ -74,7 +249,13 @@ class AISidebar(QWidget):
         # 初始化AI客户端功能
         self._init_ai_client()
         
+        # 后台预取credit余额，使首次对话的余额预检查无需等待数据库
+        user_info = UserOperations.load_user_info()
+        if user_info and user_info['user_id']:
+            CreditBalanceCache.refresh_async(user_info['user_id'])
+        
         self.messages = []  # 存储对话历史
+        self.session_id = None  # 当前会话ID，发送第一条消息时创建
         self.thoughts = []  # 存储思考过程
         self.current_ai_response = None  # 当前AI响应组件
         self.current_thought_content = None  # 当前思考内容组件
@@ -89,7 +270,24 @@ class AISidebar(QWidget):
         self.uploaded_images = []  # 存储上传的图片路径
         self.uploaded_documents = []  # 存储上传的文档路径
         self.cited_webpages = []  # 存储引用的网页URL列表
-        self.cited_webpage_contents = {}  # 存储引用的网页内容 {url: content}
+        self.cited_webpage_contents = {}  # 存储引用的网页内容 {url: {'text', 'plan'（后台生成前为None）, 'label'}}
+        self.plan_loaders = []  # 运行中的分段计划线程，防止被提前回收
+        
+        # AI请求管理：前台对话请求会禁用按钮，页面总结等后台请求可与对话同时进行
+        self.ai_pool = AIWorkerPool(self)
+        self.foreground_request_id = None
+        
+        # 后台预总结停留的页面（需在配置中启用）
+        self.page_presummarizer = PagePresummarizer(self, self)
+        
+        # 浏览历史向量索引，对话时附上相关的历史页面（需在配置中启用）
+        self.history_index = HistoryEmbeddingIndex(lambda: self.client)
+        
+        # 流式输出渲染：片段先缓存，定时器到期时合并为一次重绘
+        self.active_streams = {}  # {请求ID: {'record', 'response', 'thought', 'dirty'}}
+        self.stream_render_timer = QTimer(self)
+        self.stream_render_timer.setSingleShot(True)
+        self.stream_render_timer.timeout.connect(self.render_stream)
         
         self.setup_ui()
         
@@ -98,20 +296,21 @@ class AISidebar(QWidget):
     
     def _init_ai_client(self):
         """初始化AI客户端"""
-        # 从配置文件加载API密钥和基础URL
-        config_path = Path("config.yaml")
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-            ai_config = config['ai']
-            api_key = ai_config['api_key']
-            base_url = ai_config['base_url']
-            self.models_config = config['models']
-        
-        # 初始化OpenAI客户端
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+        # 从共享配置获取API密钥、基础URL和模型配置
+        settings = ConfigManager.get()
+        self.models_config = settings.models
+        
+        # 初始化OpenAI客户端（复用连接池，启动时预热连接）
+        self.client = AIClientFactory.create(settings.ai)
+        
+        # 配置变化后替换下来的客户端，进行中的请求结束后关闭以释放连接池
+        self.retired_clients = []
+        self.client_close_timer = QTimer(self)
+        self.client_close_timer.setInterval(self.CLIENT_CLOSE_INTERVAL * 1000)
+        self.client_close_timer.timeout.connect(self._close_retired_clients)
+        
+        # 配置文件重新加载时更新客户端和模型配置
+        ConfigManager.add_listener(self._on_config_changed)
         
         # 系统提示词
         self.system_prompt = """你是一个名为Mindra AI的浏览器助手。你具有以下特点和能力：
@@ -138,15 +337,90 @@ class AISidebar(QWidget):
 
 请根据以上定位为用户提供最好的服务！"""
         
-        # 对话历史
-        self.conversation_history = [
-            {"role": "system", "content": self.system_prompt}
-        ]
+        # 对话历史（按token预算裁剪后发送给模型）
+        self.conversation_history = ConversationHistory(
+            self.system_prompt,
+            max_messages=settings.history.max_messages,
+            keep_image_turns=settings.history.keep_image_turns
+        )
+    
+    def _on_config_changed(self, old_settings, new_settings):
+        """配置文件变化时更新AI客户端和模型配置"""
+        self.models_config = new_settings.models
+        self.conversation_history.max_messages = new_settings.history.max_messages
+        self.conversation_history.keep_image_turns = new_settings.history.keep_image_turns
+        if old_settings.ai != new_settings.ai:
+            self.retired_clients.append(self.client)
+            self.client = AIClientFactory.create(new_settings.ai)
+            self.client_close_timer.start()
+    
+    def _close_retired_clients(self):
+        """没有进行中的AI请求和后台预总结时关闭替换下来的客户端"""
+        if self.ai_pool.running or self.ai_pool.queue or self.page_presummarizer.in_progress:
+            return
+        self.client_close_timer.stop()
+        for client in self.retired_clients:
+            try:
+                client.close()
+            except Exception as e:
+                print(f"关闭AI客户端错误: {e}")
+        self.retired_clients = []
     
-    def _chat_stream_with_thinking(self, user_message, extra_body=None, has_images=False, has_documents=False):
-        """支持思考过程的流式对话"""
+    def _upload_documents(self, doc_paths, progress_callback=None, cancel_event=None):
+        """并行上传文档并按原顺序返回文件ID；被取消时返回None
+
+        已上传过的相同文档直接使用缓存的文件ID。任一文档上传失败时抛出异常。
+        """
+        total = len(doc_paths)
+        if progress_callback:
+            progress_callback(0, total, "")
+        
+        executor = ThreadPoolExecutor(max_workers=min(self.UPLOAD_WORKERS, total),
+                                      thread_name_prefix="document-upload")
+        futures = {executor.submit(DocumentFileCache.get_file_id, self.client, doc_path): index
+                   for index, doc_path in enumerate(doc_paths)}
+        file_ids = [None] * total
+        pending = set(futures)
+        try:
+            while pending:
+                # 定时检查取消标记
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                for future in done:
+                    index = futures[future]
+                    try:
+                        file_ids[index] = future.result()
+                    except Exception as e:
+                        raise RuntimeError(f"{Path(doc_paths[index]).name}: {e}") from e
+                    if progress_callback:
+                        progress_callback(total - len(pending), total, Path(doc_paths[index]).name)
+        finally:
+            # 取消尚未开始的上传，不等待进行中的上传
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+        return file_ids
+
+    @staticmethod
+    def _related_pages_message(pages):
+        """将检索到的历史页面构建为系统消息"""
+        sections = [f"[{index}] {page['title']}\n{page['url']}\n{page['snippet']}"
+                    for index, page in enumerate(pages, 1)]
+        return {"role": "system",
+                "content": "以下是用户之前浏览过的、可能与问题相关的网页摘录，仅在相关时参考并注明来源网址：\n\n" +
+                           "\n\n".join(sections)}
+
+    def _chat_stream_with_thinking(self, user_message, extra_body=None, has_images=False, has_documents=False,
+                                   progress_callback=None, cancel_event=None, response_callback=None,
+                                   completed_callback=None, retrieval_query=None, retrieval_exclude=()):
+        """支持思考过程的流式对话；回复正常生成后调用completed_callback
+
+        retrieval_query不为空时检索相关的历史页面，作为本次请求的参考资料（不加入对话历史）
+        """
+        session_id = self.session_id
         try:
-            # 检查用户credit余额是否足够
+            # 检查用户credit余额是否足够（内存缓存比较，后台与数据库同步）
             user_info = UserOperations.load_user_info()
             if user_info and user_info['user_id']:
                 # 检查余额是否足够（设置最小阈值0.001）
@@ -156,16 +430,16 @@ class AISidebar(QWidget):
             
             # 处理文档上传的情况
             if has_documents:
-                # 上传所有文档并获取文件ID
-                file_ids = []
-                for doc_path in user_message.get('documents', []):
-                    try:
-                        file_object = self.client.files.create(file=Path(doc_path), purpose="file-extract")
-                        file_ids.append(file_object.id)
-                    except Exception as e:
-                        print(f"上传文档失败 {doc_path}: {e}")
-                        yield f"上传文档失败: {e}", ""
-                        return
+                # 并行上传所有文档并获取文件ID
+                try:
+                    file_ids = self._upload_documents(user_message.get('documents', []),
+                                                      progress_callback, cancel_event)
+                except Exception as e:
+                    print(f"上传文档失败 {e}")
+                    yield f"上传文档失败: {e}", ""
+                    return
+                if file_ids is None:
+                    return
                 
                 # 构建文件ID字符串
                 file_id_content = ",".join([f"fileid://{fid}" for fid in file_ids])
@@ -175,143 +449,163 @@ class AISidebar(QWidget):
                     {"role": "user", "content": user_message.get('text', '')}
                 ]
                 
-                response = self.client.chat.completions.create(
-                    model=self.models_config['text_parsing'],
-                    messages=messages,
-                    stream=True,
-                    temperature=0.7,
-                    max_tokens=2000,
-                    stream_options={"include_usage": True}
-                )
+                try:
+                    response = self.client.chat.completions.create(
+                        model=self.models_config['text_parsing'],
+                        messages=messages,
+                        stream=True,
+                        temperature=0.7,
+                        max_tokens=2000,
+                        stream_options={"include_usage": True}
+                    )
+                except Exception as e:
+                    # 服务端拒绝文件时文件ID已失效，下次重新上传；超时、限流等临时失败保留缓存
+                    if DocumentFileCache.is_file_rejected(e):
+                        for file_id in file_ids:
+                            DocumentFileCache.invalidate(file_id)
+                    raise
+                if response_callback:
+                    response_callback(response)
                 
                 full_response = ""
-                input_tokens = 0
-                output_tokens = 0
+                usage = None
                 
-                for chunk in response:
-                    if chunk.choices and chunk.choices[0].delta:
-                        delta = chunk.choices[0].delta
-                        content = ""
-                        if hasattr(delta, 'content') and delta.content:
-                            content = delta.content
-                            full_response += content
-                        yield content, ""
+                try:
+                    for chunk in response:
+                        if cancel_event is not None and cancel_event.is_set():
+                            response.close()
+                            return
                     
-                    # 检查是否包含 usage（通常在最后一个 chunk）
-                    if hasattr(chunk, 'usage') and chunk.usage is not None:
-                        usage = chunk.usage
-                        input_tokens = usage.prompt_tokens
-                        output_tokens = usage.completion_tokens
+                        if chunk.choices and chunk.choices[0].delta:
+                            delta = chunk.choices[0].delta
+                            content = ""
+                            if hasattr(delta, 'content') and delta.content:
+                                content = delta.content
+                                full_response += content
+                            yield content, ""
+                    
+                        # 检查是否包含 usage（通常在最后一个 chunk）
+                        if hasattr(chunk, 'usage') and chunk.usage is not None:
+                            usage = chunk.usage
+                finally:
+                    # 取消、超时或读取中断时收不到usage，按已发送的消息和已生成的内容估算
+                    self._record_stream_usage(self.models_config['text_parsing'], messages, full_response, usage)
                 
                 # 添加到对话历史
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": user_message.get('text', '')
-                })
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": full_response
-                })
-                
-                # 限制历史长度
-                if len(self.conversation_history) > 20:
-                    self.conversation_history = [
-                        self.conversation_history[0],
-                        *self.conversation_history[-18:]
-                    ]
-                
-                # 记录credit使用情况
-                if input_tokens > 0 or output_tokens > 0:
-                    # 获取用户ID
-                    user_info = UserOperations.load_user_info()
-                    if user_info and user_info['user_id']:
-                        UserOperations.record_credit_usage(user_info['user_id'], self.models_config['text_parsing'], input_tokens, output_tokens)
+                history_messages = [
+                    {"role": "user", "content": user_message.get('text', '')},
+                    {"role": "assistant", "content": full_response}
+                ]
+                self.conversation_history.extend(history_messages)
+                self._save_history_messages(session_id, history_messages)
+                if completed_callback:
+                    completed_callback()
                 
                 return
             
-            # 添加用户消息到历史
-            if has_images and isinstance(user_message, list):
-                # 图片+文本消息
-                self.conversation_history.append({
-                    "role": "user", 
-                    "content": user_message
-                })
-            else:
-                # 纯文本消息
-                self.conversation_history.append({
-                    "role": "user", 
-                    "content": user_message
-                })
+            # 等待图片预处理完成（在工作线程中执行，不阻塞界面）
+            if has_images:
+                user_message = ImagePreprocessor.resolve_content(user_message)
+            
+            # 长网页先用text_parsing模型并行提取各段要点，再由本次对话请求汇总
+            history_content = PageSummarizer.without_pages(user_message)
+            user_message = PageSummarizer.resolve_content(self.client, user_message, progress_callback, cancel_event)
+            if user_message is None:
+                return
+            
+            # 用户消息（图片+文本消息或纯文本消息）；请求完成后与回复一起加入历史，页面内容不写入历史
+            user_entry = {
+                "role": "user", 
+                "content": user_message
+            }
             
             # 根据是否有图片选择模型
-            model_name = self.models_config['image_parsing'] if has_images else self.models_config['daily_conversation']
+            role = 'image_parsing' if has_images else 'daily_conversation'
+            model_name = self.models_config[role]
+            
+            # 只发送token预算内的最近历史
+            token_budget = ConfigManager.get().history.budget_for(role)
+            
+            messages = self.conversation_history.build(token_budget, pending=[user_entry])
+            if retrieval_query:
+                related_pages = self.history_index.search(retrieval_query, exclude_urls=retrieval_exclude)
+                if related_pages:
+                    messages.insert(-1, self._related_pages_message(related_pages))
             
             response = self.client.chat.completions.create(
                 model=model_name,
-                messages=self.conversation_history,
+                messages=messages,
                 stream=True,
                 temperature=0.7,
                 max_tokens=2000,
                 extra_body=extra_body or {},
                 stream_options={"include_usage": True}
             )
+            if response_callback:
+                response_callback(response)
             
             full_response = ""
-            input_tokens = 0
-            output_tokens = 0
+            reasoning = ""
+            usage = None
             
-            for chunk in response:
-                if chunk.choices and chunk.choices[0].delta:
-                    delta = chunk.choices[0].delta
+            try:
+                for chunk in response:
+                    if cancel_event is not None and cancel_event.is_set():
+                        response.close()
+                        return
+                
+                    if chunk.choices and chunk.choices[0].delta:
+                        delta = chunk.choices[0].delta
                     
-                    # 处理思考过程
-                    reasoning_content = ""
-                    if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
-                        reasoning_content = delta.reasoning_content
+                        # 处理思考过程
+                        reasoning_content = ""
+                        if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
+                            reasoning_content = delta.reasoning_content
+                            reasoning += reasoning_content
                     
-                    # 处理响应内容
-                    content = ""
-                    if hasattr(delta, 'content') and delta.content:
-                        content = delta.content
-                        full_response += content
+                        # 处理响应内容
+                        content = ""
+                        if hasattr(delta, 'content') and delta.content:
+                            content = delta.content
+                            full_response += content
                     
-                    yield content, reasoning_content
+                        yield content, reasoning_content
                 
-                # 检查是否包含 usage（通常在最后一个 chunk）
-                if hasattr(chunk, 'usage') and chunk.usage is not None:
-                    usage = chunk.usage
-                    input_tokens = usage.prompt_tokens
-                    output_tokens = usage.completion_tokens
+                    # 检查是否包含 usage（通常在最后一个 chunk）
+                    if hasattr(chunk, 'usage') and chunk.usage is not None:
+                        usage = chunk.usage
+            finally:
+                # 取消、超时或读取中断时收不到usage，按已发送的消息和已生成的内容估算
+                self._record_stream_usage(model_name, messages, full_response + reasoning, usage)
                     
             # 添加到对话历史
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": full_response
-            })
-            
-            # 限制历史长度
-            if len(self.conversation_history) > 20:
-                self.conversation_history = [
-                    self.conversation_history[0],
-                    *self.conversation_history[-18:]
-                ]
-                
-            # 记录credit使用情况
-            if input_tokens > 0 or output_tokens > 0:
-                # 获取用户ID
-                user_info = UserOperations.load_user_info()
-                if user_info and user_info['user_id']:
-                    UserOperations.record_credit_usage(user_info['user_id'], model_name, input_tokens, output_tokens)
+            history_messages = [{"role": "user", "content": history_content},
+                                {"role": "assistant", "content": full_response}]
+            self.conversation_history.extend(history_messages)
+            self._save_history_messages(session_id, history_messages)
+            if completed_callback:
+                completed_callback()
                 
         except Exception as e:
             error_msg = f"抱歉，流式输出失败: {str(e)}"
             yield error_msg, ""
             
+    def _record_stream_usage(self, model_name, messages, output_text, usage):
+        """记录credit使用情况：有usage时按实际用量，否则按发送的消息和已生成的内容估算"""
+        if usage is not None:
+            input_tokens, output_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            estimator = self.conversation_history.estimator
+            input_tokens = sum(estimator.count_message(message) for message in messages)
+            output_tokens = estimator.count_text(output_text)
+        if input_tokens > 0 or output_tokens > 0:
+            user_info = UserOperations.load_user_info()
+            if user_info and user_info['user_id']:
+                UserOperations.record_credit_usage(user_info['user_id'], model_name, input_tokens, output_tokens)
+    
     def clear_history(self):
         """清除对话历史"""
-        self.conversation_history = [
-            {"role": "system", "content": self.system_prompt}
-        ]
+        self.conversation_history.clear()
 
     def setup_ui(self):
         """设置UI布局"""
@@ -338,6 +632,14 @@ class AISidebar(QWidget):
         layout.addWidget(self.chat_scroll, 1)
         self.chat_scroll.verticalScrollBar().actionTriggered.connect(self.on_scrollbar_action)
         
+        # 消息组件按需创建：滚动后更新可视区域附近的消息
+        self.transcript_items = []  # 消息记录，按显示顺序
+        self.virtualize_timer = QTimer(self)
+        self.virtualize_timer.setSingleShot(True)
+        self.virtualize_timer.setInterval(100)
+        self.virtualize_timer.timeout.connect(self.update_virtualization)
+        self.chat_scroll.verticalScrollBar().valueChanged.connect(self.schedule_virtualization)
+        
         # 输入区域
         self.setup_input_area(layout)
         
@@ -420,6 +722,8 @@ class AISidebar(QWidget):
         
     def clear_chat_layout(self):
         """清空聊天布局中的所有内容"""
+        self.transcript_items = []
+        
         # 移除所有子部件
         while self.chat_layout.count() > 0:
             item = self.chat_layout.takeAt(0)
@@ -508,6 +812,13 @@ class AISidebar(QWidget):
         self.clear_btn.clicked.connect(self.on_clear_chat)
         bottom_button_layout.addWidget(self.clear_btn)
         
+        # 历史会话按钮
+        self.sessions_btn = QPushButton("🕘")
+        self.sessions_btn.setToolTip("历史会话")
+        self.sessions_btn.setStyleSheet(AISidebarStyles.get_tool_button_style("#e3f2fd", "#bbdefb"))
+        self.sessions_btn.clicked.connect(self.on_open_sessions)
+        bottom_button_layout.addWidget(self.sessions_btn)
+        
         # 联网搜索按钮
         self.search_toggle_btn = QPushButton("🌐")
         self.search_toggle_btn.setToolTip("联网搜索")
@@ -528,7 +839,7 @@ class AISidebar(QWidget):
         self.send_btn = QPushButton("🚀")
         self.send_btn.setToolTip("发送消息 (Enter)")
         self.send_btn.setStyleSheet(AISidebarStyles.get_send_button_style())
-        self.send_btn.clicked.connect(self.send_message)
+        self.send_btn.clicked.connect(self.on_send_clicked)
         bottom_button_layout.addWidget(self.send_btn)
         
         # 将底部按钮行添加到输入容器布局
@@ -552,8 +863,16 @@ class AISidebar(QWidget):
             
     def on_clear_chat(self):
         """清空聊天记录"""
-        # 清空大模型的对话历史
+        # 取消所有进行中的请求，避免其回复写入新的对话
+        self.ai_pool.cancel_all()
+        self.active_streams.clear()
+        if self.foreground_request_id is not None:
+            self.foreground_request_id = None
+            self.set_buttons_enabled(True)
+        
+        # 清空大模型的对话历史，下一条消息开始新会话（已保存的会话可在历史会话中恢复）
         self.clear_history()
+        self.session_id = None
         
         # 清空消息历史
         self.messages.clear()
@@ -589,8 +908,11 @@ class AISidebar(QWidget):
     def set_buttons_enabled(self, enabled):
         """设置按钮启用状态"""
         self.buttons_enabled = enabled
-        self.send_btn.setEnabled(enabled)
+        # 请求进行时发送按钮变为停止按钮
+        self.send_btn.setText("🚀" if enabled else "⏹️")
+        self.send_btn.setToolTip("发送消息 (Enter)" if enabled else "停止生成")
         self.clear_btn.setEnabled(enabled)
+        self.sessions_btn.setEnabled(enabled)
         
         # 深度思考按钮：只有在启用状态且没有文档时才启用
         if enabled and self.uploaded_documents:
@@ -652,6 +974,13 @@ class AISidebar(QWidget):
         # 调用父类事件处理，防止事件被吞噬
         super(QLabel, arrow).mousePressEvent(event)
                 
+    def on_send_clicked(self):
+        """发送按钮：空闲时发送消息，请求进行时停止生成"""
+        if self.buttons_enabled:
+            self.send_message()
+        else:
+            self.cancel_ai_request()
+    
     def send_message(self):
         """发送消息到AI"""
         if not self.buttons_enabled:
@@ -693,40 +1022,23 @@ class AISidebar(QWidget):
         # 构建发送到AI的消息内容（图片+文本+网页内容）
         content_list = []
         
-        # 添加图片（如果有）
+        # 添加图片（如果有）：图片在后台缩放压缩后按内容哈希存入缓存，消息中只保存句柄
         for img_path in image_paths:
-            # 读取图片并转换为base64
-            try:
-                with open(img_path, 'rb') as f:
-                    img_data = base64.b64encode(f.read()).decode('utf-8')
-                # 获取图片格式
-                ext = img_path.split('.')[-1].lower()
-                if ext == 'jpg':
-                    ext = 'jpeg'
-                mime_type = f"image/{ext}"
-                content_list.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:{mime_type};base64,{img_data}"}
-                })
-            except Exception as e:
-                print(f"读取图片失败: {e}")
-        
-        # 构建文本消息
-        full_message = message if message else ""
-
-        # 添加引用网页的内容（使用实际提取的网页内容）
-        if has_webpages:
-            webpage_contents = []
-            for url in webpage_urls:
-                # 获取存储的网页内容
-                page_content = self.cited_webpage_contents.get(url, "[页面内容未获取]")
-                webpage_contents.append(f"引用网页 [{url}] 的内容：\n{page_content}")
-            if webpage_contents:
-                full_message += "\n\n" + "\n\n".join(webpage_contents)
+            content_list.append(ImagePreprocessor.image_part(img_path))
         
         # 添加文本（如果有）
-        if full_message:
-            content_list.append({"type": "text", "text": full_message})
+        if message:
+            content_list.append({"type": "text", "text": message})
+
+        # 添加引用网页的内容（使用实际提取的网页内容，长网页在发送前分段总结）
+        for url in webpage_urls:
+            entry = self.cited_webpage_contents.get(url)
+            if entry is None:
+                content_list.append({"type": "text", "text": f"引用网页 [{url}] 的内容：\n[页面内容未获取]"})
+            else:
+                # 分段计划尚未完成时发送原文，由工作线程分段
+                content_list.append(PageSummarizer.page_part(f"引用网页 [{url}] 的内容：", entry['plan'],
+                                                             entry['text']))
         
         # 清空输入框、图片和引用的网页
         self.input_field.clear()
@@ -736,7 +1048,8 @@ class AISidebar(QWidget):
         # 使用通用方法处理AI请求
         self._process_ai_request(content_list, display_text, self.use_deep_thinking, self.use_search, 
                                 has_images=has_images, image_paths=image_paths, has_documents=False, doc_paths=None,
-                                has_webpages=has_webpages, webpage_urls=webpage_urls)
+                                has_webpages=has_webpages, webpage_urls=webpage_urls,
+                                retrieval_query=message or None)
         
     def eventFilter(self, obj, event):
         """事件过滤器，处理QTextEdit的键盘事件"""
@@ -753,19 +1066,66 @@ class AISidebar(QWidget):
                     return True
         return super().eventFilter(obj, event)
         
-    def handle_ai_chunk(self, response, thought_process):
-        """处理AI响应片段（流式输出）"""
-        if self.current_ai_response:
-            self.current_ai_response.setText(response)
-            
-            # 更新思考过程（如果启用深度思考）
-            if self.use_deep_thinking and self.current_thought_content:
-                self.current_thought_content.setText(thought_process)
+    def handle_ai_chunk(self, request_id, content, reasoning_content):
+        """处理AI响应片段（流式输出）- 只累积增量，重绘合并到下一帧"""
+        stream = self.active_streams.get(request_id)
+        if stream is None:
+            return
+        stream['response'] += content
+        stream['thought'] += reasoning_content
+        stream['dirty'] = True
+        if not self.stream_render_timer.isActive():
+            self.stream_render_timer.start(ConfigManager.get().ui.stream_render_interval_ms)
+    
+    def render_stream(self):
+        """将各请求累积的流式内容刷新到界面"""
+        updated = False
+        for stream in self.active_streams.values():
+            if not stream['dirty']:
+                continue
+            stream['dirty'] = False
+            record = stream['record']
+            if record['content'] is not None:
+                record['content'].setText(stream['response'])
                 
-            self.scroll_to_bottom()
+                # 更新思考过程（如果启用深度思考）
+                if record['thought_content'] is not None:
+                    record['thought_content'].setText(stream['thought'])
+                updated = True
         
-    def handle_ai_complete(self, response, thought_process):
+        if updated:
+            self.scroll_to_bottom()
+    
+    def _finish_stream(self, request_id, text=None):
+        """请求结束：刷新剩余片段或显示提示文本，并恢复按钮状态"""
+        self.render_stream()
+        stream = self.active_streams.pop(request_id, None)
+        if stream is not None:
+            record = stream['record']
+            record['request_id'] = None
+            if text is not None and record['content'] is not None:
+                record['content'].setText(text)
+            # 显示未闭合代码块中最后的不完整行
+            for view in (record['content'], record['thought_content']):
+                if isinstance(view, MarkdownMessageView):
+                    view.finish()
+        
+        # 前台请求结束后重新启用按钮
+        if request_id == self.foreground_request_id:
+            self.foreground_request_id = None
+            self.set_buttons_enabled(True)
+        return stream
+        
+    def handle_ai_complete(self, request_id, response, thought_process, completed=True):
         """处理AI响应完成"""
+        stream = self.active_streams.get(request_id)
+        if stream is not None:
+            # 立即刷新最后一批片段
+            stream.update(response=response, thought=thought_process, dirty=True)
+        stream = self._finish_stream(request_id)
+        if stream is None:
+            return
+        
         # 存储思考过程
         if thought_process:
             self.thoughts.append(thought_process)
@@ -773,29 +1133,155 @@ class AISidebar(QWidget):
         # 添加到消息历史
         self.messages.append({"role": "assistant", "content": response})
         
-        # 重新启用按钮
-        self.set_buttons_enabled(True)
+        # 缓存正常生成的回复
+        if completed and stream.get('cache_key'):
+            ResponseCache.put(stream['cache_key'], response, thought_process)
+        
+        # 保存到当前会话
+        record = stream['record']
+        record.update(text=response, thought=thought_process)
+        self._save_display_record(record)
         
-    def handle_ai_error(self, error_msg):
+    def handle_upload_progress(self, request_id, completed, total, filename):
+        """显示文档上传或长网页分段总结的进度"""
+        stream = self.active_streams.get(request_id)
+        if stream is None or stream['record']['content'] is None:
+            return
+        label = stream['progress_label']
+        if filename:
+            stream['record']['content'].setText(f"{label} ({completed}/{total})，已完成: {filename}")
+        else:
+            stream['record']['content'].setText(f"{label} (0/{total})...")
+    
+    def handle_ai_cancelled(self, request_id):
+        """处理AI请求取消"""
+        self._finish_stream(request_id, "已取消")
+    
+    def cancel_ai_request(self):
+        """取消正在进行的前台AI请求"""
+        if self.foreground_request_id is not None:
+            self.ai_pool.cancel(self.foreground_request_id)
+    
+    def handle_ai_error(self, request_id, error_msg):
         """处理AI错误"""
         # 显示错误信息
-        if self.current_ai_response:
-            self.current_ai_response.setText(error_msg)
-
-        # 重新启用按钮
-        self.set_buttons_enabled(True)
+        self._finish_stream(request_id, error_msg)
 
     def on_link_clicked(self, url):
         """处理AI消息中的链接点击，在当前浏览器中打开"""
         if self.parent:
             self.parent.create_new_tab(url=url)
 
-    def add_message(self, text="", is_ai=False, has_images=False, image_paths=None, has_documents=False, doc_paths=None, use_deep_thinking=None, has_webpages=False, webpage_urls=None):
-        """添加消息到聊天界面"""
+    def add_message(self, text="", is_ai=False, has_images=False, image_paths=None, has_documents=False, doc_paths=None, use_deep_thinking=None, has_webpages=False, webpage_urls=None, cached_request=None, cached_model=None):
+        """添加消息到聊天界面；cached_request为缓存命中时重新生成所需的请求参数，cached_model为生成缓存回复的模型（与对话模型不同时）"""
         # 如果未指定，使用全局设置
         if use_deep_thinking is None:
             use_deep_thinking = self.use_deep_thinking
         
+        # 消息记录：移出可视区域的消息组件会被释放，之后根据记录重新创建
+        record = {
+            'text': text, 'is_ai': is_ai,
+            'has_images': has_images, 'image_paths': image_paths,
+            'has_documents': has_documents, 'doc_paths': doc_paths,
+            'has_webpages': has_webpages, 'webpage_urls': webpage_urls,
+            'use_deep_thinking': use_deep_thinking,
+            'thought': "", 'thought_visible': True,
+            'row': None, 'placeholder': None, 'content': None, 'thought_content': None,
+            'request_id': None, 'cached_request': cached_request, 'cached_model': cached_model
+        }
+        self._append_record(record, is_current=True)
+        
+        # AI消息在回复完成后保存
+        if not is_ai:
+            self._save_display_record(record)
+        return record
+    
+    def _append_record(self, record, is_current=False):
+        """创建消息组件并添加到聊天布局"""
+        record['row'] = self._create_message_row(record, is_current=is_current)
+        self.transcript_items.append(record)
+        
+        # 添加到聊天布局
+        self.chat_layout.addWidget(record['row'])
+        self.scroll_to_bottom()
+        self.schedule_virtualization()
+    
+    def _save_display_record(self, record):
+        """将界面消息追加到当前会话（首条消息时创建会话）"""
+        try:
+            store = ChatSessionStore.get_instance()
+            if self.session_id is None:
+                title = record['text'].strip().split('\n')[0][:30]
+                self.session_id = store.create_session(title)
+            payload = {key: record[key] for key in self.DISPLAY_FIELDS}
+            store.append(self.session_id, 'display', payload, record['text'])
+        except Exception as e:
+            print(f"保存会话消息错误: {e}")
+    
+    def _save_history_messages(self, session_id, messages):
+        """将对话历史消息追加到会话（在AI工作线程中调用）"""
+        if session_id is None:
+            return
+        try:
+            store = ChatSessionStore.get_instance()
+            for message in messages:
+                store.append(session_id, 'history', message)
+        except Exception as e:
+            print(f"保存对话历史错误: {e}")
+    
+    def on_open_sessions(self):
+        """打开历史会话对话框"""
+        dialog = ChatSessionDialog(self)
+        if dialog.exec() == ChatSessionDialog.Accepted and dialog.selected_session_id:
+            self.resume_session(dialog.selected_session_id)
+    
+    def resume_session(self, session_id):
+        """恢复历史会话：重建对话历史，界面只显示最近的消息"""
+        self.on_clear_chat()
+        
+        try:
+            store = ChatSessionStore.get_instance()
+            history = store.load_messages(session_id, 'history', limit=ConfigManager.get().history.max_messages)
+            total = store.count_messages(session_id, 'display')
+            payloads = store.load_messages(session_id, 'display', limit=self.RESUME_DISPLAY_LIMIT)
+        except Exception as e:
+            print(f"加载会话错误: {e}")
+            return
+        
+        for message in history:
+            self.conversation_history.append(message)
+        
+        self.welcome_shown = False
+        self.clear_chat_layout()
+        if total > len(payloads):
+            hint = QLabel(f"仅显示最近 {len(payloads)} 条消息")
+            hint.setFont(QFont("Microsoft YaHei", 9))
+            hint.setStyleSheet("color: #999999;")
+            hint.setAlignment(Qt.AlignCenter)
+            self.chat_layout.addWidget(hint)
+        
+        for payload in payloads:
+            record = {key: payload.get(key) for key in self.DISPLAY_FIELDS}
+            record.update(thought=record['thought'] or "", thought_visible=True,
+                          row=None, placeholder=None, content=None, thought_content=None,
+                          request_id=None, cached_request=None, cached_model=None)
+            self._append_record(record)
+            if record['is_ai']:
+                self.messages.append({"role": "assistant", "content": record['text']})
+                if record['thought']:
+                    self.thoughts.append(record['thought'])
+        
+        self.session_id = session_id
+    
+    def _create_message_row(self, record, is_current=False):
+        """根据消息记录创建消息行组件；is_current为True时作为当前接收流式输出的消息"""
+        text = record['text']
+        is_ai = record['is_ai']
+        has_images, image_paths = record['has_images'], record['image_paths']
+        has_documents, doc_paths = record['has_documents'], record['doc_paths']
+        has_webpages, webpage_urls = record['has_webpages'], record['webpage_urls']
+        use_deep_thinking = record['use_deep_thinking']
+        
         message_frame = QFrame()
         message_frame.setFrameShape(QFrame.NoFrame)
         message_frame.setStyleSheet(
@@ -810,19 +1296,20 @@ class AISidebar(QWidget):
         content_layout = QVBoxLayout()
         
         if is_ai:
-            content = QLabel()
-            content.setFont(QFont("Microsoft YaHei", 11))
-            content.setStyleSheet("color: black;")
-            content.setWordWrap(True)
-            content.setTextInteractionFlags(Qt.TextBrowserInteraction | Qt.TextSelectableByMouse)
-            content.setOpenExternalLinks(False)  # 不使用默认浏览器打开链接
-            content.setTextFormat(Qt.MarkdownText)  # 使用 Markdown 格式
+            # 使用 Markdown 格式，流式输出时只重新渲染最后一个未完成的块
+            content = MarkdownMessageView(QFont("Microsoft YaHei", 11), "color: black;",
+                                          Qt.TextBrowserInteraction | Qt.TextSelectableByMouse)
             content.setFixedWidth(self.chat_scroll.width()*0.93)
             # 连接链接点击信号，在当前浏览器中打开
             content.linkActivated.connect(self.on_link_clicked)
+            content.setText(text)
+            if record.get('request_id') is None:
+                content.finish()
+            record['content'] = content
             
             # 存储当前消息的引用
-            self.current_ai_response = content
+            if is_current:
+                self.current_ai_response = content
             
             # 深度思考模式时添加思考过程区域
             if use_deep_thinking:
@@ -847,17 +1334,17 @@ class AISidebar(QWidget):
                 arrow_layout.addStretch()
                 
                 # 思考内容区域
-                thought_content = QLabel(thought_area)
-                thought_content.setFont(QFont("Microsoft YaHei", 9))
-                thought_content.setStyleSheet("margin-left: 10px; color: #666666")
-                thought_content.setTextFormat(Qt.MarkdownText)
-                thought_content.setTextInteractionFlags(Qt.TextSelectableByMouse)
-                thought_content.setWordWrap(True)
+                thought_content = MarkdownMessageView(QFont("Microsoft YaHei", 9), "margin-left: 10px; color: #666666",
+                                                      Qt.TextSelectableByMouse, thought_area)
                 thought_content.setFixedWidth(self.chat_scroll.width()*0.93)
                 
-                # 深度思考模式时默认显示思考区域
-                thought_content.show()
-                arrow.setText("▲")
+                # 深度思考模式时默认显示思考区域（重新创建时恢复之前的显示状态）
+                thought_content.setText(record['thought'])
+                if record.get('request_id') is None:
+                    thought_content.finish()
+                thought_content.setVisible(record['thought_visible'])
+                arrow.setText("▲" if record['thought_visible'] else "▼")
+                record['thought_content'] = thought_content
                 thought_layout.addLayout(arrow_layout)
                 thought_layout.addWidget(thought_content)
                 content_layout.addWidget(thought_area)
@@ -866,11 +1353,16 @@ class AISidebar(QWidget):
                 arrow.mousePressEvent = lambda event, t=thought_content, a=arrow: self.toggle_thought_display(event, t, a)
                 
                 # 存储当前消息的思考过程组件
-                self.current_thought_area = thought_area
-                self.current_thought_content = thought_content
-                self.current_arrow = arrow
+                if is_current:
+                    self.current_thought_area = thought_area
+                    self.current_thought_content = thought_content
+                    self.current_arrow = arrow
             
             content_layout.addWidget(content)
+            
+            # 缓存命中的回复显示标记，可忽略缓存重新生成
+            if record.get('cached_request'):
+                content_layout.addWidget(self._create_cached_label(record))
         else:
             # 用户消息，显示文本、图片和文档
             if text:
@@ -1007,16 +1499,95 @@ class AISidebar(QWidget):
             h_layout.addStretch()  # 添加弹性空间，确保气泡在右半边
             h_layout.addWidget(message_frame)
         
-        # 添加到聊天布局
-        self.chat_layout.addLayout(h_layout)
-        self.scroll_to_bottom()
+        row = QWidget()
+        h_layout.setContentsMargins(0, 0, 0, 0)
+        row.setLayout(h_layout)
+        return row
+    
+    def _create_cached_label(self, record):
+        """创建缓存结果标记"""
+        stats = ResponseCache.stats()
+        title = f"后台预先总结（{html.escape(record['cached_model'])}）" if record.get('cached_model') else "缓存结果"
+        label = QLabel(f'⚡ {title} · <a href="regenerate" style="color: #999999;">重新生成</a>')
+        label.setFont(QFont("Microsoft YaHei", 9))
+        label.setStyleSheet("color: #999999;")
+        label.setTextFormat(Qt.RichText)
+        label.setToolTip(f"缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+                         f"已缓存 {stats['entries']} 条回复")
+        label.linkActivated.connect(lambda _, r=record: self.regenerate_cached(r))
+        return label
+    
+    def regenerate_cached(self, record):
+        """忽略缓存重新请求，新回复会覆盖缓存"""
+        if record['cached_request']:
+            self._process_ai_request(**record['cached_request'], background=True, cacheable=True, use_cache=False)
+    
+    def schedule_virtualization(self):
+        """滚动或添加消息后，稍后统一更新消息组件的创建和释放"""
+        if not self.virtualize_timer.isActive():
+            self.virtualize_timer.start()
+    
+    def update_virtualization(self):
+        """只为可视区域附近的消息保留组件，其余消息替换为等高的占位组件"""
+        scroll_bar = self.chat_scroll.verticalScrollBar()
+        viewport_height = self.chat_scroll.viewport().height()
+        top = scroll_bar.value() - viewport_height * self.VIRTUALIZE_MARGIN
+        bottom = scroll_bar.value() + viewport_height * (1 + self.VIRTUALIZE_MARGIN)
+        
+        # 最近一轮对话（可能正在流式输出）始终保留
+        for record in self.transcript_items[:-self.KEEP_RECENT_MESSAGES]:
+            if record.get('request_id') is not None:
+                continue
+            widget = record['row'] if record['row'] is not None else record['placeholder']
+            geometry = widget.geometry()
+            visible = geometry.bottom() >= top and geometry.top() <= bottom
+            
+            if record['row'] is not None and not visible:
+                self._unload_message(record)
+            elif record['row'] is None and visible:
+                offset = self._load_message(record)
+                # 可视区域上方的消息高度变化时调整滚动位置，保持当前内容不跳动
+                if geometry.bottom() < scroll_bar.value() and offset:
+                    scroll_bar.setValue(scroll_bar.value() + offset)
+    
+    def _unload_message(self, record):
+        """保存消息状态并用等高占位组件替换消息组件"""
+        row = record['row']
+        if record['is_ai']:
+            record['text'] = record['content'].text()
+            if record.get('thought_content') is not None:
+                record['thought'] = record['thought_content'].text()
+                record['thought_visible'] = record['thought_content'].isVisible()
+        
+        placeholder = QWidget()
+        placeholder.setFixedHeight(row.height())
+        self.chat_layout.replaceWidget(row, placeholder)
+        row.deleteLater()
+        record.update(row=None, placeholder=placeholder, content=None, thought_content=None)
+    
+    def _load_message(self, record):
+        """重新创建消息组件替换占位组件，返回高度变化量"""
+        placeholder = record['placeholder']
+        row = self._create_message_row(record)
+        offset = row.sizeHint().height() - placeholder.height()
+        self.chat_layout.replaceWidget(placeholder, row)
+        placeholder.deleteLater()
+        record.update(row=row, placeholder=None)
+        return offset
             
     def _process_ai_request(self, prompt, user_message_text, use_deep_thinking=False, use_search=False, 
                            has_images=False, image_paths=None, has_documents=False, doc_paths=None,
-                           has_webpages=False, webpage_urls=None):
-        """处理AI请求的通用方法"""
+                           has_webpages=False, webpage_urls=None, background=False,
+                           cacheable=False, use_cache=True, retrieval_query=None, presummary=False):
+        """处理AI请求的通用方法
+
+        background为True时不禁用按钮，用户可以在请求进行时继续对话；
+        cacheable为True时回复按(模型, 提示词, 选项)缓存，use_cache为False时忽略已有缓存重新请求；
+        retrieval_query不为空时附上与之相关的历史页面；presummary为True时对话模型的缓存未命中则使用后台预总结
+        """
         # 禁用按钮
-        self.set_buttons_enabled(False)
+        if not background:
+            self.set_buttons_enabled(False)
         
         # 如果是欢迎页面，先清空欢迎页面
         if self.welcome_shown:
@@ -1028,110 +1599,154 @@ class AISidebar(QWidget):
                         has_documents=has_documents, doc_paths=doc_paths,
                         has_webpages=has_webpages, webpage_urls=webpage_urls)
         
+        cache_key = None
+        if cacheable:
+            cache_key = ResponseCache.key_for_request(prompt, use_deep_thinking, use_search)
+            cached = ResponseCache.get(cache_key) if use_cache else None
+            cached_model = None
+            if cached is None and use_cache and presummary:
+                cached = ResponseCache.get(ResponseCache.key_for_presummary(prompt))
+                cached_model = ConfigManager.get().models.text_parsing
+            if cached is not None:
+                self._show_cached_response(cached, prompt, user_message_text, use_deep_thinking, use_search,
+                                           cached_model)
+                if not background:
+                    self.set_buttons_enabled(True)
+                return
+        
         # 创建AI消息容器（传递 use_deep_thinking 参数控制是否显示思考过程）
-        self.add_message("", True, use_deep_thinking=use_deep_thinking)
+        record = self.add_message("", True, use_deep_thinking=use_deep_thinking)
         
         # 使用线程安全方式发送到AI
-        self.ai_worker = AIWorker(self, prompt, use_deep_thinking=use_deep_thinking, use_search=use_search, 
-                                 has_images=has_images, has_documents=has_documents)
-        self.ai_worker.response_chunk.connect(self.handle_ai_chunk)
-        self.ai_worker.response_complete.connect(self.handle_ai_complete)
-        self.ai_worker.error_occurred.connect(self.handle_ai_error)
-        self.ai_worker.start()
+        worker = AIWorker(self, prompt, use_deep_thinking=use_deep_thinking, use_search=use_search, 
+                          has_images=has_images, has_documents=has_documents,
+                          retrieval_query=retrieval_query, retrieval_exclude=tuple(webpage_urls or ()))
+        worker.response_chunk.connect(self.handle_ai_chunk)
+        worker.response_complete.connect(self.handle_ai_complete)
+        worker.error_occurred.connect(self.handle_ai_error)
+        worker.upload_progress.connect(self.handle_upload_progress)
+        worker.cancelled.connect(self.handle_ai_cancelled)
+        request_id = self.ai_pool.submit(worker)
+        
+        # 请求进行中的消息不会被释放组件
+        record['request_id'] = request_id
+        self.active_streams[request_id] = {'record': record, 'response': "", 'thought': "", 'dirty': False,
+                                           'cache_key': cache_key,
+                                           'progress_label': "正在上传文档" if has_documents else "正在分段总结网页"}
+        if not background:
+            self.foreground_request_id = request_id
+        
+    def _show_cached_response(self, cached, prompt, user_message_text, use_deep_thinking, use_search,
+                              cached_model=None):
+        """直接显示缓存的回复，并像正常回复一样加入对话历史和当前会话"""
+        response, thought = cached
+        cached_request = {'prompt': prompt, 'user_message_text': user_message_text,
+                          'use_deep_thinking': use_deep_thinking, 'use_search': use_search}
+        record = self.add_message(response, True, use_deep_thinking=use_deep_thinking, cached_request=cached_request,
+                                  cached_model=cached_model)
+        if thought:
+            record['thought'] = thought
+            if record['thought_content'] is not None:
+                record['thought_content'].setText(thought)
+                record['thought_content'].finish()
+            self.thoughts.append(thought)
+        self.messages.append({"role": "assistant", "content": response})
         
+        history_messages = [{"role": "user", "content": PageSummarizer.without_pages(prompt)},
+                            {"role": "assistant", "content": response}]
+        self.conversation_history.extend(history_messages)
+        self._save_history_messages(self.session_id, history_messages)
+        self._save_display_record(record)
+    
     def explain_current_page(self):
-        """总结当前页面 - 使用JavaScript提取页面文本"""
+        """总结当前页面 - 使用JavaScript提取页面正文"""
         current_browser = self.parent.tabs.currentWidget()
         if current_browser:
-            # 使用JavaScript提取页面可见文本（不修改DOM）
-            js_code = """
-            (function() {
-                // 获取正文文本（不修改页面DOM）
-                var body = document.body;
-                if (!body) return '';
-                var text = body.innerText || body.textContent;
-                // 清理多余空白，保留换行符以便阅读
-                text = text.replace(/[ \\t]+/g, ' ');
-                text = text.replace(/\\n\\s*\\n\\s*\\n/g, '\\n\\n');
-                return text.trim();
-            })()
-            """
-            current_browser.page().runJavaScript(
-                js_code, lambda text: self.process_page_explain(text))
+            # 使用缓存的页面正文，未缓存时在页面中提取（去除导航、页脚、评论等，不修改DOM）
+            page = current_browser.page()
+            PageContentCache.extract(page, lambda text: self._on_explain_text(page, text))
+    
+    def _on_explain_text(self, page, text):
+        """提取到正文时直接总结；提取脚本失败（如页面没有body或脚本出错）时改用页面HTML"""
+        if text:
+            self.process_page_explain(text, is_html=False)
+        else:
+            page.toHtml(lambda html: self.process_page_explain(html, is_html=True))
             
-    def process_page_explain(self, content):
-        """处理页面总结 - 改进版，自动识别HTML或纯文本"""
+    def process_page_explain(self, content, is_html=None):
+        """处理页面总结 - 改进版，is_html为None时自动识别HTML或纯文本"""
         
         # 检查内容是否为空
         if not content or len(content.strip()) == 0:
             prompt = "无法获取页面内容，请确保页面已加载完成。"
-            self._process_ai_request(prompt, "请总结当前页面内容", use_deep_thinking=False)
+            self._process_ai_request(prompt, "请总结当前页面内容", use_deep_thinking=False, background=True)
             return
         
+        # 文本转换和分段在后台线程中进行，完成后再确认和发送
+        self._run_plan_loader(lambda: self._build_summary_prompt(content, is_html), self._on_summary_prompt_ready)
+    
+    def _run_plan_loader(self, function, callback):
+        """在后台线程中执行function，完成后在界面线程中回调callback(结果)"""
+        loader = PagePlanLoader(function)
+        loader.ready.connect(callback)
+        loader.finished.connect(lambda l=loader: self._on_plan_loader_finished(l))
+        self.plan_loaders.append(loader)
+        loader.start()
+    
+    def _on_plan_loader_finished(self, loader):
+        """释放已结束的分段计划线程"""
+        if loader in self.plan_loaders:
+            self.plan_loaders.remove(loader)
+        loader.deleteLater()
+    
+    @staticmethod
+    def _build_summary_prompt(content, is_html):
+        """转换页面内容并构建总结提示词（在后台线程中执行），返回(prompt, plan)"""
         # 判断content是HTML还是纯文本
         # 如果包含明显的HTML标签对，则视为HTML
-        is_html = re.search(r'<[^>]+>', content) and re.search(r'</[^>]+>', content)
+        if is_html is None:
+            is_html = HTMLTextCleaner.looks_like_html(content)
         
         if is_html:
-            # HTML处理流程
-            # 1. 提取body标签内容（不区分大小写）
-            body_match = re.search(r'<body[^>]*>(.*?)</body>', content, re.IGNORECASE | re.DOTALL)
-            if body_match:
-                text = body_match.group(1)
-            else:
-                text = content
-            
-            # 2. 移除script标签及其内容
-            text = re.sub(r'<script[^>]*>.*?</script>', ' ', text, flags=re.IGNORECASE | re.DOTALL)
-            # 3. 移除style标签及其内容
-            text = re.sub(r'<style[^>]*>.*?</style>', ' ', text, flags=re.IGNORECASE | re.DOTALL)
-            # 4. 移除其他不需要的标签（如noscript, iframe等）
-            text = re.sub(r'<(noscript|iframe|object|embed)[^>]*>.*?</\1>', ' ', text, flags=re.IGNORECASE | re.DOTALL)
-            # 5. 移除所有剩余的HTML标签
-            text = re.sub(r'<[^>]+>', ' ', text)
-            # 6. 替换HTML实体
-            text = re.sub(r'&(?:[a-zA-Z]+|#\d+);', ' ', text)
-            # 7. 合并空白字符
-            text = re.sub(r'\s+', ' ', text)
-            # 8. 去除首尾空白
-            text = text.strip()
+            # HTML转文本：优先使用body内容，去除脚本样式等元素和标签并解码实体（过短时使用整个文档）
+            text = HTMLTextCleaner.to_text(content)
         else:
-            # 纯文本处理
-            text = content.strip()
-            # 合并多余空白
-            text = re.sub(r'\s+', ' ', text)
-        
-        # 如果内容太短，尝试使用HTML解析作为后备（仅当原始内容是HTML时）
-        if len(text) < 100 and is_html:
-            # 简单的HTML标签移除
-            text = re.sub(r'<[^>]+>', ' ', content)
-            text = re.sub(r'\s+', ' ', text).strip()
-        
-        # 智能截断
-        max_length = 3000
-        if len(text) > max_length:
-            # 尝试在句号、问号、感叹号后截断
-            truncate_pos = text.rfind('。', 0, max_length)
-            if truncate_pos == -1:
-                truncate_pos = text.rfind('.', 0, max_length)
-            if truncate_pos == -1:
-                truncate_pos = text.rfind('?', 0, max_length)
-            if truncate_pos == -1:
-                truncate_pos = text.rfind('!', 0, max_length)
-            if truncate_pos == -1:
-                truncate_pos = max_length
-            text = text[:truncate_pos + 1]
-        
-        prompt = f"请总结以下网页内容，提取关键信息：\n\n{text}"
-        self._process_ai_request(prompt, "请总结当前页面内容", use_deep_thinking=False)
+            # 纯文本处理：合并多余空白，保留段落结构以便按段落分段
+            text = PageExtractor.normalize_text(content)
+        
+        # 按token分段：只有一段时直接发送原文，否则先分段总结再汇总
+        return PageSummarizer.summary_prompt(text)
+    
+    def _on_summary_prompt_ready(self, result):
+        """分段完成：长网页预计消耗较多时先确认，再发送总结请求"""
+        if result is None:
+            return
+        prompt, plan = result
+        if len(plan['chunks']) <= 1:
+            self._process_ai_request(prompt, "请总结当前页面内容", use_deep_thinking=False, background=True,
+                                     cacheable=True, presummary=True)
+            return
+        
+        # 预计消耗较多时先确认（已有缓存的总结时无需确认）
+        estimate = PageSummarizer.describe(plan)
+        if plan['credit'] > ConfigManager.get().summarize.confirm_credit and \
+                not ResponseCache.contains(ResponseCache.key_for_request(prompt)) and \
+                not ResponseCache.contains(ResponseCache.key_for_presummary(prompt)):
+            reply = QMessageBox.question(self, "确认总结", f"页面内容较长，将分段总结（{estimate}），是否继续？",
+                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                return
+        
+        self._process_ai_request(prompt, f"请总结当前页面内容\n（{estimate}）", use_deep_thinking=False,
+                                 background=True, cacheable=True, presummary=True)
         
     def handle_selection_explain(self, text):
         """处理划词解释"""
         prompt = f"请解释以下文本：\n\n{text}"
         if len(text) < 100:
-            self._process_ai_request(prompt, f"请解释选中的文本：\n{text}", use_deep_thinking=False)
+            self._process_ai_request(prompt, f"请解释选中的文本：\n{text}", use_deep_thinking=False, background=True, cacheable=True)
         else:
-            self._process_ai_request(prompt, f"请解释选中的文本：\n{text[:100]}\n......", use_deep_thinking=False)
+            self._process_ai_request(prompt, f"请解释选中的文本：\n{text[:100]}\n......", use_deep_thinking=False, background=True, cacheable=True)
         
     def on_cite_webpage(self):
         """引用当前网页 - 提取网页内容"""
@@ -1144,52 +1759,25 @@ class AISidebar(QWidget):
             if url in self.cited_webpages:
                 return
 
-            # 使用JavaScript提取页面内容（参考explain_current_page的实现）
-            js_code = """
-            (function() {
-                // 获取正文文本（不修改页面DOM）
-                var body = document.body;
-                if (!body) return '';
-                var text = body.innerText || body.textContent;
-                // 清理多余空白，保留换行符以便阅读
-                text = text.replace(/[ \\t]+/g, ' ');
-                text = text.replace(/\\n\\s*\\n\\s*\\n/g, '\\n\\n');
-                return text.trim();
-            })()
-            """
-            current_browser.page().runJavaScript(
-                js_code, lambda text: self.process_cite_webpage(url, text))
+            # 使用缓存的页面正文（参考explain_current_page的实现）
+            PageContentCache.extract(current_browser.page(), lambda text: self.process_cite_webpage(url, text))
 
     def process_cite_webpage(self, url, content):
         """处理引用的网页内容"""
         # 检查内容是否为空
         if not content or len(content.strip()) == 0:
             # 如果无法获取内容，只添加URL
-            page_content = "[无法获取页面内容]"
+            text = "[无法获取页面内容]"
         else:
-            # 清理内容（参考process_page_explain的处理）
-            text = content.strip()
-            # 合并多余空白
-            text = re.sub(r'\s+', ' ', text)
-            # 智能截断，限制内容长度
-            max_length = 3000
-            if len(text) > max_length:
-                # 尝试在句号、问号、感叹号后截断
-                truncate_pos = text.rfind('。', 0, max_length)
-                if truncate_pos == -1:
-                    truncate_pos = text.rfind('.', 0, max_length)
-                if truncate_pos == -1:
-                    truncate_pos = text.rfind('?', 0, max_length)
-                if truncate_pos == -1:
-                    truncate_pos = text.rfind('!', 0, max_length)
-                if truncate_pos == -1:
-                    truncate_pos = max_length
-                text = text[:truncate_pos + 1]
-            page_content = text
+            # 清理内容（参考process_page_explain的处理）：合并多余空白，保留段落结构
+            text = PageExtractor.normalize_text(content)
 
-        # 存储URL和内容
+        # 存储URL和内容：在后台线程中按token分段，超过一段的长网页在发送时分段总结
         self.cited_webpages.append(url)
-        self.cited_webpage_contents[url] = page_content
+        entry = {'text': text, 'plan': None, 'label': None}
+        self.cited_webpage_contents[url] = entry
+        self._run_plan_loader(lambda: PageSummarizer.plan(text),
+                              lambda plan: self._on_cite_plan_ready(url, entry, plan))
         
         # 不再清除已上传的文档和图片，因为引用网页可以与上传内容共存
         # 但根据业务逻辑，引用网页时确实不能同时有上传的图片和文档
@@ -1208,6 +1796,14 @@ class AISidebar(QWidget):
             self.upload_image_btn.setEnabled(False)
             self.upload_doc_btn.setEnabled(False)
     
+    def _on_cite_plan_ready(self, url, entry, plan):
+        """引用网页分段完成：保存计划并在缩略图提示中显示用量估算"""
+        if plan is None or self.cited_webpage_contents.get(url) is not entry:
+            return
+        entry['plan'] = plan
+        if entry['label'] is not None and len(plan['chunks']) > 1:
+            entry['label'].setToolTip(f"{url}\n长网页将分段总结：{PageSummarizer.describe(plan)}")
+    
     def add_webpage_thumbnail(self, url, page_index):
         """添加网页缩略图到预览区域"""
         # 创建缩略图容器
@@ -1246,7 +1842,13 @@ class AISidebar(QWidget):
             }
         """)
         page_label.setAlignment(Qt.AlignCenter)
-        page_label.setToolTip(url)  # 鼠标悬停显示URL
+        # 鼠标悬停显示URL，长网页分段完成后同时显示分段总结的用量估算
+        page_label.setToolTip(url)
+        entry = self.cited_webpage_contents.get(url)
+        if entry is not None:
+            entry['label'] = page_label
+            if entry['plan'] is not None:
+                self._on_cite_plan_ready(url, entry, entry['plan'])
         container_layout.addWidget(page_label, alignment=Qt.AlignCenter)
         
         # 创建删除按钮
@@ -1326,6 +1928,7 @@ class AISidebar(QWidget):
         """移除引用的网页"""
         if url in self.cited_webpages:
             self.cited_webpages.remove(url)
+        self.cited_webpage_contents.pop(url, None)
         
         # 从布局中移除并删除容器
         self.image_preview_layout.removeWidget(container)
@@ -1382,6 +1985,8 @@ class AISidebar(QWidget):
                 if file_path not in self.uploaded_images:
                     self.uploaded_images.append(file_path)
                     self.add_image_thumbnail(file_path)
+                    # 选择图片后立即开始后台预处理
+                    ImagePreprocessor.submit(file_path)
             
             # 显示图片预览区域
             if self.uploaded_images:
@@ -1527,9 +2132,9 @@ class AISidebar(QWidget):
         """处理划词翻译"""
         prompt = f"请翻译以下文本：\n\n{text}"
         if len(text) < 100:
-            self._process_ai_request(prompt, f"请翻译选中的文本：\n{text}", use_deep_thinking=False)
+            self._process_ai_request(prompt, f"请翻译选中的文本：\n{text}", use_deep_thinking=False, background=True, cacheable=True)
         else:
-            self._process_ai_request(prompt, f"请翻译选中的文本：\n{text[:100]}\n......", use_deep_thinking=False)
+            self._process_ai_request(prompt, f"请翻译选中的文本：\n{text[:100]}\n......", use_deep_thinking=False, background=True, cacheable=True)
         
     def on_upload_document(self):
         """处理文档上传"""
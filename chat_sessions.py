@@ -0,0 +1,338 @@
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QListWidget,
+                               QListWidgetItem, QPushButton, QLabel, QMessageBox)
+from PySide6.QtCore import Qt, QTimer
+
+
+class ChatSessionStore:
+    """AI对话会话存储 - 基于SQLite，消息只追加不修改，并对消息文本建立全文索引"""
+
+    DB_FILE = Path("Mindra_data") / "chat_sessions.db"
+    MIN_FTS_QUERY_LENGTH = 3  # trigram分词要求查询至少3个字符，更短的查询使用LIKE
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, db_file=None):
+        self.db_file = Path(db_file) if db_file else self.DB_FILE
+        self.db_file.parent.mkdir(exist_ok=True)
+
+        # 单连接 + 锁，供GUI线程和AI工作线程共享
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self.fts_enabled = False
+        self._create_tables()
+
+    @classmethod
+    def get_instance(cls):
+        """获取进程内共享的会话存储"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def _create_tables(self):
+        """创建数据表、索引和全文索引"""
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated
+                ON chat_sessions (updated_at, id)
+            """)
+            # kind: display为界面显示的消息，history为发送给模型的对话历史
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    search_text TEXT NOT NULL DEFAULT '',
+                    created_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_messages_session
+                ON chat_messages (session_id, kind, id)
+            """)
+
+        # 全文索引需要SQLite支持FTS5和trigram分词（3.34+），不支持时搜索退化为LIKE
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+                        search_text, content='chat_messages', content_rowid='id', tokenize='trigram'
+                    )
+                """)
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_chat_messages_fts_insert AFTER INSERT ON chat_messages
+                    WHEN NEW.search_text != ''
+                    BEGIN
+                        INSERT INTO chat_messages_fts (rowid, search_text) VALUES (NEW.id, NEW.search_text);
+                    END
+                """)
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_chat_messages_fts_delete AFTER DELETE ON chat_messages
+                    WHEN OLD.search_text != ''
+                    BEGIN
+                        INSERT INTO chat_messages_fts (chat_messages_fts, rowid, search_text)
+                        VALUES ('delete', OLD.id, OLD.search_text);
+                    END
+                """)
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            print(f"全文索引不可用，将使用普通搜索: {e}")
+
+    def create_session(self, title):
+        """创建新会话，返回会话ID"""
+        session_id = uuid.uuid4().hex
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO chat_sessions (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, title or "新对话", now, now)
+            )
+        return session_id
+
+    def append(self, session_id, kind, payload, search_text=""):
+        """追加一条消息"""
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO chat_messages (session_id, kind, payload, search_text, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (session_id, kind, json.dumps(payload, ensure_ascii=False), search_text or "", now))
+            if kind == 'display':
+                self._conn.execute("""
+                    UPDATE chat_sessions SET updated_at = ?, message_count = message_count + 1
+                    WHERE id = ?
+                """, (now, session_id))
+
+    def list_sessions(self, limit=50, before=None):
+        """按最近更新时间倒序分页列出会话
+
+        Args:
+            limit: 每页条数
+            before: 上一页最后一个会话的(updated_at, id)，None表示从最新开始
+        """
+        sql = "SELECT id, title, created_at, updated_at, message_count FROM chat_sessions"
+        params = []
+        if before is not None:
+            sql += " WHERE (updated_at, id) < (?, ?)"
+            params.extend(before)
+        sql += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, query, limit=50, offset=0):
+        """按消息内容搜索会话，返回[{id, title, updated_at, snippet}]
+
+        每个会话只返回最近一条匹配，按匹配消息从新到旧排序；分组、排序和分页都在SQL中完成
+        """
+        query = query.strip()
+        if not query:
+            return []
+
+        if self.fts_enabled and len(query) >= self.MIN_FTS_QUERY_LENGTH:
+            # 整个查询作为一个短语匹配；子查询先选出每个会话最近的匹配消息，只为这些消息生成摘要
+            phrase = '"' + query.replace('"', '""') + '"'
+            sql = """
+                SELECT s.id, s.title, s.updated_at,
+                       snippet(chat_messages_fts, 0, '', '', '…', 16) AS snippet
+                FROM chat_messages_fts
+                JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+                JOIN chat_sessions s ON s.id = m.session_id
+                WHERE chat_messages_fts MATCH ? AND m.id IN (
+                    SELECT MAX(m2.id) FROM chat_messages_fts
+                    JOIN chat_messages m2 ON m2.id = chat_messages_fts.rowid
+                    WHERE chat_messages_fts MATCH ?
+                    GROUP BY m2.session_id
+                    ORDER BY MAX(m2.id) DESC
+                    LIMIT ? OFFSET ?
+                )
+                ORDER BY m.id DESC
+            """
+            params = [phrase, phrase, int(limit), int(offset)]
+        else:
+            sql = """
+                SELECT s.id, s.title, s.updated_at, substr(m.search_text, 1, 60) AS snippet
+                FROM (
+                    SELECT MAX(id) AS id FROM chat_messages
+                    WHERE search_text LIKE ? ESCAPE '\\'
+                    GROUP BY session_id
+                    ORDER BY MAX(id) DESC
+                    LIMIT ? OFFSET ?
+                ) latest
+                JOIN chat_messages m ON m.id = latest.id
+                JOIN chat_sessions s ON s.id = m.session_id
+                ORDER BY m.id DESC
+            """
+            escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params = [f"%{escaped}%", int(limit), int(offset)]
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_messages(self, session_id, kind, limit=None):
+        """按时间顺序读取会话消息；limit不为None时只读取最近limit条"""
+        sql = "SELECT payload FROM chat_messages WHERE session_id = ? AND kind = ? ORDER BY id DESC"
+        params = [session_id, kind]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row['payload']) for row in reversed(rows)]
+
+    def count_messages(self, session_id, kind):
+        """获取会话消息数"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM chat_messages WHERE session_id = ? AND kind = ?", (session_id, kind)
+            ).fetchone()
+        return row[0]
+
+    def delete_session(self, session_id):
+        """删除会话及其消息"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+class ChatSessionDialog(QDialog):
+    """历史会话对话框 - 分页浏览和搜索已保存的AI对话"""
+
+    PAGE_SIZE = 50
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("历史会话")
+        self.setMinimumSize(420, 500)
+        self.store = ChatSessionStore.get_instance()
+        self.selected_session_id = None
+        self.last_session_key = None  # 已加载的最后一个会话的(updated_at, id)
+        self.search_query = ""  # 当前的搜索词，为空时浏览全部会话
+        self.search_offset = 0  # 已加载的搜索结果数
+        self.has_more = True
+
+        layout = QVBoxLayout(self)
+
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("搜索对话内容...")
+        layout.addWidget(self.search_input)
+
+        # 输入停顿后再搜索，避免每个字符都查询一次
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(300)
+        self.search_timer.timeout.connect(self.refresh)
+        self.search_input.textChanged.connect(lambda _: self.search_timer.start())
+
+        self.session_list = QListWidget()
+        self.session_list.itemDoubleClicked.connect(self.open_selected)
+        self.session_list.verticalScrollBar().valueChanged.connect(self.on_scroll)
+        layout.addWidget(self.session_list)
+
+        self.status_label = QLabel()
+        self.status_label.setStyleSheet("color: #666666;")
+        layout.addWidget(self.status_label)
+
+        btn_layout = QHBoxLayout()
+        open_btn = QPushButton("打开")
+        delete_btn = QPushButton("删除")
+        close_btn = QPushButton("关闭")
+        open_btn.clicked.connect(self.open_selected)
+        delete_btn.clicked.connect(self.delete_selected)
+        close_btn.clicked.connect(self.reject)
+        btn_layout.addWidget(open_btn)
+        btn_layout.addWidget(delete_btn)
+        btn_layout.addStretch()
+        btn_layout.addWidget(close_btn)
+        layout.addLayout(btn_layout)
+
+        self.refresh()
+
+    def refresh(self):
+        """重新加载会话列表（有搜索词时显示搜索结果）"""
+        self.session_list.clear()
+        self.last_session_key = None
+        self.search_query = self.search_input.text().strip()
+        self.search_offset = 0
+        self.has_more = True
+        self.load_more()
+
+    def load_more(self):
+        """加载下一页会话或搜索结果"""
+        if not self.has_more:
+            return
+        if self.search_query:
+            results = self.store.search(self.search_query, self.PAGE_SIZE, self.search_offset)
+            for result in results:
+                self._add_item(result['id'], f"{result['title']}\n{result['snippet']}", result['updated_at'])
+            self.search_offset += len(results)
+            self.has_more = len(results) == self.PAGE_SIZE
+            self.status_label.setText(f"找到 {self.session_list.count()} 个会话")
+            return
+        sessions = self.store.list_sessions(self.PAGE_SIZE, self.last_session_key)
+        for session in sessions:
+            self._add_item(session['id'], session['title'], session['updated_at'])
+        if sessions:
+            self.last_session_key = (sessions[-1]['updated_at'], sessions[-1]['id'])
+        self.has_more = len(sessions) == self.PAGE_SIZE
+        self.status_label.setText(f"已加载 {self.session_list.count()} 个会话")
+
+    def on_scroll(self, value):
+        """滚动到底部时加载更多"""
+        if value >= self.session_list.verticalScrollBar().maximum():
+            self.load_more()
+
+    def _add_item(self, session_id, text, updated_at):
+        item = QListWidgetItem(f"{text}\n{updated_at.replace('T', ' ')}")
+        item.setData(Qt.UserRole, session_id)
+        self.session_list.addItem(item)
+
+    def open_selected(self, *_):
+        """打开选中的会话"""
+        item = self.session_list.currentItem()
+        if item is None:
+            return
+        self.selected_session_id = item.data(Qt.UserRole)
+        self.accept()
+
+    def delete_selected(self):
+        """删除选中的会话"""
+        item = self.session_list.currentItem()
+        if item is None:
+            return
+        reply = QMessageBox.question(self, "确认删除", "确定要删除该会话吗？",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply == QMessageBox.Yes:
+            self.store.delete_session(item.data(Qt.UserRole))
+            self.session_list.takeItem(self.session_list.row(item))
+            # 删除后后面的搜索结果前移一位
+            if self.search_offset:
+                self.search_offset -= 1
@@ -0,0 +1,314 @@
+import threading
+import yaml
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+# ========== 配置数据类（只读） ==========
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """数据库连接池配置"""
+    min_size: int = 1
+    max_size: int = 5
+    idle_timeout: float = 300
+    health_check_interval: float = 30
+    acquire_timeout: float = 10
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    """数据库配置"""
+    host: str
+    database: str
+    user: str
+    password: str
+    pool: PoolSettings = field(default_factory=PoolSettings)
+
+
+@dataclass(frozen=True)
+class HttpSettings:
+    """AI服务HTTP连接配置"""
+    connect_timeout: float = 10  # 建立连接超时（秒）
+    read_timeout: float = 120  # 两次读取之间的超时（秒），流式输出时为相邻片段的间隔
+    write_timeout: float = 60  # 发送请求超时（秒），上传文档时需要较长时间
+    pool_timeout: float = 10  # 等待空闲连接超时（秒）
+    max_connections: int = 10  # 最大连接数
+    max_keepalive_connections: int = 5  # 保持的空闲连接数
+    keepalive_expiry: float = 60  # 空闲连接保持时间（秒）
+    http2: bool = True  # 安装了h2包时使用HTTP/2
+    max_retries: int = 3  # 429/5xx和连接错误的重试次数（指数退避加随机抖动）
+    prewarm: bool = True  # 启动时预先建立连接
+
+
+@dataclass(frozen=True)
+class AISettings:
+    """AI服务配置"""
+    api_key: str
+    base_url: str
+    max_concurrent_requests: int = 3  # 同时运行的AI请求数上限，超出的请求排队
+    first_chunk_timeout: float = 60  # 等待首个响应片段的超时时间（秒）
+    request_timeout: float = 300  # 单个请求的总超时时间（秒）
+    http: HttpSettings = field(default_factory=HttpSettings)
+
+
+@dataclass(frozen=True)
+class ModelsSettings:
+    """模型配置"""
+    text_parsing: str
+    image_parsing: str
+    daily_conversation: str
+
+    # 任务类型名称
+    ASSIGNMENTS = {
+        'text_parsing': "文本解析",
+        'image_parsing': "图片解析",
+        'daily_conversation': "日常对话"
+    }
+
+    def role_of(self, model):
+        """根据模型名称获取任务类型键，未知模型返回None
+
+        多个任务类型使用同一模型时，依次优先日常对话、图片解析、文本解析（与按模型名称建表时后者覆盖前者一致）
+        """
+        for role in ('daily_conversation', 'image_parsing', 'text_parsing'):
+            if getattr(self, role) == model:
+                return role
+        return None
+
+    def assignment_of(self, model):
+        """根据模型名称获取任务类型名称"""
+        return self.ASSIGNMENTS.get(self.role_of(model), "其他")
+
+    def __getitem__(self, role):
+        # 兼容原有 models_config['text_parsing'] 的写法
+        return getattr(self, role)
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """模型token价格（每1000 token的credit）"""
+    input: float
+    output: float
+
+
+@dataclass(frozen=True)
+class PricingSettings:
+    """各任务类型的token价格"""
+    text_parsing: ModelPrice = ModelPrice(0.0005, 0.002)
+    image_parsing: ModelPrice = ModelPrice(0.002, 0.02)
+    daily_conversation: ModelPrice = ModelPrice(0.004, 0.012)
+    default: ModelPrice = ModelPrice(0.0005, 0.002)
+
+    def price_for(self, role):
+        """根据任务类型键获取价格，未知类型使用默认价格"""
+        return getattr(self, role) if role else self.default
+
+
+@dataclass(frozen=True)
+class HistorySettings:
+    """对话历史配置"""
+    token_budget: int = 6000  # 发送给模型的历史消息默认token上限
+    token_budgets: Dict[str, int] = field(default_factory=dict)  # 按任务类型覆盖token上限
+    keep_image_turns: int = 1  # 保留图片内容的最近用户消息数，更早的图片替换为文字占位
+    max_messages: int = 40  # 内存中最多保留的消息数（不含系统提示词）
+
+    def budget_for(self, role):
+        """获取任务类型对应的token上限"""
+        return self.token_budgets.get(role, self.token_budget)
+
+
+@dataclass(frozen=True)
+class ImageSettings:
+    """图片预处理配置"""
+    max_edge: int = 1568  # 长边超过该像素数时等比缩小
+    format: str = 'jpeg'  # 重新编码格式：jpeg 或 webp
+    quality: int = 85  # 重新编码质量（1-100）
+
+
+@dataclass(frozen=True)
+class UISettings:
+    """界面配置"""
+    stream_render_interval_ms: int = 16  # 流式输出最短刷新间隔（毫秒），期间到达的片段合并为一次重绘
+
+
+@dataclass(frozen=True)
+class CacheSettings:
+    """缓存配置"""
+    enabled: bool = True  # 是否缓存页面总结、划词解释和翻译的回复
+    response_ttl: float = 3600  # 缓存回复的有效期（秒）
+    response_max_entries: int = 200  # 最多缓存的回复数，超过时淘汰最久未使用的
+    prefetch_pages: bool = False  # AI侧边栏打开时，网页加载完成后立即提取正文，AI功能使用时无需等待
+    page_max_entries: int = 30  # 最多缓存的页面正文数
+    page_max_chars: int = 4000000  # 页面正文缓存的总字符数上限
+
+
+@dataclass(frozen=True)
+class SummarizeSettings:
+    """长网页分段总结配置"""
+    chunk_tokens: int = 2000  # 每段的token上限，页面不超过一段时直接发送原文
+    max_input_tokens: int = 24000  # 单次总结处理的页面token上限，超出部分不参与总结
+    map_max_tokens: int = 300  # 每段要点的max_tokens
+    map_workers: int = 4  # 并行总结的最大线程数
+    confirm_credit: float = 0.05  # 预计消耗超过该credit时先确认
+    background_enabled: bool = False  # 是否在后台预先总结停留的页面
+    background_delay: float = 20  # 在页面停留多少秒后开始预先总结
+    background_daily_credit: float = 0.2  # 每天用于预先总结的credit上限
+
+
+@dataclass(frozen=True)
+class RetrievalSettings:
+    """浏览历史检索配置"""
+    enabled: bool = False  # 是否为浏览过的页面建立向量索引，并在对话时附上相关的历史页面
+    embedding_model: str = "text-embedding-v3"  # 计算向量的模型，更换后重新建立索引
+    top_k: int = 3  # 每次对话最多附上的历史页面数
+    min_score: float = 0.3  # 相似度低于该值的页面不附上
+    batch_size: int = 10  # 每批计算向量的页面数
+    max_pages: int = 2000  # 索引的页面数上限，超出时淘汰最早访问的页面
+    embed_chars: int = 2000  # 每个页面参与计算向量的正文字符数
+    context_chars: int = 500  # 每个历史页面附上的正文摘录字符数
+
+
+@dataclass(frozen=True)
+class Settings:
+    """应用配置"""
+    database: DatabaseSettings
+    ai: AISettings
+    models: ModelsSettings
+    pricing: PricingSettings = field(default_factory=PricingSettings)
+    history: HistorySettings = field(default_factory=HistorySettings)
+    images: ImageSettings = field(default_factory=ImageSettings)
+    ui: UISettings = field(default_factory=UISettings)
+    cache: CacheSettings = field(default_factory=CacheSettings)
+    summarize: SummarizeSettings = field(default_factory=SummarizeSettings)
+    retrieval: RetrievalSettings = field(default_factory=RetrievalSettings)
+
+
+# ========== 配置管理器 ==========
+
+class ConfigManager:
+    """配置管理器 - config.yaml只解析一次，所有模块共享同一份只读配置"""
+
+    CONFIG_FILE = Path("config.yaml")
+
+    _settings: Optional[Settings] = None
+    _lock = threading.Lock()
+    _listeners: List[Callable[[Settings, Settings], None]] = []
+    _watcher = None
+
+    @classmethod
+    def get(cls) -> Settings:
+        """获取当前配置（首次调用时加载）"""
+        settings = cls._settings
+        if settings is None:
+            with cls._lock:
+                if cls._settings is None:
+                    cls._settings = cls._load()
+                settings = cls._settings
+        return settings
+
+    @classmethod
+    def reload(cls) -> Settings:
+        """重新加载配置文件，并通知监听者"""
+        try:
+            new_settings = cls._load()
+        except Exception as e:
+            print(f"重新加载配置文件错误: {e}")
+            return cls.get()
+
+        with cls._lock:
+            old_settings = cls._settings
+            cls._settings = new_settings
+
+        if old_settings is not None and old_settings != new_settings:
+            for listener in list(cls._listeners):
+                try:
+                    listener(old_settings, new_settings)
+                except Exception as e:
+                    print(f"配置变更处理错误: {e}")
+        return new_settings
+
+    @classmethod
+    def add_listener(cls, listener):
+        """注册配置变更回调 listener(old_settings, new_settings)"""
+        cls._listeners.append(listener)
+
+    @classmethod
+    def remove_listener(cls, listener):
+        """移除配置变更回调"""
+        if listener in cls._listeners:
+            cls._listeners.remove(listener)
+
+    @classmethod
+    def start_watching(cls):
+        """监听配置文件变化并自动重新加载（需在Qt主线程中调用）"""
+        if cls._watcher is not None:
+            return
+        from PySide6.QtCore import QFileSystemWatcher
+
+        cls._watcher = QFileSystemWatcher([str(cls.CONFIG_FILE.absolute())])
+
+        def on_file_changed(path):
+            # 编辑器保存时可能先删除再创建文件，需重新加入监听
+            if path not in cls._watcher.files() and Path(path).exists():
+                cls._watcher.addPath(path)
+            cls.reload()
+
+        cls._watcher.fileChanged.connect(on_file_changed)
+
+    @classmethod
+    def _load(cls) -> Settings:
+        """解析config.yaml"""
+        with open(cls.CONFIG_FILE, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+
+        db_config = config['database']
+        pool_config = db_config.get('pool') or {}
+        database = DatabaseSettings(
+            host=db_config['host'],
+            database=db_config['database'],
+            user=db_config['user'],
+            password=db_config['password'],
+            pool=PoolSettings(**pool_config)
+        )
+
+        ai_config = dict(config['ai'])
+        http_config = ai_config.pop('http', None) or {}
+        ai = AISettings(**ai_config, http=HttpSettings(**http_config))
+
+        models_config = config['models']
+        models = ModelsSettings(
+            text_parsing=models_config['text_parsing'],
+            image_parsing=models_config['image_parsing'],
+            daily_conversation=models_config['daily_conversation']
+        )
+
+        # 价格配置可选，未配置的任务类型使用默认价格
+        pricing_config = config.get('pricing') or {}
+        prices: Dict[str, ModelPrice] = {}
+        for role, price in pricing_config.items():
+            prices[role] = ModelPrice(input=float(price['input']), output=float(price['output']))
+        pricing = PricingSettings(**prices)
+
+        # 对话历史配置可选
+        history = HistorySettings(**(config.get('history') or {}))
+
+        # 图片预处理配置可选
+        images = ImageSettings(**(config.get('images') or {}))
+
+        # 界面配置可选
+        ui = UISettings(**(config.get('ui') or {}))
+
+        # 缓存配置可选
+        cache = CacheSettings(**(config.get('cache') or {}))
+
+        # 长网页分段总结配置可选
+        summarize = SummarizeSettings(**(config.get('summarize') or {}))
+
+        # 浏览历史检索配置可选
+        retrieval = RetrievalSettings(**(config.get('retrieval') or {}))
+
+        return Settings(database=database, ai=ai, models=models, pricing=pricing,
+                        history=history, images=images, ui=ui, cache=cache, summarize=summarize,
+                        retrieval=retrieval)
@@ -0,0 +1,213 @@
+import re
+import threading
+from image_cache import ImageCache
+
+
+# ========== Token估算 ==========
+
+class TokenEstimator:
+    """本地token估算器 - 中日韩字符约1个token，其他字符约4个字符1个token"""
+
+    CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+    MESSAGE_OVERHEAD = 4  # 每条消息的角色、分隔符等固定开销
+    IMAGE_TOKENS = 1000  # 单张图片的估算token数
+    IMAGE_TYPES = ('image_url', 'image_ref')  # image_ref为图片缓存中的句柄
+
+    def count_text(self, text):
+        """估算文本的token数"""
+        if not text:
+            return 0
+        cjk = len(self.CJK_PATTERN.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def count_message(self, message):
+        """估算一条消息的token数"""
+        content = message.get('content')
+        tokens = self.MESSAGE_OVERHEAD
+        if isinstance(content, str):
+            tokens += self.count_text(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'text':
+                    tokens += self.count_text(part.get('text', ''))
+                elif part.get('type') in self.IMAGE_TYPES:
+                    tokens += self.IMAGE_TOKENS
+        return tokens
+
+
+class TiktokenEstimator(TokenEstimator):
+    """基于tiktoken的token估算器（需安装tiktoken）"""
+
+    def __init__(self, encoding_name="cl100k_base"):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count_text(self, text):
+        if not text:
+            return 0
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+class EstimatorLoader:
+    """tiktoken加载器 - 在后台线程中加载编码（首次使用可能需要下载编码文件），加载完成前使用本地估算"""
+
+    _lock = threading.Lock()
+    _estimator = None  # 加载成功后共用的TiktokenEstimator
+    _loading = False
+    _loaded = False
+    _callbacks = []  # 等待加载完成的回调
+
+    @classmethod
+    def get(cls, on_ready=None):
+        """返回当前可用的估算器；tiktoken尚未加载完成时返回本地估算器，加载成功后回调on_ready(估算器)"""
+        with cls._lock:
+            if cls._estimator is not None:
+                return cls._estimator
+            if not cls._loaded:
+                if on_ready is not None:
+                    cls._callbacks.append(on_ready)
+                if not cls._loading:
+                    cls._loading = True
+                    threading.Thread(target=cls._load, name="tiktoken-loader", daemon=True).start()
+        return TokenEstimator()
+
+    @classmethod
+    def _load(cls):
+        """后台线程：加载tiktoken编码并通知等待的估算器使用者"""
+        try:
+            estimator = TiktokenEstimator()
+        except ImportError:
+            estimator = None  # 未安装tiktoken时使用本地估算
+        except Exception as e:
+            print(f"加载tiktoken编码错误，使用本地估算: {e}")
+            estimator = None
+        with cls._lock:
+            cls._estimator = estimator
+            cls._loading = False
+            cls._loaded = True
+            callbacks, cls._callbacks = cls._callbacks, []
+        if estimator is None:
+            return
+        for callback in callbacks:
+            try:
+                callback(estimator)
+            except Exception as e:
+                print(f"更换token估算器错误: {e}")
+
+
+def default_estimator(on_ready=None):
+    """优先使用tiktoken，加载完成前或未安装时使用本地估算；tiktoken加载成功后回调on_ready(估算器)"""
+    return EstimatorLoader.get(on_ready)
+
+
+# ========== 对话历史 ==========
+
+class ConversationHistory:
+    """对话历史管理器 - 按token预算裁剪发送给模型的历史，并清理旧消息中的图片"""
+
+    IMAGE_PLACEHOLDER = "[图片已省略]"
+
+    def __init__(self, system_prompt, estimator=None, max_messages=40, keep_image_turns=1):
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.max_messages = max_messages
+        self.keep_image_turns = keep_image_turns
+        self.entries = []  # [{'message': dict, 'tokens': int}]，不含系统提示词
+        self._lock = threading.RLock()  # 多个AI请求可能同时读写历史
+        with self._lock:
+            # 未指定估算器时先用本地估算，tiktoken在后台加载完成后重新计算
+            self.estimator = estimator or default_estimator(on_ready=self.set_estimator)
+            self.system_tokens = self.estimator.count_message(self.system_message)
+
+    def set_estimator(self, estimator):
+        """更换token估算器并重新计算缓存"""
+        with self._lock:
+            self.estimator = estimator
+            self.system_tokens = estimator.count_message(self.system_message)
+            for entry in self.entries:
+                entry['tokens'] = estimator.count_message(entry['message'])
+
+    def append(self, message):
+        """添加一条消息（token数在添加时计算并缓存）"""
+        with self._lock:
+            self.entries.append({'message': message, 'tokens': self.estimator.count_message(message)})
+            self._strip_stale_images()
+
+            # 限制内存中保留的消息数量
+            if len(self.entries) > self.max_messages:
+                self.entries = self.entries[-self.max_messages:]
+                # 保证历史不以助手消息开头
+                while self.entries and self.entries[0]['message']['role'] != 'user':
+                    self.entries.pop(0)
+
+    def extend(self, messages):
+        """连续添加多条消息（如一问一答），期间其他请求不会插入"""
+        with self._lock:
+            for message in messages:
+                self.append(message)
+
+    def clear(self):
+        """清除对话历史（保留系统提示词）"""
+        with self._lock:
+            self.entries = []
+
+    def __len__(self):
+        return len(self.entries) + 1
+
+    @property
+    def messages(self):
+        """完整历史（含系统提示词）"""
+        return [self.system_message] + [entry['message'] for entry in self.entries]
+
+    def total_tokens(self):
+        """完整历史的估算token数"""
+        return self.system_tokens + sum(entry['tokens'] for entry in self.entries)
+
+    def build(self, token_budget, pending=None):
+        """构建发送给模型的消息列表：从最新消息向前保留，直到达到token预算
+
+        pending为尚未加入历史的新消息（请求完成后再append），总是保留；
+        被裁剪的开头若为助手消息也一并去掉，保证以用户消息开始。
+        历史中的图片句柄在此时才编码为data URL。
+        """
+        with self._lock:
+            entries = list(self.entries)
+        entries += [{'message': message, 'tokens': self.estimator.count_message(message)}
+                    for message in (pending or [])]
+        remaining = token_budget - self.system_tokens
+        selected = []
+        for entry in reversed(entries):
+            if selected and entry['tokens'] > remaining:
+                break
+            selected.append(entry)
+            remaining -= entry['tokens']
+        selected.reverse()
+        while len(selected) > 1 and selected[0]['message']['role'] != 'user':
+            selected.pop(0)
+        return [self.system_message] + [ImageCache.resolve_message(entry['message']) for entry in selected]
+
+    def _strip_stale_images(self):
+        """将较早用户消息中的图片替换为文字占位，只保留最近keep_image_turns条消息的图片"""
+        user_turns = 0
+        for entry in reversed(self.entries):
+            message = entry['message']
+            if message['role'] != 'user':
+                continue
+            user_turns += 1
+            if user_turns <= self.keep_image_turns or not isinstance(message.get('content'), list):
+                continue
+            if not any(part.get('type') in TokenEstimator.IMAGE_TYPES for part in message['content']):
+                continue
+            entry['message'] = self._without_images(message)
+            entry['tokens'] = self.estimator.count_message(entry['message'])
+
+    def _without_images(self, message):
+        """返回去掉图片内容后的消息副本"""
+        texts = []
+        image_count = 0
+        for part in message['content']:
+            if part.get('type') in TokenEstimator.IMAGE_TYPES:
+                image_count += 1
+            elif part.get('type') == 'text':
+                texts.append(part.get('text', ''))
+        placeholder = self.IMAGE_PLACEHOLDER if image_count == 1 else f"[{image_count}张图片已省略]"
+        return {"role": message['role'], "content": "\n".join([placeholder] + texts)}
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from openai import BadRequestError, NotFoundError
+
+
+class DocumentFileCache:
+    """文档文件ID缓存 - 按(内容哈希, 文件大小)记录已上传文档的远程文件ID，重复提问时无需再次上传"""
+
+    CACHE_FILE = Path("Mindra_data") / "document_file_cache.json"
+    EXPIRY = 7 * 24 * 3600  # 文件ID有效期（秒），过期后重新上传
+    REVALIDATE_INTERVAL = 3600  # 距上次确认超过该时间（秒）时，先向服务端确认文件仍然存在
+
+    _lock = threading.Lock()
+    _entries = None  # {缓存键: {'file_id', 'filename', 'uploaded_at', 'validated_at'}}
+    _hash_memo = {}  # {(路径, mtime, 大小): 内容哈希}
+
+    @classmethod
+    def get_file_id(cls, client, path):
+        """获取文档的远程文件ID：命中缓存且仍有效时直接返回，否则上传并记录"""
+        key = cls._cache_key(client, path)
+        entry = cls._lookup(key)
+        if entry and cls._validate(client, key, entry):
+            return entry['file_id']
+
+        file_object = client.files.create(file=Path(path), purpose="file-extract")
+        now = time.time()
+        with cls._lock:
+            cls._entries[key] = {
+                'file_id': file_object.id,
+                'filename': Path(path).name,
+                'uploaded_at': now,
+                'validated_at': now
+            }
+            cls._save()
+        return file_object.id
+
+    @classmethod
+    def invalidate(cls, file_id):
+        """移除指定文件ID的缓存（服务端拒绝该文件时调用）"""
+        with cls._lock:
+            cls._load()
+            keys = [key for key, entry in cls._entries.items() if entry['file_id'] == file_id]
+            for key in keys:
+                del cls._entries[key]
+            if keys:
+                cls._save()
+
+    @staticmethod
+    def is_file_rejected(error):
+        """服务端是否因文件不存在或已失效而拒绝请求（超时、限流、服务端错误等临时失败不算）"""
+        if isinstance(error, NotFoundError):
+            return True
+        return isinstance(error, BadRequestError) and 'file' in str(error).lower()
+
+    @classmethod
+    def clear(cls):
+        """清空缓存"""
+        with cls._lock:
+            cls._entries = {}
+            cls._save()
+
+    @classmethod
+    def _lookup(cls, key):
+        """查找未过期的缓存记录"""
+        with cls._lock:
+            cls._load()
+            entry = cls._entries.get(key)
+            if entry and time.time() - entry['uploaded_at'] > cls.EXPIRY:
+                del cls._entries[key]
+                cls._save()
+                entry = None
+            return dict(entry) if entry else None
+
+    @classmethod
+    def _validate(cls, client, key, entry):
+        """确认服务端文件仍然存在；文件已失效时移除缓存记录，临时失败时继续使用"""
+        if time.time() - entry['validated_at'] < cls.REVALIDATE_INTERVAL:
+            return True
+        try:
+            client.files.retrieve(entry['file_id'])
+        except Exception as e:
+            if not cls.is_file_rejected(e):
+                print(f"确认文档文件失败，继续使用缓存 {entry['filename']}: {e}")
+                return True
+            print(f"缓存的文档文件已失效 {entry['filename']}: {e}")
+            cls.invalidate(entry['file_id'])
+            return False
+
+        with cls._lock:
+            if key in cls._entries:
+                cls._entries[key]['validated_at'] = time.time()
+                cls._save()
+        return True
+
+    @classmethod
+    def _cache_key(cls, client, path):
+        """缓存键：服务地址 + 内容哈希 + 文件大小（不同服务地址的文件ID互不通用）"""
+        stat = os.stat(path)
+        memo_key = (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+        digest = cls._hash_memo.get(memo_key)
+        if digest is None:
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(block)
+            digest = sha256.hexdigest()
+            cls._hash_memo[memo_key] = digest
+        return f"{client.base_url}|{digest}|{stat.st_size}"
+
+    @classmethod
+    def _load(cls):
+        """首次使用时从文件加载缓存，需持有锁"""
+        if cls._entries is not None:
+            return
+        cls._entries = {}
+        if cls.CACHE_FILE.exists():
+            try:
+                with open(cls.CACHE_FILE, 'r', encoding='utf-8') as f:
+                    cls._entries = json.load(f)
+            except Exception as e:
+                print(f"加载文档文件缓存错误: {e}")
+
+    @classmethod
+    def _save(cls):
+        """写入缓存文件（先写临时文件再替换），需持有锁"""
+        try:
+            cls.CACHE_FILE.parent.mkdir(exist_ok=True)
+            temp_file = cls.CACHE_FILE.with_name(cls.CACHE_FILE.name + ".tmp")
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(cls._entries, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, cls.CACHE_FILE)
+        except Exception as e:
+            print(f"保存文档文件缓存错误: {e}")
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from config_manager import ConfigManager
+from user_operations import UserOperations
+
+try:
+    import numpy as np
+except ImportError:  # 未安装numpy时不启用浏览历史检索
+    np = None
+
+
+class HistoryEmbeddingIndex:
+    """浏览历史向量索引 - 后台批量计算访问过的页面正文的向量，存入内存映射文件，对话时检索最相关的历史页面
+
+    向量归一化后按行追加到float32文件，页面信息保存在JSON中（行数以JSON为准，文件末尾多余的数据忽略）。
+    同一URL内容变化时原位更新向量；页面数超过上限时淘汰最早访问的页面。
+    """
+
+    INDEX_DIR = Path("Mindra_data") / "history_index"
+    META_FILE = INDEX_DIR / "meta.json"
+    VECTORS_FILE = INDEX_DIR / "vectors.f32"
+    FLUSH_INTERVAL = 3.0  # 等待凑满一批的最长时间（秒）
+    EVICT_RATIO = 0.1  # 超过上限时一次淘汰的页面比例，避免每次新增都重写向量文件
+
+    def __init__(self, client_provider):
+        self.client_provider = client_provider  # 返回当前OpenAI客户端的函数（配置变化时客户端会重建）
+        self._queue = []  # 待计算向量的页面
+        self._condition = threading.Condition()
+        self._lock = threading.RLock()  # 保护索引数据和向量文件
+        self._stopped = False
+        self._meta = None  # {'model', 'dim', 'rows': [{'url', 'title', 'snippet', 'digest', 'visited_at'}]}
+        self._row_of = {}  # {url: 行号}
+        self._matrix = None  # 内存映射的向量矩阵，写入后重新打开
+        self._thread = None
+
+    @staticmethod
+    def available():
+        """是否已启用且安装了numpy"""
+        return np is not None and ConfigManager.get().retrieval.enabled
+
+    def add_page(self, url, title, text):
+        """将访问过的页面加入待索引队列（在界面线程中调用，不阻塞）"""
+        if not self.available() or not text:
+            return
+        with self._condition:
+            if self._stopped:
+                return
+            self._queue.append({'url': url, 'title': title, 'text': text,
+                                'visited_at': datetime.now().isoformat()})
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="history-index", daemon=True)
+                self._thread.start()
+            # 第一个页面唤醒后台线程开始计时，凑满一批时立即处理
+            if len(self._queue) == 1 or len(self._queue) >= ConfigManager.get().retrieval.batch_size:
+                self._condition.notify()
+
+    def search(self, query, top_k=None, exclude_urls=()):
+        """检索与查询最相关的历史页面（在AI工作线程中调用），返回[{'url', 'title', 'snippet', 'score'}]
+
+        历史页面数量有限，直接对内存映射的矩阵做一次矩阵乘法取前k个
+        """
+        if not self.available() or not query:
+            return []
+        settings = ConfigManager.get().retrieval
+        with self._lock:
+            self._load()
+            if not self._meta['rows'] or self._meta['model'] != settings.embedding_model:
+                return []
+        try:
+            query_vector = self._embed([query])[0]
+        except Exception as e:
+            print(f"计算检索向量失败: {e}")
+            return []
+
+        with self._lock:
+            matrix = self._open_matrix()
+            rows = list(self._meta['rows'])
+            if matrix is None or matrix.shape[1] != query_vector.shape[0]:
+                return []
+            scores = np.array(matrix @ query_vector)
+            excluded = [self._row_of[url] for url in exclude_urls if url in self._row_of]
+
+        # 先排除已引用的页面和低于阈值的页面，再取前k个
+        scores[excluded] = -np.inf
+        candidates = np.flatnonzero(scores >= settings.min_score)
+        top_k = top_k or settings.top_k
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        results = []
+        for index in sorted(candidates, key=lambda i: -scores[i]):
+            row = rows[index]
+            results.append({'url': row['url'], 'title': row['title'], 'snippet': row['snippet'],
+                            'score': float(scores[index])})
+        return results
+
+    def shutdown(self):
+        """停止后台线程（未处理的页面丢弃，程序退出时调用）"""
+        with self._condition:
+            self._stopped = True
+            self._queue.clear()
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        """后台线程：凑满一批或等待超时后批量计算向量"""
+        while True:
+            with self._condition:
+                while not self._stopped and not self._queue:
+                    self._condition.wait()
+                batch_size = ConfigManager.get().retrieval.batch_size
+                if not self._stopped and len(self._queue) < batch_size:
+                    self._condition.wait(self.FLUSH_INTERVAL)
+                if self._stopped:
+                    return
+                batch = self._queue[:batch_size]
+                del self._queue[:len(batch)]
+            try:
+                self._index_batch(batch)
+            except Exception as e:
+                print(f"索引浏览历史失败: {e}")
+
+    def _index_batch(self, batch):
+        """计算一批页面的向量并写入索引，内容未变化的页面跳过"""
+        settings = ConfigManager.get().retrieval
+        pages = {}
+        for page in batch:
+            # 同一批中重复的URL只保留最后一次访问
+            embed_text = f"{page['title']}\n{page['text'][:settings.embed_chars]}"
+            page['digest'] = hashlib.sha256(embed_text.encode('utf-8')).hexdigest()
+            page['embed_text'] = embed_text
+            pages[page['url']] = page
+
+        with self._lock:
+            self._load()
+            if self._meta['model'] != settings.embedding_model:
+                self._reset(settings.embedding_model)
+            changed = []
+            for page in pages.values():
+                row = self._row_of.get(page['url'])
+                if row is not None and self._meta['rows'][row]['digest'] == page['digest']:
+                    self._meta['rows'][row]['visited_at'] = page['visited_at']
+                else:
+                    changed.append(page)
+        if not changed:
+            with self._lock:
+                self._save_meta()
+            return
+
+        vectors = self._embed([page['embed_text'] for page in changed])
+        with self._lock:
+            self._write(changed, vectors)
+            if len(self._meta['rows']) > settings.max_pages:
+                self._evict(len(self._meta['rows']) - int(settings.max_pages * (1 - self.EVICT_RATIO)))
+            self._save_meta()
+
+    def _embed(self, texts):
+        """批量计算归一化向量并记录credit使用情况"""
+        model = ConfigManager.get().retrieval.embedding_model
+        response = self.client_provider().embeddings.create(model=model, input=texts)
+        vectors = np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)],
+                           dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+
+        usage = getattr(response, 'usage', None)
+        if usage is not None and usage.prompt_tokens:
+            user_info = UserOperations.load_user_info()
+            if user_info and user_info['user_id']:
+                UserOperations.record_credit_usage(user_info['user_id'], model, usage.prompt_tokens, 0)
+        return vectors
+
+    def _write(self, pages, vectors):
+        """写入向量：已有的URL原位更新，新URL追加到文件末尾，需持有锁"""
+        rows = self._meta['rows']
+        if self._meta['dim'] != vectors.shape[1]:
+            if rows:
+                # 向量维度变化（更换了模型参数），重新建立索引
+                self._reset(self._meta['model'])
+                rows = self._meta['rows']
+            self._meta['dim'] = int(vectors.shape[1])
+
+        self.INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        appended = []
+        for page, vector in zip(pages, vectors):
+            info = {'url': page['url'], 'title': page['title'], 'digest': page['digest'],
+                    'snippet': page['text'][:ConfigManager.get().retrieval.context_chars],
+                    'visited_at': page['visited_at']}
+            row = self._row_of.get(page['url'])
+            if row is None:
+                appended.append((info, vector))
+                continue
+            rows[row] = info
+            self._matrix = None
+            matrix = np.memmap(self.VECTORS_FILE, dtype=np.float32, mode='r+', shape=(len(rows), self._meta['dim']))
+            matrix[row] = vector
+            matrix.flush()
+            del matrix
+
+        if appended:
+            # 先释放只读映射：Windows上无法截断仍被映射的文件
+            self._matrix = None
+            with open(self.VECTORS_FILE, 'r+b' if self.VECTORS_FILE.exists() else 'wb') as f:
+                # 从有效行末尾开始写，覆盖上次中断时遗留的数据
+                f.seek(len(rows) * self._meta['dim'] * 4)
+                for info, vector in appended:
+                    f.write(vector.astype(np.float32).tobytes())
+                    self._row_of[info['url']] = len(rows)
+                    rows.append(info)
+                f.truncate()
+
+    def _evict(self, count):
+        """淘汰最早访问的count个页面并重写向量文件，需持有锁"""
+        rows = self._meta['rows']
+        order = sorted(range(len(rows)), key=lambda i: rows[i]['visited_at'])
+        keep = sorted(order[count:])
+        matrix = np.array(self._open_matrix()[keep])
+        self._matrix = None
+        temp_file = self.VECTORS_FILE.with_name(self.VECTORS_FILE.name + ".tmp")
+        matrix.tofile(temp_file)
+        os.replace(temp_file, self.VECTORS_FILE)
+        self._meta['rows'] = [rows[i] for i in keep]
+        self._row_of = {row['url']: index for index, row in enumerate(self._meta['rows'])}
+
+    def _open_matrix(self):
+        """以只读方式内存映射向量文件，需持有锁"""
+        rows = len(self._meta['rows'])
+        if self._matrix is None and rows:
+            self._matrix = np.memmap(self.VECTORS_FILE, dtype=np.float32, mode='r', shape=(rows, self._meta['dim']))
+        return self._matrix
+
+    def _reset(self, model):
+        """清空索引，需持有锁"""
+        self._matrix = None
+        self._meta = {'model': model, 'dim': 0, 'rows': []}
+        self._row_of = {}
+        if self.VECTORS_FILE.exists():
+            self.VECTORS_FILE.unlink()
+
+    def _load(self):
+        """首次使用时加载索引，文件损坏或不完整时重新建立，需持有锁"""
+        if self._meta is not None:
+            return
+        model = ConfigManager.get().retrieval.embedding_model
+        self._meta = {'model': model, 'dim': 0, 'rows': []}
+        if not self.META_FILE.exists():
+            return
+        try:
+            with open(self.META_FILE, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            expected_size = len(meta['rows']) * meta['dim'] * 4
+            if not self.VECTORS_FILE.exists() or self.VECTORS_FILE.stat().st_size < expected_size:
+                raise ValueError("向量文件不完整")
+            self._meta = meta
+            self._row_of = {row['url']: index for index, row in enumerate(meta['rows'])}
+        except Exception as e:
+            print(f"加载浏览历史索引错误，重新建立: {e}")
+            self._reset(model)
+
+    def _save_meta(self):
+        """写入页面信息（先写临时文件再替换），需持有锁"""
+        try:
+            self.INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            temp_file = self.META_FILE.with_name(self.META_FILE.name + ".tmp")
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._meta, f, ensure_ascii=False)
+            os.replace(temp_file, self.META_FILE)
+        except Exception as e:
+            print(f"保存浏览历史索引错误: {e}")
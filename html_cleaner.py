@@ -0,0 +1,49 @@
+import html
+import re
+
+
+class HTMLTextCleaner:
+    """HTML转文本 - 一遍扫描去除不可见元素、注释和标签，同时解码实体"""
+
+    BODY_OPEN_PATTERN = re.compile(r'<body\b[^>]*>', re.IGNORECASE)
+    BODY_CLOSE_PATTERN = re.compile(r'</body\s*>', re.IGNORECASE)
+    # 不可见元素（连同内容）、注释和标签整体匹配；唯一的分组为实体，split后奇数位置为实体或None（标签）
+    TOKEN_PATTERN = re.compile(
+        r'<(?:(?:script|style|noscript|iframe|object|embed)\b.*?'
+        r'</(?:script|style|noscript|iframe|object|embed)\s*|!--.*?--|[^>]+)>'
+        r'|(&(?:[a-zA-Z][a-zA-Z0-9]*|#[0-9]+|#[xX][0-9a-fA-F]+);)',
+        re.IGNORECASE | re.DOTALL)
+    TAG_PATTERN = re.compile(r'<[^>]+>')
+    CLOSE_TAG_PATTERN = re.compile(r'</[^>]+>')
+
+    MIN_TEXT_LENGTH = 100  # body中的文本短于该长度时改用整个文档的文本
+
+    _decoded = {None: ' '}  # {实体: 解码结果}，标签替换为空格；网页中的实体种类很少
+
+    @classmethod
+    def looks_like_html(cls, content):
+        """是否包含成对的HTML标签"""
+        return (cls.TAG_PATTERN.search(content) is not None and
+                cls.CLOSE_TAG_PATTERN.search(content) is not None)
+
+    @classmethod
+    def to_text(cls, content):
+        """提取HTML中的文本：优先使用body内容，body中文本过少时使用整个文档"""
+        body_open = cls.BODY_OPEN_PATTERN.search(content)
+        if body_open is not None:
+            body_close = cls.BODY_CLOSE_PATTERN.search(content, body_open.end())
+            text = cls._strip(content[body_open.end():body_close.start() if body_close else len(content)])
+            if len(text) >= cls.MIN_TEXT_LENGTH:
+                return text
+        return cls._strip(content)
+
+    @classmethod
+    def _strip(cls, content):
+        """去除标签、解码实体并合并空白"""
+        pieces = cls.TOKEN_PATTERN.split(content)
+        tokens = pieces[1::2]
+        decoded = cls._decoded
+        for entity in set(tokens).difference(decoded):
+            decoded[entity] = html.unescape(entity)
+        pieces[1::2] = map(decoded.__getitem__, tokens)
+        return ' '.join(''.join(pieces).split())
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class ImageCache:
+    """图片缓存 - 按文件内容哈希存储上传的图片，对话历史中只保存句柄，发送时再编码为data URL"""
+
+    CACHE_DIR = Path("Mindra_data") / "image_cache"
+    MAX_CACHE_BYTES = 200 * 1024 * 1024  # 磁盘缓存上限，超出后删除最久未使用的图片
+    ENCODED_CACHE_SIZE = 4  # 内存中保留的已编码data URL数量
+
+    MIME_TYPES = {
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'png': 'image/png',
+        'gif': 'image/gif',
+        'webp': 'image/webp',
+        'bmp': 'image/bmp'
+    }
+
+    _lock = threading.Lock()
+    _encoded = OrderedDict()  # {handle: data_url}
+
+    @classmethod
+    def add_file(cls, path):
+        """将图片文件加入缓存，返回句柄（内容哈希+扩展名）；读取失败返回None"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except Exception as e:
+            print(f"读取图片失败: {e}")
+            return None
+
+        ext = Path(path).suffix.lstrip('.').lower() or 'png'
+        if ext == 'jpg':
+            ext = 'jpeg'
+        return cls.add_bytes(data, ext)
+
+    @classmethod
+    def add_bytes(cls, data, ext):
+        """将图片数据加入缓存，返回句柄；相同内容只保存一份"""
+        handle = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        cache_file = cls.CACHE_DIR / handle
+        try:
+            if cache_file.exists():
+                cache_file.touch()
+            else:
+                cls.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                temp_file = cache_file.with_name(cache_file.name + ".tmp")
+                with open(temp_file, 'wb') as f:
+                    f.write(data)
+                temp_file.replace(cache_file)
+                cls._prune()
+        except Exception as e:
+            print(f"写入图片缓存失败: {e}")
+            return None
+        return handle
+
+    @classmethod
+    def data_url(cls, handle):
+        """根据句柄获取图片的data URL（按需编码，最近使用的结果保留在内存中）"""
+        with cls._lock:
+            if handle in cls._encoded:
+                cls._encoded.move_to_end(handle)
+                return cls._encoded[handle]
+
+        try:
+            with open(cls.CACHE_DIR / handle, 'rb') as f:
+                data = f.read()
+        except Exception as e:
+            print(f"读取图片缓存失败: {e}")
+            return None
+
+        ext = handle.rsplit('.', 1)[-1]
+        mime_type = cls.MIME_TYPES.get(ext, f"image/{ext}")
+        url = f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+        with cls._lock:
+            cls._encoded[handle] = url
+            while len(cls._encoded) > cls.ENCODED_CACHE_SIZE:
+                cls._encoded.popitem(last=False)
+        return url
+
+    @classmethod
+    def image_part(cls, handle):
+        """对话历史中使用的图片引用"""
+        return {"type": "image_ref", "handle": handle}
+
+    @classmethod
+    def resolve_message(cls, message):
+        """将消息中的图片引用替换为可发送给模型的image_url；图片丢失时替换为文字占位"""
+        content = message.get('content')
+        if not isinstance(content, list) or not any(part.get('type') == 'image_ref' for part in content):
+            return message
+
+        parts = []
+        for part in content:
+            if part.get('type') != 'image_ref':
+                parts.append(part)
+                continue
+            url = cls.data_url(part['handle'])
+            if url:
+                parts.append({"type": "image_url", "image_url": {"url": url}})
+            else:
+                parts.append({"type": "text", "text": "[图片已失效]"})
+        return {**message, "content": parts}
+
+    @classmethod
+    def _prune(cls):
+        """磁盘缓存超过上限时，按最后使用时间删除旧图片"""
+        files = [f for f in cls.CACHE_DIR.iterdir() if f.is_file() and not f.name.endswith('.tmp')]
+        total = sum(f.stat().st_size for f in files)
+        if total <= cls.MAX_CACHE_BYTES:
+            return
+        for f in sorted(files, key=lambda f: f.stat().st_mtime):
+            if total <= cls.MAX_CACHE_BYTES:
+                break
+            try:
+                size = f.stat().st_size
+                f.unlink()
+                total -= size
+            except OSError as e:
+                print(f"清理图片缓存失败: {e}")
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from config_manager import ConfigManager
+from image_cache import ImageCache
+
+
+class ImagePreprocessor:
+    """图片预处理 - 上传给视觉模型前缩小尺寸并重新压缩，在后台线程池中执行"""
+
+    MAX_WORKERS = 2
+
+    _executor = None
+    _lock = threading.Lock()
+    _file_memo = {}  # {(路径, mtime, 大小, 配置): 句柄}
+    _content_memo = {}  # {(原图哈希, 配置): 句柄}
+    _pending = {}  # {(路径, mtime, 大小, 配置): Future}
+
+    @classmethod
+    def _get_executor(cls):
+        """获取后台线程池（首次使用时创建）"""
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=cls.MAX_WORKERS,
+                                                   thread_name_prefix="image-preprocess")
+            return cls._executor
+
+    @classmethod
+    def submit(cls, path):
+        """提交图片预处理任务，返回结果为缓存句柄的Future；同一文件未修改时直接复用结果"""
+        options = ConfigManager.get().images
+        try:
+            stat = os.stat(path)
+            key = (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size, options)
+        except OSError as e:
+            print(f"读取图片失败: {e}")
+            future = Future()
+            future.set_result(None)
+            return future
+
+        executor = cls._get_executor()
+        with cls._lock:
+            if key in cls._file_memo:
+                future = Future()
+                future.set_result(cls._file_memo[key])
+                return future
+            if key in cls._pending:
+                return cls._pending[key]
+            future = executor.submit(cls._process, path, options)
+            cls._pending[key] = future
+        future.add_done_callback(lambda f: cls._on_done(key, f))
+        return future
+
+    @classmethod
+    def _on_done(cls, key, future):
+        """记录处理结果"""
+        with cls._lock:
+            cls._pending.pop(key, None)
+            if not future.cancelled() and future.exception() is None and future.result():
+                cls._file_memo[key] = future.result()
+
+    @classmethod
+    def image_part(cls, path):
+        """构建待处理的图片消息片段，并立即开始后台处理"""
+        cls.submit(path)
+        return {"type": "image_file", "path": path}
+
+    @classmethod
+    def resolve_content(cls, content):
+        """等待消息中的图片处理完成，将image_file片段替换为图片缓存引用（需在工作线程中调用）"""
+        if not isinstance(content, list):
+            return content
+        parts = []
+        for part in content:
+            if part.get('type') != 'image_file':
+                parts.append(part)
+                continue
+            try:
+                handle = cls.submit(part['path']).result()
+            except Exception as e:
+                print(f"图片预处理失败: {e}")
+                handle = ImageCache.add_file(part['path'])
+            if handle:
+                parts.append(ImageCache.image_part(handle))
+        return parts
+
+    @classmethod
+    def shutdown(cls):
+        """关闭后台线程池，取消尚未开始的任务"""
+        with cls._lock:
+            executor = cls._executor
+            cls._executor = None
+            for future in cls._pending.values():
+                future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @classmethod
+    def _process(cls, path, options):
+        """解码、缩放并重新编码图片，结果存入图片缓存"""
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        digest = hashlib.sha256(data).hexdigest()
+        with cls._lock:
+            if (digest, options) in cls._content_memo:
+                return cls._content_memo[(digest, options)]
+
+        encoded, ext = cls._recompress(data, options)
+        if encoded is None:
+            # 无法解码或编码时直接使用原图
+            ext = Path(path).suffix.lstrip('.').lower() or 'png'
+            handle = ImageCache.add_bytes(data, 'jpeg' if ext == 'jpg' else ext)
+        else:
+            handle = ImageCache.add_bytes(encoded, ext)
+
+        if handle:
+            with cls._lock:
+                cls._content_memo[(digest, options)] = handle
+        return handle
+
+    @classmethod
+    def _recompress(cls, data, options):
+        """返回(编码后的数据, 扩展名)；缩放后仍不比原图小时返回(None, None)"""
+        # QImage可以在非GUI线程中使用（QPixmap不行）
+        from PySide6.QtCore import QBuffer, QByteArray, QIODevice, Qt
+        from PySide6.QtGui import QImage, QPainter
+
+        image = QImage.fromData(data)
+        if image.isNull():
+            return None, None
+
+        resized = max(image.width(), image.height()) > options.max_edge
+        if resized:
+            image = image.scaled(options.max_edge, options.max_edge,
+                                 Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        for fmt in dict.fromkeys([options.format.lower(), 'jpeg']):
+            source = image
+            if fmt == 'jpeg' and image.hasAlphaChannel():
+                # JPEG不支持透明通道，透明区域填充为白色
+                source = QImage(image.size(), QImage.Format_RGB32)
+                source.fill(Qt.white)
+                painter = QPainter(source)
+                painter.drawImage(0, 0, image)
+                painter.end()
+
+            byte_array = QByteArray()
+            buffer = QBuffer(byte_array)
+            buffer.open(QIODevice.WriteOnly)
+            saved = source.save(buffer, fmt.upper(), options.quality)
+            buffer.close()
+            if not saved:
+                continue
+
+            encoded = bytes(byte_array.data())
+            if not resized and len(encoded) >= len(data):
+                return None, None
+            return encoded, fmt
+        return None, None
@@ -16,7 +16,11 @@ from cookie_manager import CookieManager
 from more_dialog import MoreDialog
 from settings_dialog import SettingsDialog
 from style_settings import MenuStyles, MainWindowStyles
-from user_operations import LoginDialog, UserOperations
+from user_operations import LoginDialog, UserOperations, DBConnectionPool, CreditLedger
+from config_manager import ConfigManager
+from image_processor import ImagePreprocessor
+from page_content_cache import PageContentCache
+from history_index import HistoryEmbeddingIndex
 import html as html_module
 import os
 
@@ -218,6 +222,12 @@ class BrowserWindow(QMainWindow):
         # 加载保存的cookie
         self.cookie_manager.load_cookies()
         
+        # 启动credit使用记录写入服务（同时补写上次未完成的记录）
+        CreditLedger.get_instance()
+        
+        # 监听config.yaml变化，修改后自动重新加载配置
+        ConfigManager.start_watching()
+        
     def ensure_more_dialog(self):
         """确保更多对话框已创建"""
         if not hasattr(self, 'more_dialog') or self.more_dialog is None:
@@ -340,7 +350,7 @@ class BrowserWindow(QMainWindow):
         browser.titleChanged.connect(lambda title: self.update_tab_title(browser, title))
         browser.urlChanged.connect(lambda url: self.update_url_bar(url))
         browser.loadProgress.connect(self.update_progress)
-        browser.loadFinished.connect(self.page_loaded)
+        browser.loadFinished.connect(lambda ok: self.page_loaded(browser, ok))
 
         # 添加上下文菜单
         browser.setContextMenuPolicy(Qt.CustomContextMenu)
@@ -492,6 +502,9 @@ class BrowserWindow(QMainWindow):
                     else:
                         # 普通网页浏览器
                         self.url_bar.setText(url)
+                    
+                    # 切换到的页面重新开始停留计时
+                    self.ai_sidebar.page_presummarizer.schedule(current_widget.page())
                 
     def update_url_bar(self, url):
         """更新地址栏"""
@@ -523,11 +536,26 @@ class BrowserWindow(QMainWindow):
             self.statusBar().showMessage("页面加载完成")
             QTimer.singleShot(1000, lambda: self.statusBar().clearMessage())
             
-    def page_loaded(self):
+    def page_loaded(self, browser, ok):
         """页面加载完成"""
         self.statusBar().showMessage("页面加载完成")
         QTimer.singleShot(1000, lambda: self.statusBar().clearMessage())
         
+        # AI侧边栏打开时预先提取网页正文，总结和引用网页时直接使用
+        if ok and ConfigManager.get().cache.prefetch_pages and self.ai_sidebar.isVisible() and \
+                browser.url().scheme() in ('http', 'https'):
+            PageContentCache.extract(browser.page())
+        
+        # 当前页面开始停留计时，停留足够久时在后台预先总结
+        if ok and browser is self.tabs.currentWidget():
+            self.ai_sidebar.page_presummarizer.schedule(browser.page())
+            
+            # 与历史记录相同，只索引在当前标签页中访问的网页
+            if HistoryEmbeddingIndex.available() and browser.url().scheme() in ('http', 'https'):
+                url, title = browser.url().toString(), browser.title()
+                PageContentCache.extract(browser.page(),
+                                         lambda text: self.ai_sidebar.history_index.add_page(url, title, text))
+        
     def toggle_ai_sidebar(self):
         """切换AI侧边栏显示/隐藏"""
         if self.ai_toggle_btn.isChecked():
@@ -710,6 +738,14 @@ class BrowserWindow(QMainWindow):
         """窗口关闭事件"""
         # 保存cookie
         self.cookie_manager.save_cookies()
+        # 停止进行中的AI请求、后台预总结和浏览历史索引
+        self.ai_sidebar.ai_pool.shutdown()
+        self.ai_sidebar.page_presummarizer.shutdown()
+        self.ai_sidebar.history_index.shutdown()
+        # 写入剩余的credit使用记录，再关闭数据库连接池
+        CreditLedger.shutdown()
+        DBConnectionPool.shutdown()
+        ImagePreprocessor.shutdown()
         event.accept()
 
 
@@ -753,6 +789,10 @@ class BrowserPage(QWebEnginePage):
         self.parent = parent
         self.browser_view = browser_view
         
+        # 页面加载代数，每次开始加载时更新，区分同一URL的不同加载
+        self.load_generation = 0
+        self.loadStarted.connect(lambda: PageContentCache.begin_load(self))
+        
     def is_video_site(self, url):
         """判断URL是否是视频网站"""
         try:
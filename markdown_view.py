@@ -0,0 +1,149 @@
+import re
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QMenu, QApplication
+from PySide6.QtCore import Qt, Signal
+
+
+class MarkdownBlockSplitter:
+    """Markdown分块 - 按空行（代码块之外）切分出已完成的块"""
+
+    FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+    # 只按\n分行（str.splitlines还会在\u2028、\x0c、单独的\r等处分行，导致位置偏移）；末尾不完整的行不匹配
+    LINE_PATTERN = re.compile(r'[^\n]*\n')
+
+    @classmethod
+    def split_closed(cls, text, start=0):
+        """从start处扫描，返回(已完成的块列表, 未完成块的起始位置, 未完成块是否处于未闭合的围栏代码块中)
+
+        块在空行之后出现新的非缩进行时结束；缩进行视为上一块（如列表项）的延续；
+        围栏代码块内部的空行不切分；末尾不完整的行不参与判断。
+        """
+        blocks = []
+        block_start = start
+        pos = start
+        fence = None
+        saw_blank = False
+
+        for match in cls.LINE_PATTERN.finditer(text, start):
+            line = match.group()
+            stripped = line.strip()
+
+            if fence:
+                # 围栏代码块内，直到出现相同字符且不短于开始标记的结束行
+                if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                    fence = None
+                pos += len(line)
+                continue
+
+            if saw_blank and stripped and line[0] not in ' \t':
+                if text[block_start:pos].strip():
+                    blocks.append(text[block_start:pos])
+                block_start = pos
+            saw_blank = not stripped
+
+            fence_match = cls.FENCE_PATTERN.match(line)
+            if fence_match:
+                fence = fence_match.group(1)
+            pos += len(line)
+
+        return blocks, block_start, fence is not None
+
+
+class MarkdownMessageView(QWidget):
+    """流式Markdown消息视图 - 已完成的块各自渲染一次并保留排版，只重新渲染最后一个未完成的块
+
+    每个块是独立的标签，鼠标拖选不能跨块；右键菜单提供"复制全部"复制整条消息的Markdown原文。
+    """
+
+    linkActivated = Signal(str)
+
+    def __init__(self, font, style="color: black;", interaction_flags=Qt.TextSelectableByMouse, parent=None):
+        super().__init__(parent)
+        self._font = font
+        self._style = style
+        self._interaction_flags = interaction_flags
+
+        self._layout = QVBoxLayout(self)
+        self._layout.setContentsMargins(0, 0, 0, 0)
+        self._layout.setSpacing(4)
+
+        self._text = ""  # 已接收的全部文本
+        self._tail_start = 0  # 未完成块在文本中的起始位置
+        self._block_labels = []  # 已完成块的标签
+        self._tail_rendered = ""  # 未完成块当前显示的文本
+        self._tail_label = self._create_label()
+        self._layout.addWidget(self._tail_label)
+
+    def _create_label(self, text=""):
+        """创建单个块的Markdown标签"""
+        label = QLabel()
+        label.setFont(self._font)
+        label.setStyleSheet(self._style)
+        label.setWordWrap(True)
+        label.setTextInteractionFlags(self._interaction_flags)
+        label.setOpenExternalLinks(False)
+        label.setTextFormat(Qt.MarkdownText)
+        label.linkActivated.connect(self.linkActivated)
+        label.setContextMenuPolicy(Qt.CustomContextMenu)
+        label.customContextMenuRequested.connect(lambda pos, l=label: self._show_context_menu(l, pos))
+        label.setText(text)
+        return label
+
+    def _show_context_menu(self, label, pos):
+        """右键菜单：复制选中内容或整条消息"""
+        menu = QMenu(label)
+        copy_selected = menu.addAction("复制")
+        copy_selected.setEnabled(label.hasSelectedText())
+        copy_selected.triggered.connect(lambda: QApplication.clipboard().setText(label.selectedText()))
+        copy_all = menu.addAction("复制全部")
+        copy_all.setEnabled(bool(self._text))
+        copy_all.triggered.connect(lambda: QApplication.clipboard().setText(self._text))
+        menu.exec(label.mapToGlobal(pos))
+
+    def text(self):
+        return self._text
+
+    def setText(self, text):
+        """设置文本；新文本以当前文本开头时只追加增量，否则重新渲染"""
+        if text.startswith(self._text):
+            self.appendText(text[len(self._text):])
+        else:
+            self.clear()
+            self.appendText(text)
+
+    def appendText(self, delta):
+        """追加文本：新完成的块生成独立标签，未完成块重新渲染"""
+        if not delta:
+            return
+        self._text += delta
+
+        blocks, self._tail_start, in_fence = MarkdownBlockSplitter.split_closed(self._text, self._tail_start)
+        for block in blocks:
+            label = self._create_label(block.rstrip())
+            self._layout.insertWidget(self._layout.count() - 1, label)
+            self._block_labels.append(label)
+
+        tail = self._text[self._tail_start:]
+        if in_fence:
+            # 未闭合的代码块可能很长，只在有新的完整行时重新渲染
+            tail = tail[:tail.rfind('\n') + 1]
+        if tail != self._tail_rendered:
+            self._tail_rendered = tail
+            self._tail_label.setText(tail)
+
+    def finish(self):
+        """流式输出结束：显示未闭合代码块中尚未显示的末尾不完整行"""
+        tail = self._text[self._tail_start:]
+        if tail != self._tail_rendered:
+            self._tail_rendered = tail
+            self._tail_label.setText(tail)
+
+    def clear(self):
+        """清空内容"""
+        for label in self._block_labels:
+            self._layout.removeWidget(label)
+            label.deleteLater()
+        self._block_labels = []
+        self._text = ""
+        self._tail_start = 0
+        self._tail_rendered = ""
+        self._tail_label.setText("")
@@ -0,0 +1,102 @@
+import itertools
+import threading
+from collections import OrderedDict
+from config_manager import ConfigManager
+from page_extractor import PageExtractor
+
+
+class PageContentCache:
+    """网页正文缓存 - 按(URL, 页面加载代数)缓存提取出的正文，供页面总结、引用网页等AI功能共用
+
+    页面每次开始加载时获得新的代数并淘汰上一次加载的缓存；同一页面同时只执行一次提取脚本。
+    只在界面线程中调用extract和begin_load。
+    """
+
+    _lock = threading.Lock()
+    _entries = OrderedDict()  # {(url, 代数): 正文}，按最近使用排序
+    _total_chars = 0
+    _pending = {}  # {(url, 代数): [等待提取结果的回调]}
+    _live_generations = set()  # 尚未开始新加载的页面代数，只缓存这些代数的提取结果
+    _generation_counter = itertools.count(1)
+
+    @classmethod
+    def begin_load(cls, page):
+        """页面开始加载：淘汰上一次加载的缓存并分配新的代数"""
+        old_generation = getattr(page, 'load_generation', 0)
+        generation = next(cls._generation_counter)
+        page.load_generation = generation
+        with cls._lock:
+            cls._live_generations.discard(old_generation)
+            cls._live_generations.add(generation)
+            for key in [key for key in cls._entries if key[1] == old_generation]:
+                cls._remove(key)
+
+    @staticmethod
+    def key_for(page):
+        return page.url().toString(), getattr(page, 'load_generation', 0)
+
+    @classmethod
+    def get(cls, key):
+        """获取缓存的正文，未命中返回None"""
+        with cls._lock:
+            text = cls._entries.get(key)
+            if text is not None:
+                cls._entries.move_to_end(key)
+            return text
+
+    @classmethod
+    def extract(cls, page, callback=None):
+        """获取页面正文：命中缓存时立即回调，否则在页面中执行提取脚本，完成后回调callback(text)"""
+        key = cls.key_for(page)
+        text = cls.get(key)
+        if text is not None:
+            if callback:
+                callback(text)
+            return
+
+        callbacks = cls._pending.get(key)
+        if callbacks is not None:
+            # 同一页面的提取正在进行，等待结果
+            if callback:
+                callbacks.append(callback)
+            return
+        cls._pending[key] = [callback] if callback else []
+        page.runJavaScript(PageExtractor.SCRIPT, lambda result: cls._on_extracted(key, result))
+
+    @classmethod
+    def _on_extracted(cls, key, result):
+        text = PageExtractor.normalize_text(PageExtractor.to_text(result))
+        if text:
+            cls.put(key, text)
+        for callback in cls._pending.pop(key, []):
+            try:
+                callback(text)
+            except Exception as e:
+                print(f"处理页面正文错误: {e}")
+
+    @classmethod
+    def put(cls, key, text):
+        """写入缓存（页面已重新加载时忽略），超过条数或总字符数上限时淘汰最久未使用的"""
+        settings = ConfigManager.get().cache
+        with cls._lock:
+            if key[1] not in cls._live_generations:
+                return
+            if key in cls._entries:
+                cls._remove(key)
+            cls._entries[key] = text
+            cls._total_chars += len(text)
+            while cls._entries and (len(cls._entries) > settings.page_max_entries or
+                                    cls._total_chars > settings.page_max_chars):
+                cls._remove(next(iter(cls._entries)))
+
+    @classmethod
+    def clear(cls):
+        """清空缓存"""
+        with cls._lock:
+            cls._entries.clear()
+            cls._total_chars = 0
+
+    @classmethod
+    def _remove(cls, key):
+        """移除一条缓存（调用方持有锁）"""
+        cls._total_chars -= len(cls._entries.pop(key))
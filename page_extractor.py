@@ -0,0 +1,268 @@
+import re
+
+
+class PageExtractor:
+    """网页正文提取 - 页面内按文本密度和链接密度为DOM块打分，只保留正文的标题、段落、列表等结构"""
+
+    # 在页面中执行的提取脚本（不修改页面DOM），返回{title, blocks}；找不到明显的正文容器时从body提取，
+    # 提取出的文本过短时返回{title, blocks: [], text}，text为body的全部文本
+    SCRIPT = r"""
+    (function() {
+        var body = document.body;
+        if (!body) return null;
+
+        var SKIP_TAGS = /^(SCRIPT|STYLE|NOSCRIPT|TEMPLATE|IFRAME|SVG|CANVAS|VIDEO|AUDIO|OBJECT|EMBED|FORM|BUTTON|SELECT|INPUT|TEXTAREA|NAV|FOOTER|ASIDE|DIALOG)$/;
+        var NEGATIVE = /comment|footer|footnote|sidebar|sponsor|banner|cookie|consent|gdpr|popup|modal|masthead|menu|breadcrumb|share|social|related|recommend|advert|\bads?\b|promo|subscribe|newsletter|pagination|toolbar|widget/i;
+        var POSITIVE = /article|content|entry|main|post|text|story|body|blog|news/i;
+        var BOILERPLATE_ROLES = /^(navigation|banner|contentinfo|complementary|dialog|alert|menu|search)$/;
+        var MIN_TEXT_LENGTH = 200;
+
+        function classWeight(el) {
+            var weight = 0;
+            var names = (el.className && el.className.baseVal === undefined ? el.className : '') + ' ' + (el.id || '');
+            if (NEGATIVE.test(names)) weight -= 25;
+            if (POSITIVE.test(names)) weight += 25;
+            return weight;
+        }
+
+        function isBoilerplate(el) {
+            if (SKIP_TAGS.test(el.tagName)) return true;
+            // 文章内的header通常包含标题和作者信息，页面级header是站点导航
+            if (el.tagName === 'HEADER') return !el.closest('article, main');
+            var role = el.getAttribute('role');
+            if (role && BOILERPLATE_ROLES.test(role)) return true;
+            if (el.getAttribute('aria-hidden') === 'true' || el.hidden) return true;
+            return classWeight(el) < 0 && el.tagName !== 'ARTICLE' && el.tagName !== 'MAIN';
+        }
+
+        // innerText会触发布局计算，每个元素只计算一次
+        var textCache = new Map(), densityCache = new Map(), boilerplateCache = new Map();
+        function textOf(el) {
+            var text = textCache.get(el);
+            if (text === undefined) {
+                text = (el.innerText || el.textContent || '').replace(/\s+/g, ' ').trim();
+                textCache.set(el, text);
+            }
+            return text;
+        }
+
+        function linkDensity(el, length) {
+            if (!length) return 1;
+            var linkLength = densityCache.get(el);
+            if (linkLength === undefined) {
+                linkLength = 0;
+                var links = el.getElementsByTagName('a');
+                for (var i = 0; i < links.length; i++) linkLength += textOf(links[i]).length;
+                densityCache.set(el, linkLength);
+            }
+            return linkLength / length;
+        }
+
+        // 元素自身或任一祖先（不含body）是否为页面框架部分，结果按元素缓存
+        function insideBoilerplate(el) {
+            if (!el || el === body) return false;
+            var result = boilerplateCache.get(el);
+            if (result === undefined) {
+                result = isBoilerplate(el) || insideBoilerplate(el.parentElement);
+                boilerplateCache.set(el, result);
+            }
+            return result;
+        }
+
+        // 1. 为段落的父元素和祖父元素累加分数（Readability算法）
+        var candidates = [];
+        function addScore(el, score) {
+            if (!el || el === document.documentElement) return;
+            if (el._mindraScore === undefined) {
+                var base = {ARTICLE: 10, MAIN: 10, SECTION: 5, DIV: 5, PRE: 3, TD: 3, BLOCKQUOTE: 3}[el.tagName] || 0;
+                el._mindraScore = base + classWeight(el);
+                candidates.push(el);
+            }
+            el._mindraScore += score;
+        }
+
+        var paragraphs = body.querySelectorAll('p, pre, td, blockquote, li, div');
+        for (var i = 0; i < paragraphs.length; i++) {
+            var p = paragraphs[i];
+            // div只在直接包含文字时视为段落
+            if (p.tagName === 'DIV') {
+                var direct = 0;
+                for (var c = p.firstChild; c; c = c.nextSibling) {
+                    if (c.nodeType === 3) direct += c.textContent.trim().length;
+                }
+                if (direct < 25) continue;
+            }
+            if (insideBoilerplate(p)) continue;
+            var text = textOf(p);
+            if (text.length < 25) continue;
+            var score = 1 + text.split(/[,，、]/).length + Math.min(Math.floor(text.length / 100), 3);
+            addScore(p.parentElement, score);
+            if (p.parentElement) addScore(p.parentElement.parentElement, score / 2);
+        }
+
+        // 2. 按链接密度修正后选出得分最高的容器
+        var top = null, topScore = 0;
+        for (var i = 0; i < candidates.length; i++) {
+            var el = candidates[i];
+            var length = textOf(el).length;
+            el._mindraScore *= (1 - linkDensity(el, length));
+            if (el._mindraScore > topScore) { top = el; topScore = el._mindraScore; }
+        }
+        var fallback = !top || textOf(top).length < 200;
+        var roots = fallback ? [body] : [top];
+
+        // 得分接近的兄弟元素也属于正文（如被拆分成多个容器的文章）
+        if (!fallback && top.parentElement) {
+            var threshold = Math.max(10, topScore * 0.2);
+            var siblings = top.parentElement.children;
+            roots = [];
+            for (var i = 0; i < siblings.length; i++) {
+                var sibling = siblings[i];
+                if (sibling === top || (sibling._mindraScore || 0) >= threshold) roots.push(sibling);
+            }
+        }
+        for (var i = 0; i < candidates.length; i++) delete candidates[i]._mindraScore;
+
+        // 3. 序列化为结构化的块：标题、段落、列表、代码、引用
+        var blocks = [];
+        function visible(el) {
+            return el.getClientRects().length > 0;
+        }
+        function walk(el) {
+            if (isBoilerplate(el) || !visible(el)) return;
+            var tag = el.tagName;
+            if (/^H[1-6]$/.test(tag)) {
+                var heading = textOf(el);
+                if (heading) blocks.push({type: 'heading', level: parseInt(tag.charAt(1)), text: heading});
+                return;
+            }
+            if (tag === 'UL' || tag === 'OL') {
+                var length = textOf(el).length;
+                // 以链接为主的列表通常是导航或推荐
+                if (linkDensity(el, length) > 0.5) return;
+                var items = [];
+                for (var i = 0; i < el.children.length; i++) {
+                    if (el.children[i].tagName === 'LI') {
+                        var item = textOf(el.children[i]);
+                        if (item) items.push(item);
+                    }
+                }
+                if (items.length) blocks.push({type: 'list', ordered: tag === 'OL', items: items});
+                return;
+            }
+            if (tag === 'PRE') {
+                var code = (el.innerText || el.textContent || '').replace(/\s+$/, '');
+                if (code) blocks.push({type: 'code', text: code});
+                return;
+            }
+            if (tag === 'BLOCKQUOTE' || tag === 'P' || tag === 'TABLE') {
+                var text = textOf(el);
+                if (text && linkDensity(el, text.length) < 0.5) {
+                    blocks.push({type: tag === 'BLOCKQUOTE' ? 'quote' : 'paragraph', text: text});
+                }
+                return;
+            }
+            // 其他容器：直接包含的文字作为段落，子元素递归处理
+            var pending = '';
+            for (var c = el.firstChild; c; c = c.nextSibling) {
+                if (c.nodeType === 3) {
+                    pending += c.textContent;
+                } else if (c.nodeType === 1) {
+                    var display = window.getComputedStyle(c).display;
+                    if (display.indexOf('inline') === 0 && !c.querySelector('p, div, ul, ol, pre, h1, h2, h3, h4, h5, h6')) {
+                        if (!isBoilerplate(c)) pending += c.innerText || '';
+                        continue;
+                    }
+                    if (pending.trim()) blocks.push({type: 'paragraph', text: pending.replace(/\s+/g, ' ').trim()});
+                    pending = '';
+                    walk(c);
+                }
+            }
+            if (pending.trim()) blocks.push({type: 'paragraph', text: pending.replace(/\s+/g, ' ').trim()});
+        }
+        for (var i = 0; i < roots.length; i++) walk(roots[i]);
+        if (!blocks.length && !fallback) walk(body);
+
+        // 整个页面包在form中或body的class被判为框架（如has-sidebar）时提取不到正文，改用body的全部文本
+        var length = 0;
+        for (var i = 0; i < blocks.length; i++) {
+            length += (blocks[i].text || (blocks[i].items || []).join('')).length;
+        }
+        if (length < MIN_TEXT_LENGTH) {
+            return {title: document.title || '', blocks: [], text: body.innerText || ''};
+        }
+
+        return {title: document.title || '', blocks: blocks};
+    })()
+    """
+
+    MIN_PARAGRAPH_LENGTH = 2  # 短于该长度的段落（如单个符号）丢弃
+    WHITESPACE_PATTERN = re.compile(r'[ \t\u00a0\u3000]+')
+    BLANK_LINES_PATTERN = re.compile(r' ?\n\s*\n\s*')
+    BOILERPLATE_PATTERN = re.compile(
+        r'^(copyright|©|all rights reserved|版权所有|分享到|点击|登录|注册|关注我们|返回顶部|上一篇|下一篇|阅读原文)',
+        re.IGNORECASE)
+
+    @classmethod
+    def to_text(cls, result):
+        """将提取结果转换为精简的Markdown风格文本（段落间保留空行，便于分段）
+
+        result为页面脚本的返回值；提取失败时返回空字符串
+        """
+        if not result:
+            return ""
+        if isinstance(result, str):
+            return result.strip()
+
+        lines = []
+        title = cls._clean(result.get('title', ''))
+        if title:
+            lines.append(f"# {title}")
+
+        # 未提取到足够的正文时使用body的全部文本
+        if result.get('text'):
+            lines.append(result['text'].strip())
+            return "\n\n".join(lines)
+
+        seen = set()
+        for block in result.get('blocks') or []:
+            block_type = block.get('type')
+            if block_type == 'list':
+                items = [cls._clean(item) for item in block.get('items') or []]
+                items = [item for item in items if item]
+                if not items:
+                    continue
+                if block.get('ordered'):
+                    text = "\n".join(f"{index}. {item}" for index, item in enumerate(items, 1))
+                else:
+                    text = "\n".join(f"- {item}" for item in items)
+            elif block_type == 'code':
+                text = f"```\n{block.get('text', '')}\n```"
+            else:
+                text = cls._clean(block.get('text', ''))
+                if len(text) < cls.MIN_PARAGRAPH_LENGTH or cls.BOILERPLATE_PATTERN.match(text):
+                    continue
+                if block_type == 'heading':
+                    if text == title:
+                        continue
+                    text = "#" * min(int(block.get('level') or 2) + 1, 6) + " " + text
+                elif block_type == 'quote':
+                    text = f"> {text}"
+
+            # 相同的块（如重复的标题或提示）只保留一次
+            if text in seen:
+                continue
+            seen.add(text)
+            lines.append(text)
+
+        return "\n\n".join(lines)
+
+    @classmethod
+    def normalize_text(cls, text):
+        """合并行内多余空白和连续空行，保留段落结构"""
+        text = cls.WHITESPACE_PATTERN.sub(' ', text or '')
+        return cls.BLANK_LINES_PATTERN.sub('\n\n', text).strip()
+
+    @classmethod
+    def _clean(cls, text):
+        return cls.WHITESPACE_PATTERN.sub(' ', text or '').strip()
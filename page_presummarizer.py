@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from PySide6.QtCore import QObject, QTimer
+from config_manager import ConfigManager
+from page_content_cache import PageContentCache
+from page_extractor import PageExtractor
+from page_summarizer import PageSummarizer
+from response_cache import ResponseCache
+from user_operations import UserOperations
+
+
+class PagePresummarizer(QObject):
+    """后台页面预总结 - 用户在页面停留一段时间且没有进行中的AI请求时，用text_parsing模型预先生成总结并写入回复缓存
+
+    预总结使用与点击"总结"完全相同的提示词，按text_parsing模型单独缓存，点击时显示并标明生成的模型；
+    每天的用量不超过配置的credit上限，按最大用量预留，未生成总结时退回。
+    """
+
+    BUDGET_FILE = Path("Mindra_data") / "presummarize_budget.json"
+    RETRY_DELAY = 5  # 有进行中的AI请求时，延后多少秒再尝试
+
+    def __init__(self, ai_sidebar, parent=None):
+        super().__init__(parent)
+        self.ai_sidebar = ai_sidebar
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-presummarize")
+        self.page = None  # 等待停留计时结束的页面
+        self.page_key = None
+        self.in_progress = set()  # 正在预总结的缓存键
+        self._lock = threading.Lock()
+
+        self.dwell_timer = QTimer(self)
+        self.dwell_timer.setSingleShot(True)
+        self.dwell_timer.timeout.connect(self._on_dwell)
+
+    def schedule(self, page):
+        """页面加载完成或切换到该页面时开始停留计时"""
+        settings = ConfigManager.get().summarize
+        if not settings.background_enabled or page.url().scheme() not in ('http', 'https'):
+            self.dwell_timer.stop()
+            self.page = None
+            return
+        self.page = page
+        self.page_key = PageContentCache.key_for(page)
+        self.dwell_timer.start(int(settings.background_delay * 1000))
+
+    def shutdown(self):
+        """停止计时并取消尚未开始的预总结（关闭窗口时调用）"""
+        self.dwell_timer.stop()
+        self.page = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _on_dwell(self):
+        """停留计时结束：页面仍在前台且未重新加载时提取正文"""
+        page = self.page
+        if page is None:
+            return
+        current_browser = self.ai_sidebar.parent.tabs.currentWidget() if self.ai_sidebar.parent else None
+        if current_browser is None or current_browser.page() is not page or \
+                PageContentCache.key_for(page) != self.page_key:
+            return
+
+        # 只在空闲时运行，不与前台请求争用连接和并发数
+        if self.ai_sidebar.ai_pool.running or self.ai_sidebar.ai_pool.queue:
+            self.dwell_timer.start(self.RETRY_DELAY * 1000)
+            return
+        self.page = None
+        PageContentCache.extract(page, self._on_page_text)
+
+    def _on_page_text(self, text):
+        """提交后台预总结（提示词构建和分段也在后台线程中进行）"""
+        if not text or not text.strip():
+            return
+        try:
+            self.executor.submit(self._prepare, text)
+        except RuntimeError:
+            # 已关闭
+            pass
+
+    def _prepare(self, text):
+        """按点击"总结"时的方式构建提示词，未缓存且预算充足时生成总结（在后台线程中执行）"""
+        text = PageExtractor.normalize_text(text)
+        if not text:
+            return
+        prompt, plan = PageSummarizer.summary_prompt(text)
+        cache_key = ResponseCache.key_for_presummary(prompt)
+        with self._lock:
+            if cache_key in self.in_progress or ResponseCache.contains(cache_key) or \
+                    ResponseCache.contains(ResponseCache.key_for_request(prompt)):
+                return
+
+        # 后台全部使用text_parsing模型，按计划的最大用量预留预算
+        credit = UserOperations.calculate_credit_usage(ConfigManager.get().models.text_parsing,
+                                                       plan['input_tokens'], plan['output_tokens'])
+        if not self._reserve_budget(credit):
+            return
+
+        with self._lock:
+            self.in_progress.add(cache_key)
+        self._summarize(self.ai_sidebar.client, prompt, cache_key, credit)
+
+    def _summarize(self, client, prompt, cache_key, credit):
+        """在后台线程中生成总结（长网页先分段总结再汇总）并写入回复缓存；未生成总结时退回预留的预算"""
+        summary = ""
+        try:
+            user_info = UserOperations.load_user_info()
+            user_id = user_info['user_id'] if user_info else None
+            if user_id and not UserOperations.check_credit_balance(user_id, 0.001):
+                return
+
+            model = ConfigManager.get().models.text_parsing
+            content = PageSummarizer.resolve_content(client, prompt)
+            response = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": content}],
+                temperature=0.7,
+                max_tokens=PageSummarizer.REDUCE_OUTPUT_TOKENS
+            )
+            usage = response.usage
+            if user_id and usage is not None and (usage.prompt_tokens or usage.completion_tokens):
+                UserOperations.record_credit_usage(user_id, model, usage.prompt_tokens, usage.completion_tokens)
+
+            summary = response.choices[0].message.content if response.choices else ""
+            if summary:
+                ResponseCache.put(cache_key, summary)
+        except Exception as e:
+            print(f"后台预总结失败: {e}")
+        finally:
+            with self._lock:
+                self.in_progress.discard(cache_key)
+            if not summary:
+                self._refund_budget(credit)
+
+    def _reserve_budget(self, credit):
+        """从当天的预总结预算中预留credit，超出上限时返回False"""
+        limit = ConfigManager.get().summarize.background_daily_credit
+        today = date.today().isoformat()
+        with self._lock:
+            budget = self._load_budget()
+            spent = budget['spent'] if budget.get('date') == today else 0.0
+            if spent + credit > limit:
+                return False
+            self._save_budget({'date': today, 'spent': round(spent + credit, 6)})
+            return True
+
+    def _refund_budget(self, credit):
+        """退回当天预留的预算（跨天后无需退回）"""
+        today = date.today().isoformat()
+        with self._lock:
+            budget = self._load_budget()
+            if budget.get('date') == today:
+                self._save_budget({'date': today, 'spent': round(max(budget['spent'] - credit, 0.0), 6)})
+
+    def _load_budget(self):
+        """读取当天已用的预总结预算，需持有锁"""
+        if self.BUDGET_FILE.exists():
+            try:
+                with open(self.BUDGET_FILE, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"加载预总结预算错误: {e}")
+        return {}
+
+    def _save_budget(self, budget):
+        """写入预算文件（先写临时文件再替换），需持有锁"""
+        try:
+            self.BUDGET_FILE.parent.mkdir(exist_ok=True)
+            temp_file = self.BUDGET_FILE.with_name(self.BUDGET_FILE.name + ".tmp")
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(budget, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.BUDGET_FILE)
+        except Exception as e:
+            print(f"保存预总结预算错误: {e}")
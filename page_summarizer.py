@@ -0,0 +1,221 @@
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from config_manager import ConfigManager
+from conversation_history import default_estimator
+from user_operations import UserOperations
+
+
+class TextChunker:
+    """文本分段 - 按段落和句子边界把长文本切分成不超过token上限的片段"""
+
+    PARAGRAPH_PATTERN = re.compile(r'\n\s*\n')
+    SENTENCE_PATTERN = re.compile(r'(?<=[。！？；.!?;])\s*')
+
+    def __init__(self, estimator=None):
+        self.estimator = estimator or default_estimator(on_ready=self.set_estimator)
+
+    def set_estimator(self, estimator):
+        """更换token估算器（tiktoken在后台加载完成后调用）"""
+        self.estimator = estimator
+
+    def split(self, text, max_tokens, max_chunks=None):
+        """切分文本，返回(片段列表, 是否因达到max_chunks而截断)"""
+        chunks = []
+        current = []
+        current_tokens = 0
+        for piece in self._pieces(text, max_tokens):
+            tokens = self.estimator.count_text(piece)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current = []
+                current_tokens = 0
+                # 达到上限后不再继续切分剩余文本
+                if max_chunks is not None and len(chunks) >= max_chunks:
+                    return chunks, True
+            current.append(piece)
+            current_tokens += tokens
+        if current:
+            chunks.append("\n".join(current))
+        return chunks, False
+
+    def _pieces(self, text, max_tokens):
+        """段落过长时按句子切分，句子仍过长时按字符硬切"""
+        for paragraph in self.PARAGRAPH_PATTERN.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if self.estimator.count_text(paragraph) <= max_tokens:
+                yield paragraph
+                continue
+            for sentence in self.SENTENCE_PATTERN.split(paragraph):
+                if not sentence:
+                    continue
+                if self.estimator.count_text(sentence) <= max_tokens:
+                    yield sentence
+                else:
+                    # 按每个字符最多1个token估算硬切
+                    for start in range(0, len(sentence), max_tokens):
+                        yield sentence[start:start + max_tokens]
+
+
+class PageSummarizer:
+    """长网页分段总结 - 用text_parsing模型并行提取各段要点（map），再由对话模型汇总成最终回复（reduce）"""
+
+    SUMMARY_INSTRUCTION = "请总结以下网页内容，提取关键信息："
+    MAP_PROMPT = "以下是一篇网页内容的第{index}/{total}段，请用简洁的要点列出这一段的关键信息：\n\n{chunk}"
+    MAP_PROMPT_TOKENS = 40  # 分段提示词本身的估算token数
+    REDUCE_OUTPUT_TOKENS = 2000  # 汇总回复的max_tokens，与对话请求一致
+
+    _chunker = None
+
+    @classmethod
+    def chunker(cls):
+        if cls._chunker is None:
+            cls._chunker = TextChunker()
+        return cls._chunker
+
+    @classmethod
+    def plan(cls, text):
+        """切分页面文本并估算用量
+
+        返回{'chunks', 'truncated', 'input_tokens', 'output_tokens', 'credit'}，
+        只有一段时不需要分段总结，用量按直接发送估算
+        """
+        settings = ConfigManager.get()
+        summarize = settings.summarize
+        max_chunks = max(1, summarize.max_input_tokens // summarize.chunk_tokens)
+        chunks, truncated = cls.chunker().split(text, summarize.chunk_tokens, max_chunks)
+        chunk_tokens = sum(cls.chunker().estimator.count_text(chunk) for chunk in chunks)
+
+        models = settings.models
+        if len(chunks) <= 1:
+            input_tokens, output_tokens = chunk_tokens, cls.REDUCE_OUTPUT_TOKENS
+            credit = UserOperations.calculate_credit_usage(models.daily_conversation, input_tokens, output_tokens)
+        else:
+            map_input = chunk_tokens + cls.MAP_PROMPT_TOKENS * len(chunks)
+            map_output = summarize.map_max_tokens * len(chunks)
+            input_tokens = map_input + map_output
+            output_tokens = map_output + cls.REDUCE_OUTPUT_TOKENS
+            credit = (UserOperations.calculate_credit_usage(models.text_parsing, map_input, map_output) +
+                      UserOperations.calculate_credit_usage(models.daily_conversation, map_output,
+                                                            cls.REDUCE_OUTPUT_TOKENS))
+        return {'chunks': chunks, 'truncated': truncated, 'input_tokens': input_tokens,
+                'output_tokens': output_tokens, 'credit': round(credit, 4)}
+
+    @classmethod
+    def summary_prompt(cls, text):
+        """构建页面总结的提示词，返回(prompt, plan)：只有一段时直接包含原文，否则为待分段总结的页面片段"""
+        plan = cls.plan(text)
+        if len(plan['chunks']) <= 1:
+            return f"{cls.SUMMARY_INSTRUCTION}\n\n{text}", plan
+        return [cls.page_part(cls.SUMMARY_INSTRUCTION, plan)], plan
+
+    @staticmethod
+    def describe(plan):
+        """用量估算的显示文本"""
+        text = (f"共{len(plan['chunks'])}段，预计最多约{plan['input_tokens'] + plan['output_tokens']} token，"
+                f"约{plan['credit']} credit")
+        if plan['truncated']:
+            text += "，超出长度上限的部分未包含"
+        return text
+
+    @staticmethod
+    def page_part(label, plan=None, text=None):
+        """构建页面内容消息片段，发送前在工作线程中由resolve_content转换为文本
+
+        分段计划尚未生成时传入页面文本，在工作线程中分段
+        """
+        if plan is None:
+            return {"type": "page_text", "label": label, "text": text or ""}
+        return {"type": "page_text", "label": label, "chunks": plan['chunks']}
+
+    @staticmethod
+    def without_pages(content):
+        """将消息中的页面片段替换为占位文字（写入对话历史和会话记录）"""
+        if not isinstance(content, list):
+            return content
+        return [{"type": "text", "text": f"{part['label']}\n[页面内容已省略]"} if part.get('type') == 'page_text'
+                else part for part in content]
+
+    @classmethod
+    def resolve_content(cls, client, content, progress_callback=None, cancel_event=None):
+        """将消息中的页面片段转换为文本：只有一段时直接使用原文，多段时替换为各段要点
+
+        被取消时返回None
+        """
+        if not isinstance(content, list) or not any(part.get('type') == 'page_text' for part in content):
+            return content
+        resolved = []
+        for part in content:
+            if part.get('type') != 'page_text':
+                resolved.append(part)
+                continue
+            chunks = part['chunks'] if 'chunks' in part else cls.plan(part['text'])['chunks']
+            if len(chunks) <= 1:
+                body = chunks[0] if chunks else "[无法获取页面内容]"
+            else:
+                summaries = cls.summarize_chunks(client, chunks, progress_callback, cancel_event)
+                if summaries is None:
+                    return None
+                body = "（页面较长，以下为各段要点摘要）\n\n" + "\n\n".join(summaries)
+            resolved.append({"type": "text", "text": f"{part['label']}\n{body}"})
+        return resolved
+
+    @classmethod
+    def summarize_chunks(cls, client, chunks, progress_callback=None, cancel_event=None):
+        """并行总结各段并按原顺序返回要点；被取消时返回None
+
+        单段失败时跳过该段，全部失败时抛出异常
+        """
+        settings = ConfigManager.get()
+        total = len(chunks)
+        if progress_callback:
+            progress_callback(0, total, "")
+
+        executor = ThreadPoolExecutor(max_workers=min(settings.summarize.map_workers, total),
+                                      thread_name_prefix="page-summarize")
+        futures = {executor.submit(cls._summarize_chunk, client, settings.models.text_parsing,
+                                   settings.summarize.map_max_tokens, index, total, chunk): index
+                   for index, chunk in enumerate(chunks)}
+        summaries = [None] * total
+        pending = set(futures)
+        try:
+            while pending:
+                # 定时检查取消标记
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                for future in done:
+                    index = futures[future]
+                    try:
+                        summaries[index] = future.result()
+                    except Exception as e:
+                        print(f"分段总结失败 第{index + 1}段: {e}")
+                    if progress_callback:
+                        progress_callback(total - len(pending), total, f"第{index + 1}段")
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        summaries = [summary for summary in summaries if summary]
+        if not summaries:
+            raise RuntimeError("所有分段总结均失败")
+        return summaries
+
+    @classmethod
+    def _summarize_chunk(cls, client, model, max_tokens, index, total, chunk):
+        """总结单段内容并记录credit使用情况"""
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": cls.MAP_PROMPT.format(index=index + 1, total=total, chunk=chunk)}],
+            temperature=0.3,
+            max_tokens=max_tokens
+        )
+        usage = response.usage
+        if usage is not None and (usage.prompt_tokens or usage.completion_tokens):
+            user_info = UserOperations.load_user_info()
+            if user_info and user_info['user_id']:
+                UserOperations.record_credit_usage(user_info['user_id'], model,
+                                                   usage.prompt_tokens, usage.completion_tokens)
+        return response.choices[0].message.content if response.choices else ""
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from config_manager import ConfigManager
+
+
+class ResponseCache:
+    """AI回复缓存 - 按(模型, 规范化提示词哈希, 请求选项)缓存页面总结、划词解释和翻译的回复"""
+
+    WHITESPACE_PATTERN = re.compile(r'\s+')
+
+    _lock = threading.Lock()
+    _entries = OrderedDict()  # {缓存键: {'response', 'thought', 'created_at'}}，按最近使用排序
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def make_key(cls, model, prompt, **options):
+        """生成缓存键：提示词合并空白后计算哈希，选项（如深度思考、联网搜索）参与区分"""
+        if not isinstance(prompt, str):
+            prompt = json.dumps(prompt, ensure_ascii=False, sort_keys=True)
+        normalized = cls.WHITESPACE_PATTERN.sub(' ', prompt).strip()
+        digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        option_text = ",".join(f"{name}={options[name]}" for name in sorted(options))
+        return f"{model}|{digest}|{option_text}"
+
+    @classmethod
+    def key_for_request(cls, prompt, use_deep_thinking=False, use_search=False):
+        """对话请求的缓存键（使用daily_conversation模型）"""
+        model = ConfigManager.get().models.daily_conversation
+        return cls.make_key(model, prompt, deep_thinking=use_deep_thinking, search=use_search)
+
+    @classmethod
+    def key_for_presummary(cls, prompt):
+        """后台预总结的缓存键（使用text_parsing模型，与对话请求的缓存区分）"""
+        model = ConfigManager.get().models.text_parsing
+        return cls.make_key(model, prompt, presummary=True)
+
+    @classmethod
+    def get(cls, key):
+        """获取未过期的缓存回复，返回(response, thought)；未命中返回None"""
+        settings = ConfigManager.get().cache
+        with cls._lock:
+            entry = cls._entries.get(key) if settings.enabled else None
+            if entry and time.time() - entry['created_at'] > settings.response_ttl:
+                del cls._entries[key]
+                entry = None
+            if entry is None:
+                cls.misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls.hits += 1
+            return entry['response'], entry['thought']
+
+    @classmethod
+    def contains(cls, key):
+        """是否有未过期的缓存（不计入命中统计）"""
+        settings = ConfigManager.get().cache
+        with cls._lock:
+            entry = cls._entries.get(key)
+            return entry is not None and time.time() - entry['created_at'] <= settings.response_ttl
+
+    @classmethod
+    def put(cls, key, response, thought=""):
+        """写入缓存，超过容量时淘汰最久未使用的回复"""
+        settings = ConfigManager.get().cache
+        if not settings.enabled or not response:
+            return
+        with cls._lock:
+            cls._entries[key] = {'response': response, 'thought': thought, 'created_at': time.time()}
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > settings.response_max_entries:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def invalidate(cls, key):
+        """移除指定缓存"""
+        with cls._lock:
+            cls._entries.pop(key, None)
+
+    @classmethod
+    def clear(cls):
+        """清空缓存并重置统计"""
+        with cls._lock:
+            cls._entries.clear()
+            cls.hits = 0
+            cls.misses = 0
+
+    @classmethod
+    def stats(cls):
+        """获取缓存统计"""
+        with cls._lock:
+            total = cls.hits + cls.misses
+            return {
+                'entries': len(cls._entries),
+                'hits': cls.hits,
+                'misses': cls.misses,
+                'hit_rate': cls.hits / total if total else 0.0
+            }
@@ -1,12 +1,139 @@
 from PySide6.QtWidgets import (QDialog, QHBoxLayout, QVBoxLayout, QWidget, 
                                QPushButton, QLabel, QStackedWidget, QLineEdit,
-                               QMessageBox, QTableWidget, QTableWidgetItem,
-                               QHeaderView)
-from PySide6.QtCore import Qt
+                               QMessageBox, QTableView, QHeaderView, QAbstractItemView)
+from PySide6.QtCore import Qt, QThread, Signal, QAbstractTableModel, QModelIndex
 from style_settings import DialogStyles, ButtonStyles, InputStyles, MessageStyles
 from user_operations import UserOperations
 
 
+class CreditHistoryLoader(QThread):
+    """credit使用历史分页加载线程（加载首页时同时加载用量汇总）"""
+    page_loaded = Signal(int, list)  # 加载批次号和本页记录
+    summary_loaded = Signal(int, object)  # 加载批次号和用量汇总（失败时为None）
+    
+    SUMMARY_DAYS = 7
+    
+    def __init__(self, generation, user_id, limit, before=None):
+        super().__init__()
+        self.generation = generation
+        self.user_id = user_id
+        self.limit = limit
+        self.before = before
+        
+    def run(self):
+        """线程运行方法"""
+        records = UserOperations.get_credit_usage_history(self.user_id, limit=self.limit, before=self.before)
+        self.page_loaded.emit(self.generation, records)
+        if self.before is None:
+            summary = UserOperations.get_credit_usage_summary(self.user_id, days=self.SUMMARY_DAYS)
+            self.summary_loaded.emit(self.generation, summary)
+
+
+class CreditHistoryModel(QAbstractTableModel):
+    """credit使用历史表格模型 - 滚动到底部时在后台线程按页加载"""
+    summary_loaded = Signal(object)  # 首页加载后的用量汇总
+    
+    PAGE_SIZE = 200
+    HEADERS = ["任务类型", "输入Token", "输出Token", "消耗Credit", "使用时间"]
+    FIELDS = ['assignment', 'input_token_usage', 'output_token_usage', 'credit_usage', 'created_at']
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.user_id = None
+        self.records = []
+        self.exhausted = True  # 是否已加载全部记录
+        self.loading = False
+        self.generation = 0  # 每次重置递增，用于丢弃过期的加载结果
+        self.loaders = []  # 运行中的加载线程，防止被提前回收
+        
+    def reset(self, user_id):
+        """切换用户或清空后重新加载"""
+        self.beginResetModel()
+        self.user_id = user_id
+        self.records = []
+        self.exhausted = user_id is None
+        self.loading = False
+        self.generation += 1
+        self.endResetModel()
+        if self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+        
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.records)
+    
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return str(self.records[index.row()][self.FIELDS[index.column()]])
+        if role == Qt.TextAlignmentRole and index.column() in (1, 2, 3):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+    
+    def canFetchMore(self, parent):
+        if parent.isValid():
+            return False
+        return not self.exhausted and not self.loading
+    
+    def fetchMore(self, parent):
+        """在后台线程加载下一页"""
+        if parent.isValid() or not self.canFetchMore(parent):
+            return
+        self.loading = True
+        before = None
+        if self.records:
+            last = self.records[-1]
+            before = (last['created_at'], last['id'])
+        
+        loader = CreditHistoryLoader(self.generation, self.user_id, self.PAGE_SIZE, before)
+        loader.page_loaded.connect(self.on_page_loaded)
+        loader.summary_loaded.connect(self.on_summary_loaded)
+        loader.finished.connect(lambda l=loader: self.on_loader_finished(l))
+        self.loaders.append(loader)
+        loader.start()
+        
+    def on_page_loaded(self, generation, records):
+        """追加加载完成的一页记录"""
+        if generation != self.generation:
+            return
+        self.loading = False
+        if len(records) < self.PAGE_SIZE:
+            self.exhausted = True
+        if records:
+            start = len(self.records)
+            self.beginInsertRows(QModelIndex(), start, start + len(records) - 1)
+            self.records.extend(records)
+            self.endInsertRows()
+            
+    def on_summary_loaded(self, generation, summary):
+        """转发当前批次的用量汇总"""
+        if generation == self.generation:
+            self.summary_loaded.emit(summary)
+    
+    def on_loader_finished(self, loader):
+        """释放已结束的加载线程"""
+        if loader in self.loaders:
+            self.loaders.remove(loader)
+        loader.deleteLater()
+    
+    def wait_for_loaders(self):
+        """等待所有加载线程结束（关闭窗口时调用）"""
+        for loader in list(self.loaders):
+            loader.wait()
+
+
 class SettingsDialog(QDialog):
     """设置窗口 - 与MoreDialog相同的布局结构"""
     
@@ -447,7 +574,26 @@ class SettingsDialog(QDialog):
         credit_balance_layout.addWidget(self.credit_balance_value)
         layout.addLayout(credit_balance_layout)
         
-        layout.addSpacing(20)
+        # 用量汇总（读取增量维护的汇总表，无需扫描全部记录）
+        summary_title = QLabel("用量汇总")
+        summary_title.setStyleSheet("""
+            font-size: 16px;
+            font-weight: bold;
+            color: #1565c0;
+            padding-bottom: 4px;
+        """)
+        layout.addWidget(summary_title)
+        
+        self.credit_summary_label = QLabel()
+        self.credit_summary_label.setWordWrap(True)
+        self.credit_summary_label.setStyleSheet("""
+            color: #2c3e50;
+            font-weight: normal;
+            font-size: 13px;
+        """)
+        layout.addWidget(self.credit_summary_label)
+        
+        layout.addSpacing(10)
         
         # 用量历史标题和清空按钮
         history_layout = QHBoxLayout()
@@ -470,66 +616,75 @@ class SettingsDialog(QDialog):
         
         layout.addLayout(history_layout)
         
-        # 用量历史表格
-        self.credit_table = QTableWidget()
-        self.credit_table.setColumnCount(5)
-        self.credit_table.setHorizontalHeaderLabels(["任务类型", "输入Token", "输出Token", "消耗Credit", "使用时间"])
+        # 用量历史表格（按页懒加载）
+        self.credit_model = CreditHistoryModel(self)
+        self.credit_model.summary_loaded.connect(self.show_credit_summary)
+        self.credit_table = QTableView()
+        self.credit_table.setModel(self.credit_model)
+        self.credit_table.verticalHeader().setDefaultSectionSize(24)
         
         # 设置列宽
         header = self.credit_table.horizontalHeader()
-        header.setSectionResizeMode(0, QHeaderView.ResizeToContents)
-        header.setSectionResizeMode(1, QHeaderView.ResizeToContents)
-        header.setSectionResizeMode(2, QHeaderView.ResizeToContents)
-        header.setSectionResizeMode(3, QHeaderView.ResizeToContents)
+        # 使用固定列宽：ResizeToContents需要遍历所有行，大量记录时会卡顿
+        header.setSectionResizeMode(0, QHeaderView.Interactive)
+        header.setSectionResizeMode(1, QHeaderView.Interactive)
+        header.setSectionResizeMode(2, QHeaderView.Interactive)
+        header.setSectionResizeMode(3, QHeaderView.Interactive)
         header.setSectionResizeMode(4, QHeaderView.Stretch)
+        self.credit_table.setColumnWidth(0, 90)
+        self.credit_table.setColumnWidth(1, 90)
+        self.credit_table.setColumnWidth(2, 90)
+        self.credit_table.setColumnWidth(3, 90)
         
         # 设置表格属性
-        self.credit_table.setEditTriggers(QTableWidget.NoEditTriggers)
-        self.credit_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.credit_table.setSelectionMode(QTableWidget.ExtendedSelection)
+        self.credit_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.credit_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.credit_table.setSelectionMode(QAbstractItemView.ExtendedSelection)
         
-        # 填充表格数据
+        # 填充表格数据和用量汇总
         if self.user_info and self.user_info['user_id']:
             self.load_credit_history()
+        else:
+            self.credit_summary_label.setText("暂无用量数据")
         
         layout.addWidget(self.credit_table)
         
         return page
     
     def load_credit_history(self):
-        """加载credit使用历史"""
-        # 获取用户credit使用历史
-        history = UserOperations.get_credit_usage_history(self.user_info['user_id'])
-        
-        # 清空表格
-        self.credit_table.setRowCount(0)
+        """加载credit使用历史和用量汇总（首页和汇总在后台线程加载，其余页滚动时按需加载）"""
+        self.credit_summary_label.setText("正在加载用量数据...")
+        self.credit_model.reset(self.user_info['user_id'])
+    
+    def show_credit_summary(self, summary):
+        """显示后台线程加载的用量汇总"""
+        if not summary or summary['totals']['calls'] == 0:
+            self.credit_summary_label.setText("暂无用量数据")
+            return
         
-        # 填充表格
-        for row_idx, record in enumerate(history):
-            self.credit_table.insertRow(row_idx)
-            
-            # 任务类型
-            assignment_item = QTableWidgetItem(record['assignment'])
-            self.credit_table.setItem(row_idx, 0, assignment_item)
-            
-            # 输入Token
-            input_token_item = QTableWidgetItem(str(record['input_token_usage']))
-            input_token_item.setTextAlignment(Qt.AlignRight)
-            self.credit_table.setItem(row_idx, 1, input_token_item)
-            
-            # 输出Token
-            output_token_item = QTableWidgetItem(str(record['output_token_usage']))
-            output_token_item.setTextAlignment(Qt.AlignRight)
-            self.credit_table.setItem(row_idx, 2, output_token_item)
-            
-            # 消耗Credit
-            credit_usage_item = QTableWidgetItem(str(record['credit_usage']))
-            credit_usage_item.setTextAlignment(Qt.AlignRight)
-            self.credit_table.setItem(row_idx, 3, credit_usage_item)
-            
-            # 使用时间
-            created_at_item = QTableWidgetItem(str(record['created_at']))
-            self.credit_table.setItem(row_idx, 4, created_at_item)
+        totals = summary['totals']
+        lines = [
+            f"累计调用 {totals['calls']} 次，输入 {totals['input_token_usage']} Token，"
+            f"输出 {totals['output_token_usage']} Token，消耗 {round(totals['credit_usage'], 4)} Credit"
+        ]
+        
+        # 按任务类型
+        if summary['by_assignment']:
+            parts = [f"{item['name']} {round(item['credit_usage'], 4)}" for item in summary['by_assignment']]
+            lines.append("按任务类型：" + "，".join(parts))
+        
+        # 按模型（旧版本导入的记录没有模型信息）
+        models = [item for item in summary['by_model'] if item['name']]
+        if models:
+            parts = [f"{item['name']} {round(item['credit_usage'], 4)}" for item in models]
+            lines.append("按模型：" + "，".join(parts))
+        
+        # 最近几天
+        recent_credit = sum(item['credit_usage'] for item in summary['daily'])
+        recent_calls = sum(item['calls'] for item in summary['daily'])
+        lines.append(f"最近{CreditHistoryLoader.SUMMARY_DAYS}天：调用 {recent_calls} 次，消耗 {round(recent_credit, 4)} Credit")
+        
+        self.credit_summary_label.setText("\n".join(lines))
     
     def clear_history(self):
         """清空credit使用历史"""
@@ -548,7 +703,7 @@ class SettingsDialog(QDialog):
             result = UserOperations.clear_credit_usage_history(self.user_info['user_id'])
             
             if result:
-                # 更新表格显示
+                # 更新表格和汇总显示
                 self.load_credit_history()
                 msg_box = QMessageBox(QMessageBox.Information, "成功", "使用历史已清空", parent=self)
                 msg_box.setStyleSheet(MessageStyles.get_message_box_style())
@@ -558,6 +713,11 @@ class SettingsDialog(QDialog):
                 msg_box.setStyleSheet(MessageStyles.get_message_box_style())
                 msg_box.exec()
     
+    def closeEvent(self, event):
+        """关闭窗口时等待后台加载线程结束"""
+        self.credit_model.wait_for_loaders()
+        super().closeEvent(event)
+    
     def keyPressEvent(self, event):
         """重写按键事件，忽略Enter键"""
         if event.key() in (Qt.Key_Return, Qt.Key_Enter):
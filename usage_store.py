@@ -0,0 +1,303 @@
+import csv
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class UsageStore:
+    """大模型用量记录存储 - 基于SQLite，按(user_id, created_at)建立索引，并增量维护汇总统计"""
+
+    DB_FILE = Path("Mindra_data") / "llm_history.db"
+    LEGACY_CSV_FILE = Path("Mindra_data") / "llm_history.csv"  # 旧版本的用量记录文件
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, db_file=None):
+        self.db_file = Path(db_file) if db_file else self.DB_FILE
+        self.db_file.parent.mkdir(exist_ok=True)
+
+        # 单连接 + 锁，供GUI线程和后台写入线程共享
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    @classmethod
+    def get_instance(cls):
+        """获取进程内共享的用量存储（首次调用时导入旧版CSV记录）"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    store = cls()
+                    store.import_legacy_csv(cls.LEGACY_CSV_FILE)
+                    cls._instance = store
+        return cls._instance
+
+    def _create_tables(self):
+        """创建数据表和索引"""
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage_records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_id TEXT UNIQUE,
+                    user_id TEXT NOT NULL,
+                    assignment TEXT NOT NULL,
+                    model TEXT NOT NULL DEFAULT '',
+                    input_token_usage INTEGER NOT NULL,
+                    output_token_usage INTEGER NOT NULL,
+                    credit_usage REAL NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_usage_user_time
+                ON usage_records (user_id, created_at, id)
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            
+            # 汇总表：按 用户/日期/任务类型/模型 累计，以及每个用户的总计
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage_rollups (
+                    user_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    assignment TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    calls INTEGER NOT NULL DEFAULT 0,
+                    input_token_usage INTEGER NOT NULL DEFAULT 0,
+                    output_token_usage INTEGER NOT NULL DEFAULT 0,
+                    credit_usage REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, day, assignment, model)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage_totals (
+                    user_id TEXT PRIMARY KEY,
+                    calls INTEGER NOT NULL DEFAULT 0,
+                    input_token_usage INTEGER NOT NULL DEFAULT 0,
+                    output_token_usage INTEGER NOT NULL DEFAULT 0,
+                    credit_usage REAL NOT NULL DEFAULT 0
+                )
+            """)
+            # 插入触发器只在记录真正写入时执行（INSERT OR IGNORE 忽略的重复记录不会重复计入）
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_usage_rollup AFTER INSERT ON usage_records
+                BEGIN
+                    INSERT INTO usage_rollups
+                        (user_id, day, assignment, model, calls,
+                         input_token_usage, output_token_usage, credit_usage)
+                    VALUES (NEW.user_id, substr(NEW.created_at, 1, 10), NEW.assignment, NEW.model, 1,
+                            NEW.input_token_usage, NEW.output_token_usage, NEW.credit_usage)
+                    ON CONFLICT (user_id, day, assignment, model) DO UPDATE SET
+                        calls = calls + 1,
+                        input_token_usage = input_token_usage + excluded.input_token_usage,
+                        output_token_usage = output_token_usage + excluded.output_token_usage,
+                        credit_usage = credit_usage + excluded.credit_usage;
+                    INSERT INTO usage_totals
+                        (user_id, calls, input_token_usage, output_token_usage, credit_usage)
+                    VALUES (NEW.user_id, 1, NEW.input_token_usage, NEW.output_token_usage, NEW.credit_usage)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        calls = calls + 1,
+                        input_token_usage = input_token_usage + excluded.input_token_usage,
+                        output_token_usage = output_token_usage + excluded.output_token_usage,
+                        credit_usage = credit_usage + excluded.credit_usage;
+                END
+            """)
+            
+            # 旧版本数据库中已有记录时，一次性补建汇总数据
+            built = self._conn.execute("SELECT value FROM meta WHERE key = 'rollups_built'").fetchone()
+            if built is None:
+                self._rebuild_rollups()
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('rollups_built', '1')")
+    
+    def _rebuild_rollups(self):
+        """根据明细记录重建汇总表，需在事务中调用"""
+        self._conn.execute("DELETE FROM usage_rollups")
+        self._conn.execute("DELETE FROM usage_totals")
+        self._conn.execute("""
+            INSERT INTO usage_rollups
+                (user_id, day, assignment, model, calls,
+                 input_token_usage, output_token_usage, credit_usage)
+            SELECT user_id, substr(created_at, 1, 10), assignment, model, COUNT(*),
+                   SUM(input_token_usage), SUM(output_token_usage), SUM(credit_usage)
+            FROM usage_records
+            GROUP BY user_id, substr(created_at, 1, 10), assignment, model
+        """)
+        self._conn.execute("""
+            INSERT INTO usage_totals
+                (user_id, calls, input_token_usage, output_token_usage, credit_usage)
+            SELECT user_id, COUNT(*), SUM(input_token_usage), SUM(output_token_usage), SUM(credit_usage)
+            FROM usage_records
+            GROUP BY user_id
+        """)
+
+    def add_records(self, records):
+        """批量写入用量记录；event_id重复的记录会被忽略（保证重试时不重复写入）"""
+        if not records:
+            return
+        rows = [(record.get('event_id'), str(record['user_id']), record['assignment'],
+                 record.get('model', ''), int(record['input_token_usage']),
+                 int(record['output_token_usage']), float(record['credit_usage']),
+                 record['created_at'])
+                for record in records]
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT OR IGNORE INTO usage_records
+                (event_id, user_id, assignment, model, input_token_usage,
+                 output_token_usage, credit_usage, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    def query_records(self, user_id, limit=100, before=None):
+        """按时间倒序分页查询用户记录
+
+        Args:
+            user_id: 用户ID
+            limit: 每页条数，None表示不限制
+            before: 上一页最后一条记录的(created_at, id)，None表示从最新开始
+        """
+        sql = """
+            SELECT id, assignment, model, input_token_usage, output_token_usage,
+                   credit_usage, created_at
+            FROM usage_records
+            WHERE user_id = ?
+        """
+        params = [str(user_id)]
+        if before is not None:
+            sql += " AND (created_at, id) < (?, ?)"
+            params.extend(before)
+        sql += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_records(self, user_id):
+        """获取用户记录总数"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM usage_records WHERE user_id = ?", (str(user_id),)
+            ).fetchone()
+        return row[0]
+
+    def delete_user_records(self, user_id):
+        """删除用户的全部记录（走索引，无需扫描其他用户的数据）"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM usage_records WHERE user_id = ?", (str(user_id),))
+            self._conn.execute("DELETE FROM usage_rollups WHERE user_id = ?", (str(user_id),))
+            self._conn.execute("DELETE FROM usage_totals WHERE user_id = ?", (str(user_id),))
+    
+    def get_totals(self, user_id):
+        """获取用户累计用量（直接读取汇总行）"""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT calls, input_token_usage, output_token_usage, credit_usage
+                FROM usage_totals WHERE user_id = ?
+            """, (str(user_id),)).fetchone()
+        if row is None:
+            return {'calls': 0, 'input_token_usage': 0, 'output_token_usage': 0, 'credit_usage': 0.0}
+        return dict(row)
+    
+    def get_breakdown(self, user_id, by='assignment', since_day=None):
+        """按任务类型或模型分组统计用量
+
+        Args:
+            user_id: 用户ID
+            by: 'assignment' 或 'model'
+            since_day: 起始日期（YYYY-MM-DD），None表示全部
+        """
+        if by not in ('assignment', 'model'):
+            raise ValueError(f"不支持的分组方式: {by}")
+        sql = f"""
+            SELECT {by} AS name, SUM(calls) AS calls,
+                   SUM(input_token_usage) AS input_token_usage,
+                   SUM(output_token_usage) AS output_token_usage,
+                   SUM(credit_usage) AS credit_usage
+            FROM usage_rollups
+            WHERE user_id = ?
+        """
+        params = [str(user_id)]
+        if since_day:
+            sql += " AND day >= ?"
+            params.append(since_day)
+        sql += f" GROUP BY {by} ORDER BY credit_usage DESC"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+    
+    def get_daily_series(self, user_id, since_day=None):
+        """按日期统计用量时间序列（按日期升序）"""
+        sql = """
+            SELECT day, SUM(calls) AS calls,
+                   SUM(input_token_usage) AS input_token_usage,
+                   SUM(output_token_usage) AS output_token_usage,
+                   SUM(credit_usage) AS credit_usage
+            FROM usage_rollups
+            WHERE user_id = ?
+        """
+        params = [str(user_id)]
+        if since_day:
+            sql += " AND day >= ?"
+            params.append(since_day)
+        sql += " GROUP BY day ORDER BY day"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def import_legacy_csv(self, csv_file):
+        """一次性导入旧版本的llm_history.csv，导入完成后重命名原文件"""
+        csv_file = Path(csv_file)
+        if not csv_file.exists():
+            return 0
+
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'legacy_csv_imported'").fetchone()
+
+        count = 0
+        if row is None:
+            try:
+                rows = []
+                with open(csv_file, 'r', encoding='utf-8') as f:
+                    reader = csv.DictReader(f)
+                    for item in reader:
+                        rows.append((str(item['user_id']), item['assignment'],
+                                     int(item['input_token_usage']), int(item['output_token_usage']),
+                                     float(item['credit_usage']), item['created_at']))
+
+                # 导入记录和导入标记在同一事务中提交，避免重复导入
+                with self._lock, self._conn:
+                    self._conn.executemany("""
+                        INSERT INTO usage_records
+                        (user_id, assignment, input_token_usage, output_token_usage,
+                         credit_usage, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, rows)
+                    self._conn.execute(
+                        "INSERT INTO meta (key, value) VALUES ('legacy_csv_imported', ?)",
+                        (str(len(rows)),)
+                    )
+                count = len(rows)
+            except Exception as e:
+                print(f"导入credit使用历史错误: {e}")
+                return 0
+
+        try:
+            csv_file.rename(csv_file.with_name(csv_file.name + ".imported"))
+        except OSError as e:
+            print(f"重命名旧版credit使用历史文件错误: {e}")
+        return count
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
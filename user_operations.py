@@ -1,8 +1,10 @@
 import hashlib
+import os
+import threading
+import time
 import pymysql
 import json
-import csv
-import yaml
+import uuid
 from datetime import datetime, timedelta
 from pathlib import Path
 from pymysql import Error
@@ -10,50 +12,205 @@ from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
                                QLineEdit, QPushButton, QMessageBox)
 from PySide6.QtCore import Qt
 from style_settings import ButtonStyles, InputStyles, MessageStyles
+from config_manager import ConfigManager
+from usage_store import UsageStore
 
 
-class DBConnection:
-    def __init__(self):
-        # Load database configuration from config.yaml
-        config_path = Path("config.yaml")
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-            db_config = config['database']
-            self.host = db_config['host']
-            self.database = db_config['database']
-            self.user = db_config['user']
-            self.password = db_config['password']
+class DBConnectionPool:
+    """数据库连接池 - 进程内共享，线程安全"""
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    def __init__(self, host, database, user, password, min_size=1, max_size=5,
+                 idle_timeout=300, health_check_interval=30, acquire_timeout=10):
+        self.db_settings = None  # 创建该连接池时使用的配置
+        self.host = host
+        self.database = database
+        self.user = user
+        self.password = password
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.idle_timeout = idle_timeout  # 空闲连接最长保留时间（秒）
+        self.health_check_interval = health_check_interval  # 空闲超过该时间的连接在借出前ping检查（秒）
+        self.acquire_timeout = acquire_timeout  # 连接池耗尽时的最长等待时间（秒）
         
-        self.connection = None
-        self.connect()
+        self._idle = []  # [(connection, last_used), ...]，后进先出
+        self._in_use = 0
+        self._closed = False  # close_all后为True，之后归还的连接直接关闭
+        self._condition = threading.Condition()
         
-    def connect(self):
+        # 预先建立最小数量的连接
+        for _ in range(self.min_size):
+            connection = self._create_connection()
+            if connection is None:
+                break
+            self._idle.append((connection, time.monotonic()))
+    
+    @classmethod
+    def get_instance(cls):
+        """获取进程内共享的连接池（数据库配置的值变化后自动重建，其他配置变化不影响）"""
+        db_settings = ConfigManager.get().database
+        instance = cls._instance
+        if instance is None or instance.db_settings != db_settings:
+            with cls._instance_lock:
+                instance = cls._instance
+                if instance is None or instance.db_settings != db_settings:
+                    if instance is not None:
+                        # 关闭旧连接池的空闲连接，借出的连接归还时由旧池关闭
+                        instance.close_all()
+                    pool = db_settings.pool
+                    instance = cls(
+                        host=db_settings.host,
+                        database=db_settings.database,
+                        user=db_settings.user,
+                        password=db_settings.password,
+                        min_size=pool.min_size,
+                        max_size=pool.max_size,
+                        idle_timeout=pool.idle_timeout,
+                        health_check_interval=pool.health_check_interval,
+                        acquire_timeout=pool.acquire_timeout
+                    )
+                    instance.db_settings = db_settings
+                    cls._instance = instance
+        return instance
+    
+    def _create_connection(self):
+        """创建新的数据库连接"""
         try:
-            self.connection = pymysql.connect(
+            return pymysql.connect(
                 host=self.host,
                 database=self.database,
                 user=self.user,
                 password=self.password,
-                cursorclass=pymysql.cursors.DictCursor  # 返回字典格式结果
+                cursorclass=pymysql.cursors.DictCursor,  # 返回字典格式结果
+                autocommit=True  # 避免池化连接长期持有旧事务快照
             )
-            self.connection.ping(reconnect=False)
-            return True
         except Error as e:
             print(f"数据库连接错误: {e}")
-            return False
+            return None
+    
+    def _close_connection(self, connection):
+        """关闭数据库连接"""
+        try:
+            connection.close()
+        except Error as e:
+            print(f"关闭数据库连接错误: {e}")
+    
+    def _evict_idle(self):
+        """回收超过空闲时间的连接（保留最小连接数），需在持有锁时调用"""
+        now = time.monotonic()
+        # 归还的连接追加到列表尾部，因此头部是最久未使用的连接
+        while self._idle and len(self._idle) + self._in_use > self.min_size:
+            connection, last_used = self._idle[0]
+            if now - last_used <= self.idle_timeout:
+                break
+            self._idle.pop(0)
+            self._close_connection(connection)
+    
+    def acquire(self):
+        """从连接池借出一个连接，失败返回None"""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    connection, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print("获取数据库连接超时: 连接池已耗尽")
+                    return None
+                self._condition.wait(remaining)
+        
+        # 网络操作在锁外进行
+        try:
+            if connection is None:
+                connection = self._create_connection()
+            elif time.monotonic() - last_used > self.health_check_interval:
+                # 健康检查：空闲较久的连接可能已被服务端断开，ping并自动重连
+                connection.ping(reconnect=True)
+        except Error as e:
+            print(f"数据库连接健康检查失败: {e}")
+            self._close_connection(connection)
+            connection = self._create_connection()
+        
+        if connection is None:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+        return connection
+    
+    def release(self, connection, discard=False):
+        """归还连接到连接池；discard为True时直接关闭该连接"""
+        if connection is None:
+            return
+        if not discard and not connection.open:
+            discard = True
+        with self._condition:
+            self._in_use -= 1
+            # 连接池已关闭（被新配置的连接池替换或程序退出）时不再保留归还的连接
+            discard = discard or self._closed
+            if not discard:
+                self._idle.append((connection, time.monotonic()))
+            self._evict_idle()
+            self._condition.notify()
+        if discard:
+            self._close_connection(connection)
+    
+    def close_all(self):
+        """关闭连接池：关闭所有空闲连接，之后归还的连接也直接关闭"""
+        with self._condition:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._close_connection(connection)
+            self._idle.clear()
+    
+    @classmethod
+    def shutdown(cls):
+        """关闭共享连接池（程序退出时调用）"""
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.close_all()
+                cls._instance = None
+
+
+class DBConnection:
+    """从连接池借出的数据库会话，支持with语句自动归还"""
+    
+    def __init__(self):
+        self.pool = DBConnectionPool.get_instance()
+        self.connection = None
+        self.connect()
         
-    def disconnect(self):
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 出现数据库错误时丢弃连接，避免将损坏的连接放回池中
+        self.disconnect(discard=isinstance(exc_value, Error))
+        return False
+        
+    def connect(self):
         if self.connection:
-            try:
-                self.connection.close()
-            except Error as e:
-                print(f"关闭数据库连接错误: {e}")
+            return True
+        self.connection = self.pool.acquire()
+        return self.connection is not None
+        
+    def disconnect(self, discard=False):
+        if self.connection:
+            self.pool.release(self.connection, discard=discard)
+            self.connection = None
             
     def get_cursor(self):
         if self.connection:
             try:
-                # 检查连接并自动重连
-                self.connection.ping(reconnect=True)
+                # 连接池在借出时已完成健康检查
                 return self.connection.cursor()
             except Error as e:
                 print(f"获取数据库游标错误: {e}")
@@ -61,6 +218,305 @@ class DBConnection:
         return None
 
 
+class CreditBalanceCache:
+    """用户credit余额本地缓存 - 预检查只做内存比较，过期后在后台与数据库同步"""
+    
+    TTL = 30  # 缓存超过该时间后在后台重新同步（秒）
+    MAX_STALENESS = 120  # 缓存最大可接受陈旧时间，超过后同步查询数据库（秒）
+    
+    _entries = {}  # {user_id: {'balance': float, 'synced_at': float, 'version': int}}
+    _refreshing = set()
+    _lock = threading.Lock()
+    
+    @classmethod
+    def get(cls, user_id):
+        """获取缓存余额，必要时触发同步或后台刷新"""
+        with cls._lock:
+            entry = cls._entries.get(user_id)
+            balance = entry['balance'] if entry else None
+            age = time.monotonic() - entry['synced_at'] if entry else None
+        
+        # 无缓存或超过陈旧上限：同步查询数据库
+        if entry is None or age > cls.MAX_STALENESS:
+            return cls.refresh(user_id)
+        
+        # 超过TTL：先返回缓存值，后台刷新
+        if age > cls.TTL:
+            cls.refresh_async(user_id)
+        return balance
+    
+    @classmethod
+    def set(cls, user_id, balance, version=None):
+        """写入数据库中的最新余额；若同步期间发生过本地扣减则保留本地值"""
+        with cls._lock:
+            entry = cls._entries.get(user_id)
+            if entry and version is not None and entry['version'] != version:
+                return
+            cls._entries[user_id] = {
+                'balance': float(balance),
+                'synced_at': time.monotonic(),
+                'version': entry['version'] if entry else 0
+            }
+    
+    @classmethod
+    def debit(cls, user_id, amount):
+        """乐观扣减本地缓存余额"""
+        with cls._lock:
+            entry = cls._entries.get(user_id)
+            if entry:
+                entry['balance'] = max(entry['balance'] - float(amount), 0)
+                entry['version'] += 1
+    
+    @classmethod
+    def refresh(cls, user_id):
+        """同步查询数据库并更新缓存"""
+        with cls._lock:
+            entry = cls._entries.get(user_id)
+            version = entry['version'] if entry else None
+        balance = UserOperations.fetch_credit_balance(user_id)
+        if balance is None:
+            # 查询失败时沿用旧缓存（若有）
+            return entry['balance'] if entry else None
+        # 扣除已入队但尚未写入数据库的使用量
+        balance = max(float(balance) - CreditLedger.pending_credit(user_id), 0)
+        cls.set(user_id, balance, version)
+        with cls._lock:
+            return cls._entries[user_id]['balance']
+    
+    @classmethod
+    def refresh_async(cls, user_id):
+        """在后台线程刷新缓存，同一用户同时只有一个刷新任务"""
+        with cls._lock:
+            if user_id in cls._refreshing:
+                return
+            cls._refreshing.add(user_id)
+        
+        def worker():
+            try:
+                cls.refresh(user_id)
+            finally:
+                with cls._lock:
+                    cls._refreshing.discard(user_id)
+        
+        threading.Thread(target=worker, daemon=True).start()
+    
+    @classmethod
+    def invalidate(cls, user_id=None):
+        """清除缓存"""
+        with cls._lock:
+            if user_id is None:
+                cls._entries.clear()
+            else:
+                cls._entries.pop(user_id, None)
+
+
+class CreditLedger:
+    """credit使用记录后台写入服务 - 对话结束时只入队，定时或定量批量写入本地用量记录和数据库"""
+    
+    FLUSH_INTERVAL = 2.0  # 定时写入间隔（秒）
+    BATCH_SIZE = 20  # 队列达到该数量时立即写入
+    RETRY_INTERVAL = 10.0  # 数据库写入失败后的重试间隔（秒）
+    SPILL_FILE = Path("Mindra_data") / "credit_ledger_spill.jsonl"  # 未写入事件的落盘队列
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    def __init__(self):
+        self._queue = []  # 待写入的使用事件
+        self._pending_credit = {}  # {user_id: 尚未写入数据库的credit总量}
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()  # 保证同一时间只有一个批次在写入
+        self._stopped = False
+        
+        # 恢复上次未写入的事件（程序崩溃或异常退出时遗留）
+        self._recover_spill()
+        
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    @classmethod
+    def get_instance(cls):
+        """获取进程内共享的写入服务（首次调用时启动后台线程）"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+    
+    @classmethod
+    def pending_credit(cls, user_id):
+        """获取用户已扣减但尚未写入数据库的credit"""
+        if cls._instance is None:
+            return 0
+        with cls._instance._condition:
+            return cls._instance._pending_credit.get(user_id, 0)
+    
+    @classmethod
+    def shutdown(cls):
+        """停止后台线程并写入剩余事件（程序退出时调用）"""
+        with cls._instance_lock:
+            ledger = cls._instance
+            cls._instance = None
+        if ledger is None:
+            return
+        with ledger._condition:
+            ledger._stopped = True
+            ledger._condition.notify()
+        ledger._thread.join(timeout=5)
+        ledger.flush()
+    
+    def enqueue(self, user_id, model, input_tokens, output_tokens, credit_usage):
+        """记录一条使用事件：先追加到落盘队列，再放入内存队列"""
+        event = {
+            'event_id': uuid.uuid4().hex,  # 用于本地用量记录去重，保证重试时不重复写入
+            'user_id': user_id,
+            'model': model,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'credit_usage': credit_usage,
+            'created_at': datetime.now().isoformat()
+        }
+        with self._condition:
+            self._append_spill(event)
+            self._queue.append(event)
+            self._pending_credit[user_id] = self._pending_credit.get(user_id, 0) + credit_usage
+            if len(self._queue) >= self.BATCH_SIZE:
+                self._condition.notify()
+    
+    def _run(self):
+        """后台线程：按时间间隔或队列长度触发写入"""
+        interval = self.FLUSH_INTERVAL
+        while True:
+            with self._condition:
+                if not self._stopped and len(self._queue) < self.BATCH_SIZE:
+                    self._condition.wait(interval)
+                if self._stopped:
+                    return
+            interval = self.FLUSH_INTERVAL if self.flush() else self.RETRY_INTERVAL
+    
+    def flush(self):
+        """写入当前队列中的全部事件，返回是否成功"""
+        with self._flush_lock:
+            with self._condition:
+                batch = list(self._queue)
+            if not batch:
+                return True
+            
+            # 1. 写入本地用量记录（按event_id去重，已写过的事件不会重复写入）
+            try:
+                self._write_usage_records(batch)
+            except Exception as e:
+                print(f"写入credit使用记录错误: {e}")
+                return False
+            
+            # 2. 按用户合并扣减量，在一个事务中批量更新余额
+            totals = {}
+            for event in batch:
+                totals[event['user_id']] = totals.get(event['user_id'], 0) + event['credit_usage']
+            db_ok = self._write_db(totals)
+            
+            # 3. 从队列移除已完成的事件，并重写落盘队列
+            with self._condition:
+                if db_ok:
+                    done_ids = set(id(event) for event in batch)
+                    self._queue = [event for event in self._queue if id(event) not in done_ids]
+                    for user_id, total in totals.items():
+                        remaining = self._pending_credit.get(user_id, 0) - total
+                        if remaining > 1e-9:
+                            self._pending_credit[user_id] = remaining
+                        else:
+                            self._pending_credit.pop(user_id, None)
+                self._rewrite_spill()
+            return db_ok
+    
+    def _write_usage_records(self, events):
+        """将事件批量写入本地用量记录"""
+        models_config = ConfigManager.get().models
+        UsageStore.get_instance().add_records([{
+            'event_id': event.get('event_id'),
+            'user_id': event['user_id'],
+            'assignment': models_config.assignment_of(event['model']),
+            'model': event['model'],
+            'input_token_usage': event['input_tokens'],
+            'output_token_usage': event['output_tokens'],
+            'credit_usage': event['credit_usage'],
+            'created_at': event['created_at']
+        } for event in events])
+    
+    def _write_db(self, totals):
+        """在一个事务中批量扣减用户余额"""
+        try:
+            with DBConnection() as db:
+                cursor = db.get_cursor()
+                if not cursor:
+                    return False
+                
+                try:
+                    db.connection.begin()
+                    # 更新用户credit余额，确保不会变为负数
+                    update_query = "UPDATE users SET credit_balance = GREATEST(credit_balance - %s, 0) WHERE user_id = %s"
+                    cursor.executemany(update_query, [(total, user_id) for user_id, total in totals.items()])
+                    db.connection.commit()
+                except Error:
+                    db.connection.rollback()
+                    raise
+                finally:
+                    cursor.close()
+            return True
+        except Exception as e:
+            print(f"批量更新credit余额错误: {e}")
+            return False
+    
+    def _append_spill(self, event):
+        """追加事件到落盘队列并立即刷盘，需在持有锁时调用"""
+        try:
+            self.SPILL_FILE.parent.mkdir(exist_ok=True)
+            with open(self.SPILL_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            print(f"写入credit落盘队列错误: {e}")
+    
+    def _rewrite_spill(self):
+        """用当前内存队列原子替换落盘队列，需在持有锁时调用"""
+        try:
+            if not self._queue:
+                if self.SPILL_FILE.exists():
+                    self.SPILL_FILE.unlink()
+                return
+            tmp_file = self.SPILL_FILE.with_suffix('.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                for event in self._queue:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.SPILL_FILE)
+        except Exception as e:
+            print(f"重写credit落盘队列错误: {e}")
+    
+    def _recover_spill(self):
+        """从落盘队列恢复未写入的事件"""
+        if not self.SPILL_FILE.exists():
+            return
+        try:
+            with open(self.SPILL_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # 崩溃时可能留下不完整的最后一行
+                        continue
+                    self._queue.append(event)
+                    user_id = event['user_id']
+                    self._pending_credit[user_id] = self._pending_credit.get(user_id, 0) + event['credit_usage']
+        except Exception as e:
+            print(f"恢复credit落盘队列错误: {e}")
+
+
 class LoginDialog(QDialog):
     """登录对话框"""
     
@@ -360,14 +816,6 @@ class UserOperations:
     # 用户信息文件路径
     USER_INFO_FILE = Path("Mindra_data") / "user_info.json"
     
-    @staticmethod
-    def _load_models_config():
-        """加载模型配置"""
-        config_path = Path("config.yaml")
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-            return config['models']
-    
     @staticmethod
     def hash_password(password):
         """密码加密"""
@@ -443,6 +891,7 @@ class UserOperations:
     @staticmethod
     def clear_user_info():
         """清除用户登录信息"""
+        CreditBalanceCache.invalidate()
         try:
             if UserOperations.USER_INFO_FILE.exists():
                 UserOperations.USER_INFO_FILE.unlink()
@@ -455,21 +904,20 @@ class UserOperations:
     def verify_login(username, password):
         """验证用户登录"""
         try:
-            # 连接到 mindra 数据库
-            db = DBConnection()
-            cursor = db.get_cursor()
-            if not cursor:
-                return None
+            # 从连接池获取 mindra 数据库连接
+            with DBConnection() as db:
+                cursor = db.get_cursor()
+                if not cursor:
+                    return None
+                    
+                hashed_password = UserOperations.hash_password(password)
                 
-            hashed_password = UserOperations.hash_password(password)
-            
-            # 查询用户（使用 BINARY 确保区分大小写）
-            query = "SELECT user_id, username FROM users WHERE BINARY username = %s AND BINARY password = %s"
-            cursor.execute(query, (username, hashed_password))
-            result = cursor.fetchone()
-            
-            cursor.close()
-            db.disconnect()
+                # 查询用户（使用 BINARY 确保区分大小写）
+                query = "SELECT user_id, username FROM users WHERE BINARY username = %s AND BINARY password = %s"
+                cursor.execute(query, (username, hashed_password))
+                result = cursor.fetchone()
+                
+                cursor.close()
             
             return result if result else None
             
@@ -481,40 +929,37 @@ class UserOperations:
     def register_user(username, password, activation_code):
         """注册新用户"""
         try:
-            # 连接到 mindra 数据库
-            db = DBConnection()
-            cursor = db.get_cursor()
-            if not cursor:
-                return {'success': False, 'message': '数据库连接失败'}
-            
-            # 检查用户名是否已存在（使用 BINARY 确保区分大小写）
-            check_query = "SELECT user_id FROM users WHERE BINARY username = %s"
-            cursor.execute(check_query, (username,))
-            if cursor.fetchone():
-                cursor.close()
-                db.disconnect()
-                return {'success': False, 'message': '用户名已存在'}
-            
-            # 验证激活码
-            activation_query = "SELECT user_id FROM activation WHERE activation_code = %s"
-            cursor.execute(activation_query, (activation_code,))
-            activation_result = cursor.fetchone()
-            
-            if not activation_result:
+            # 从连接池获取 mindra 数据库连接
+            with DBConnection() as db:
+                cursor = db.get_cursor()
+                if not cursor:
+                    return {'success': False, 'message': '数据库连接失败'}
+                
+                # 检查用户名是否已存在（使用 BINARY 确保区分大小写）
+                check_query = "SELECT user_id FROM users WHERE BINARY username = %s"
+                cursor.execute(check_query, (username,))
+                if cursor.fetchone():
+                    cursor.close()
+                    return {'success': False, 'message': '用户名已存在'}
+                
+                # 验证激活码
+                activation_query = "SELECT user_id FROM activation WHERE activation_code = %s"
+                cursor.execute(activation_query, (activation_code,))
+                activation_result = cursor.fetchone()
+                
+                if not activation_result:
+                    cursor.close()
+                    return {'success': False, 'message': '激活码无效'}
+                
+                user_id = activation_result['user_id']
+                hashed_password = UserOperations.hash_password(password)
+                
+                # 插入用户数据
+                insert_query = "INSERT INTO users (user_id, username, password, credit_balance) VALUES (%s, %s, %s, %s)"
+                cursor.execute(insert_query, (user_id, username, hashed_password, 0))
+                db.connection.commit()
+                
                 cursor.close()
-                db.disconnect()
-                return {'success': False, 'message': '激活码无效'}
-            
-            user_id = activation_result['user_id']
-            hashed_password = UserOperations.hash_password(password)
-            
-            # 插入用户数据
-            insert_query = "INSERT INTO users (user_id, username, password, credit_balance) VALUES (%s, %s, %s, %s)"
-            cursor.execute(insert_query, (user_id, username, hashed_password, 0))
-            db.connection.commit()
-            
-            cursor.close()
-            db.disconnect()
             
             return {'success': True, 'user_id': user_id}
             
@@ -526,36 +971,33 @@ class UserOperations:
     def update_username(user_id, current_password, new_username):
         """更新用户名"""
         try:
-            # 连接到 mindra 数据库
-            db = DBConnection()
-            cursor = db.get_cursor()
-            if not cursor:
-                return {'success': False, 'message': '数据库连接失败'}
-            
-            # 验证当前密码是否正确
-            hashed_current_password = UserOperations.hash_password(current_password)
-            verify_query = "SELECT user_id FROM users WHERE user_id = %s AND BINARY password = %s"
-            cursor.execute(verify_query, (user_id, hashed_current_password))
-            if not cursor.fetchone():
-                cursor.close()
-                db.disconnect()
-                return {'success': False, 'message': '当前密码错误'}
-            
-            # 检查新用户名是否已存在（使用 BINARY 确保区分大小写）
-            check_query = "SELECT user_id FROM users WHERE BINARY username = %s"
-            cursor.execute(check_query, (new_username,))
-            if cursor.fetchone():
+            # 从连接池获取 mindra 数据库连接
+            with DBConnection() as db:
+                cursor = db.get_cursor()
+                if not cursor:
+                    return {'success': False, 'message': '数据库连接失败'}
+                
+                # 验证当前密码是否正确
+                hashed_current_password = UserOperations.hash_password(current_password)
+                verify_query = "SELECT user_id FROM users WHERE user_id = %s AND BINARY password = %s"
+                cursor.execute(verify_query, (user_id, hashed_current_password))
+                if not cursor.fetchone():
+                    cursor.close()
+                    return {'success': False, 'message': '当前密码错误'}
+                
+                # 检查新用户名是否已存在（使用 BINARY 确保区分大小写）
+                check_query = "SELECT user_id FROM users WHERE BINARY username = %s"
+                cursor.execute(check_query, (new_username,))
+                if cursor.fetchone():
+                    cursor.close()
+                    return {'success': False, 'message': '用户名已存在'}
+                
+                # 更新用户名
+                update_query = "UPDATE users SET username = %s WHERE user_id = %s"
+                cursor.execute(update_query, (new_username, user_id))
+                db.connection.commit()
+                
                 cursor.close()
-                db.disconnect()
-                return {'success': False, 'message': '用户名已存在'}
-            
-            # 更新用户名
-            update_query = "UPDATE users SET username = %s WHERE user_id = %s"
-            cursor.execute(update_query, (new_username, user_id))
-            db.connection.commit()
-            
-            cursor.close()
-            db.disconnect()
             
             return {'success': True, 'message': '用户名更新成功'}
             
@@ -567,35 +1009,32 @@ class UserOperations:
     def update_password(user_id, current_password, new_password):
         """更新密码"""
         try:
-            # 连接到 mindra 数据库
-            db = DBConnection()
-            cursor = db.get_cursor()
-            if not cursor:
-                return {'success': False, 'message': '数据库连接失败'}
-            
-            # 验证当前密码是否正确
-            hashed_current_password = UserOperations.hash_password(current_password)
-            verify_query = "SELECT user_id FROM users WHERE user_id = %s AND BINARY password = %s"
-            cursor.execute(verify_query, (user_id, hashed_current_password))
-            if not cursor.fetchone():
-                cursor.close()
-                db.disconnect()
-                return {'success': False, 'message': '当前密码错误'}
-            
-            # 验证新密码长度
-            if len(new_password) < 6:
+            # 从连接池获取 mindra 数据库连接
+            with DBConnection() as db:
+                cursor = db.get_cursor()
+                if not cursor:
+                    return {'success': False, 'message': '数据库连接失败'}
+                
+                # 验证当前密码是否正确
+                hashed_current_password = UserOperations.hash_password(current_password)
+                verify_query = "SELECT user_id FROM users WHERE user_id = %s AND BINARY password = %s"
+                cursor.execute(verify_query, (user_id, hashed_current_password))
+                if not cursor.fetchone():
+                    cursor.close()
+                    return {'success': False, 'message': '当前密码错误'}
+                
+                # 验证新密码长度
+                if len(new_password) < 6:
+                    cursor.close()
+                    return {'success': False, 'message': '新密码长度至少6位'}
+                
+                # 更新密码
+                hashed_new_password = UserOperations.hash_password(new_password)
+                update_query = "UPDATE users SET password = %s WHERE user_id = %s"
+                cursor.execute(update_query, (hashed_new_password, user_id))
+                db.connection.commit()
+                
                 cursor.close()
-                db.disconnect()
-                return {'success': False, 'message': '新密码长度至少6位'}
-            
-            # 更新密码
-            hashed_new_password = UserOperations.hash_password(new_password)
-            update_query = "UPDATE users SET password = %s WHERE user_id = %s"
-            cursor.execute(update_query, (hashed_new_password, user_id))
-            db.connection.commit()
-            
-            cursor.close()
-            db.disconnect()
             
             return {'success': True, 'message': '密码更新成功'}
             
@@ -605,34 +1044,44 @@ class UserOperations:
     
     @staticmethod
     def get_user_credit_balance(user_id):
-        """获取用户credit余额"""
+        """获取用户credit余额（直接查询数据库并刷新本地缓存）"""
+        balance = UserOperations.fetch_credit_balance(user_id)
+        if balance is None:
+            return 0
+        # 扣除已入队但尚未写入数据库的使用量
+        balance = max(float(balance) - CreditLedger.pending_credit(user_id), 0)
+        CreditBalanceCache.set(user_id, balance)
+        return balance
+    
+    @staticmethod
+    def fetch_credit_balance(user_id):
+        """从数据库查询用户credit余额，查询失败返回None"""
         try:
-            # 连接到 mindra 数据库
-            db = DBConnection()
-            cursor = db.get_cursor()
-            if not cursor:
-                return None
-            
-            # 查询用户credit余额
-            query = "SELECT credit_balance FROM users WHERE user_id = %s"
-            cursor.execute(query, (user_id,))
-            result = cursor.fetchone()
-            
-            cursor.close()
-            db.disconnect()
+            # 从连接池获取 mindra 数据库连接
+            with DBConnection() as db:
+                cursor = db.get_cursor()
+                if not cursor:
+                    return None
+                
+                # 查询用户credit余额
+                query = "SELECT credit_balance FROM users WHERE user_id = %s"
+                cursor.execute(query, (user_id,))
+                result = cursor.fetchone()
+                
+                cursor.close()
             
             return result['credit_balance'] if result else 0
             
         except Exception as e:
             print(f"获取credit余额错误: {e}")
-            return 0
+            return None
     
     @staticmethod
     def check_credit_balance(user_id, required_credit=0):
         """检查用户credit余额是否足够"""
         try:
-            # 获取用户credit余额
-            balance = UserOperations.get_user_credit_balance(user_id)
+            # 获取用户credit余额（优先使用本地缓存）
+            balance = CreditBalanceCache.get(user_id)
             
             # 检查余额是否足够
             if balance is not None and balance >= required_credit:
@@ -647,83 +1096,30 @@ class UserOperations:
     @staticmethod
     def calculate_credit_usage(model, input_tokens, output_tokens):
         """计算credit使用量"""
-        # 加载模型配置
-        models_config = UserOperations._load_models_config()
-        
-        # 定义不同模型的token价格
-        model_prices = {
-            models_config['text_parsing']: {"input": 0.0005, "output": 0.002},  # 文本解析
-            models_config['image_parsing']: {"input": 0.002, "output": 0.02},  # 图片解析
-            models_config['daily_conversation']: {"input": 0.004, "output": 0.012}  # 日常对话
-        }
-        
-        # 默认价格
-        input_price = 0.0005
-        output_price = 0.002
+        settings = ConfigManager.get()
         
-        # 如果模型在价格表中，使用对应价格
-        if model in model_prices:
-            input_price = model_prices[model]["input"]
-            output_price = model_prices[model]["output"]
+        # 根据模型对应的任务类型获取token价格，未知模型使用默认价格
+        price = settings.pricing.price_for(settings.models.role_of(model))
         
         # 计算credit使用量
-        input_credit = (input_tokens / 1000) * input_price
-        output_credit = (output_tokens / 1000) * output_price
+        input_credit = (input_tokens / 1000) * price.input
+        output_credit = (output_tokens / 1000) * price.output
         total_credit = input_credit + output_credit
         
         return round(total_credit, 4)
     
-    @staticmethod
-    def get_llm_history_file():
-        """获取大模型历史记录文件路径"""
-        return Path("Mindra_data") / "llm_history.csv"
-    
     @staticmethod
     def record_credit_usage(user_id, model, input_tokens, output_tokens):
-        """记录credit使用情况"""
+        """记录credit使用情况（只入队，不阻塞调用线程）"""
         try:
             # 计算credit使用量
             credit_usage = UserOperations.calculate_credit_usage(model, input_tokens, output_tokens)
             
-            # 加载模型配置
-            models_config = UserOperations._load_models_config()
-            
-            # 定义模型对应的assignment
-            model_assignments = {
-                models_config['text_parsing']: "文本解析",
-                models_config['image_parsing']: "图片解析",
-                models_config['daily_conversation']: "日常对话"
-            }
-            
-            assignment = model_assignments.get(model, "其他")
-            
-            # 记录到CSV文件
-            history_file = UserOperations.get_llm_history_file()
-            history_file.parent.mkdir(exist_ok=True)
-            
-            # 检查文件是否存在，不存在则创建并写入表头
-            file_exists = history_file.exists()
-            
-            with open(history_file, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                if not file_exists:
-                    writer.writerow(['user_id', 'assignment', 'input_token_usage', 'output_token_usage', 'credit_usage', 'created_at'])
-                writer.writerow([user_id, assignment, input_tokens, output_tokens, credit_usage, datetime.now().isoformat()])
-            
-            # 连接到 mindra 数据库更新余额
-            db = DBConnection()
-            cursor = db.get_cursor()
-            if not cursor:
-                return False
-            
-            # 更新用户credit余额，确保不会变为负数
-            update_query = "UPDATE users SET credit_balance = GREATEST(credit_balance - %s, 0) WHERE user_id = %s"
-            cursor.execute(update_query, (credit_usage, user_id))
-            
-            db.connection.commit()
+            # 入队，由后台服务批量写入本地用量记录和数据库
+            CreditLedger.get_instance().enqueue(user_id, model, input_tokens, output_tokens, credit_usage)
             
-            cursor.close()
-            db.disconnect()
+            # 乐观扣减本地缓存余额
+            CreditBalanceCache.debit(user_id, credit_usage)
             
             return True
             
@@ -732,62 +1128,52 @@ class UserOperations:
             return False
     
     @staticmethod
-    def get_credit_usage_history(user_id):
-        """获取用户credit使用历史"""
+    def get_credit_usage_history(user_id, limit=None, before=None):
+        """获取用户credit使用历史（按时间倒序）
+
+        Args:
+            user_id: 用户ID
+            limit: 返回条数，None表示全部
+            before: 上一页最后一条记录的(created_at, id)，用于分页
+        """
         try:
-            history_file = UserOperations.get_llm_history_file()
-            if not history_file.exists():
-                return []
-            
-            history = []
-            with open(history_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row['user_id'] == str(user_id):
-                        history.append({
-                            'assignment': row['assignment'],
-                            'input_token_usage': int(row['input_token_usage']),
-                            'output_token_usage': int(row['output_token_usage']),
-                            'credit_usage': float(row['credit_usage']),
-                            'created_at': row['created_at']
-                        })
-            
-            # 按时间倒序排序
-            history.sort(key=lambda x: x['created_at'], reverse=True)
-            
-            return history
-            
+            return UsageStore.get_instance().query_records(user_id, limit=limit, before=before)
         except Exception as e:
             print(f"获取credit使用历史错误: {e}")
             return []
     
+    @staticmethod
+    def count_credit_usage_history(user_id):
+        """获取用户credit使用记录总数"""
+        try:
+            return UsageStore.get_instance().count_records(user_id)
+        except Exception as e:
+            print(f"获取credit使用记录数错误: {e}")
+            return 0
+    
+    @staticmethod
+    def get_credit_usage_summary(user_id, days=7):
+        """获取用户用量汇总：累计总量、按任务类型/模型分组、最近days天的每日用量"""
+        try:
+            store = UsageStore.get_instance()
+            since_day = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+            return {
+                'totals': store.get_totals(user_id),
+                'by_assignment': store.get_breakdown(user_id, by='assignment'),
+                'by_model': store.get_breakdown(user_id, by='model'),
+                'daily': store.get_daily_series(user_id, since_day=since_day)
+            }
+        except Exception as e:
+            print(f"获取credit用量汇总错误: {e}")
+            return None
+    
     @staticmethod
     def clear_credit_usage_history(user_id):
         """清空用户credit使用历史"""
         try:
-            history_file = UserOperations.get_llm_history_file()
-            if not history_file.exists():
-                return True
-            
-            # 读取所有历史记录
-            all_history = []
-            with open(history_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                header = reader.fieldnames
-                for row in reader:
-                    all_history.append(row)
-            
-            # 过滤掉指定用户的历史记录
-            filtered_history = [row for row in all_history if row['user_id'] != str(user_id)]
-            
-            # 写回过滤后的历史记录
-            with open(history_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=header)
-                writer.writeheader()
-                writer.writerows(filtered_history)
-            
+            UsageStore.get_instance().delete_user_records(user_id)
             return True
             
         except Exception as e:
             print(f"清空credit使用历史错误: {e}")
-            return False
\ No newline at end of file
+            return False